@@ -0,0 +1,216 @@
+import calendar
+import threading
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import budget_logic
+import tracing
+
+# How many recent alert events are kept for sessions to catch up on
+MAX_EVENTS = 100
+EPOCH_ORDINAL = 719163 # date(1970, 1, 1).toordinal()
+
+
+def _ordinals(dates: pd.Series) -> np.ndarray:
+    # Day ordinals (as date.toordinal()) without a Python call per row
+    return dates.to_numpy(dtype="datetime64[D]").astype(np.int64) + EPOCH_ORDINAL
+
+
+class AlertEngine:
+    """
+    Keeps running spend totals per (month, category) and per (day, category) and
+    re-checks only the rules of the category a new transaction lands in:
+    Alert_Threshold crossed, Monthly_Limit exceeded, and today's spend above the
+    daily pace that keeps the category within its limit.
+    Each (kind, category, period) alert fires once. Only the current month alerts;
+    older rows (late entries, imports) just update the totals.
+
+    Sheet rows arrive through observe(); rows still in the write-behind journal are
+    held apart by journal id (add_pending) until settle() sees them shipped, so a
+    row is never counted twice once it comes back from the sheet.
+    """
+
+    def __init__(self, rules_df: pd.DataFrame = None):
+        self.rules = {}     # category -> (limit, threshold)
+        self.months = {}    # (year, month, category) -> spent
+        self.days = {}      # (day ordinal, category) -> spent, current month only
+        self.pending = {}   # journal id -> (year, month, day ordinal, category, amount)
+        self.fired = set()  # (kind, category, period) already alerted
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.seq = 0
+        self.month = None   # (year, month) the day totals belong to
+        self.seeded = False
+        self._rules_df = None # Frame the rules were read from
+        self._lock = threading.Lock()
+        if rules_df is not None:
+            self.set_rules(rules_df)
+
+    def set_rules(self, rules_df: pd.DataFrame):
+        if rules_df is self._rules_df:
+            return # The same cached frame as last time: every rerun passes it
+        if rules_df.empty:
+            rules = {}
+        else:
+            thresholds = rules_df["Alert_Threshold"] if "Alert_Threshold" in rules_df.columns else np.nan
+            rules = dict(zip(
+                rules_df["Category"].astype(str),
+                zip(rules_df["Monthly_Limit"].astype(float), pd.Series(thresholds, index=rules_df.index).astype(float)),
+            ))
+        with self._lock:
+            self.rules, self._rules_df = rules, rules_df
+
+    @tracing.traced("alerts.seed")
+    def seed(self, df: pd.DataFrame, today=None):
+        """
+        Loads totals from the synced transactions (without journal rows) without alerting:
+        conditions already true count as fired, so only crossings from now on produce events.
+        """
+        today = pd.Timestamp(today if today is not None else datetime.today()).normalize()
+        rollup = budget_logic.build_rollup(df)
+        months = {(int(y), int(m), str(c)): float(v) for (y, m, c), v in rollup.items()}
+
+        days = {}
+        if not df.empty:
+            dates = pd.to_datetime(df["Date"], errors="coerce")
+            in_month = ((dates.dt.year == today.year) & (dates.dt.month == today.month)).to_numpy()
+            if in_month.any():
+                keyed = pd.DataFrame({
+                    "Day": _ordinals(dates[in_month]),
+                    "Category": df["Category"].astype(str).to_numpy()[in_month],
+                    "Amount": budget_logic.money(df)[in_month].to_numpy(),
+                })
+                days = {(int(d), c): float(v) for (d, c), v in keyed.groupby(["Day", "Category"])["Amount"].sum().items()}
+
+        with self._lock:
+            self.months, self.days, self.month = months, days, (today.year, today.month)
+            for row in self.pending.values():
+                self._add(*row)
+            for category in {c for y, m, c in months if (y, m) == (today.year, today.month)} | set(self.rules):
+                self.fired.update(event["key"] for event in self._check(category, today))
+            self.seeded = True
+
+    def _add(self, year: int, month: int, day: int, category: str, amount: float):
+        self.months[(year, month, category)] = self.months.get((year, month, category), 0.0) + amount
+        if day is not None:
+            self.days[(day, category)] = self.days.get((day, category), 0.0) + amount
+
+    def _check(self, category: str, today: pd.Timestamp) -> list:
+        """
+        Alerts for one category this month, fired or not. O(1): three dict lookups.
+        """
+        rule = self.rules.get(category)
+        if rule is None:
+            return []
+        limit, threshold = rule
+        period = f"{today.year:04d}-{today.month:02d}"
+        spent = self.months.get((today.year, today.month, category), 0.0)
+        events = []
+        if spent > limit:
+            events.append(("limit", f"{category} is over its limit: €{spent:.2f} of €{limit:.2f} this month."))
+        elif not np.isnan(threshold) and spent >= threshold:
+            events.append(("threshold", f"{category} crossed its alert threshold: €{spent:.2f} of €{limit:.2f} this month."))
+
+        # Today's pace: what is left before today, spread over the days left including today
+        spent_today = self.days.get((today.toordinal(), category), 0.0)
+        days_left = calendar.monthrange(today.year, today.month)[1] - today.day + 1
+        allowance = (limit - (spent - spent_today)) / days_left
+        if allowance > 0 and spent_today > allowance and spent <= limit:
+            events.append(("pace", f"{category}: €{spent_today:.2f} spent today, above the €{allowance:.2f}/day pace for its limit."))
+
+        return [{
+            "key": (kind, category, period if kind != "pace" else str(today.date())),
+            "kind": kind, "category": category, "spent": round(spent, 2), "limit": limit, "message": message,
+        } for kind, message in events]
+
+    def _emit(self, categories: set, today: pd.Timestamp) -> list:
+        emitted = []
+        for category in categories:
+            for event in self._check(category, today):
+                if event["key"] in self.fired:
+                    continue
+                self.fired.add(event["key"])
+                self.seq += 1
+                event["seq"] = self.seq
+                self.events.append(event)
+                emitted.append(event)
+        if emitted:
+            tracing.count("alerts.fired", len(emitted))
+        return emitted
+
+    def _keys(self, df: pd.DataFrame, today: pd.Timestamp) -> list:
+        # (year, month, day ordinal or None, category, amount) per row; days only kept for this month
+        dates = pd.to_datetime(df["Date"], errors="coerce")
+        valid = dates.notna().to_numpy()
+        dates = dates[valid]
+        years, months = dates.dt.year.to_numpy(), dates.dt.month.to_numpy()
+        ordinals = _ordinals(dates)
+        current = (years == today.year) & (months == today.month)
+        return list(zip(
+            years.tolist(), months.tolist(), np.where(current, ordinals, None).tolist(),
+            df["Category"].astype(str).to_numpy()[valid].tolist(), budget_logic.money(df)[valid].tolist(),
+        ))
+
+    def _roll_over(self, today: pd.Timestamp):
+        # A new month: last month's day totals can no longer alert
+        if self.month != (today.year, today.month):
+            self.days, self.month = {}, (today.year, today.month)
+
+    def observe(self, df: pd.DataFrame, today=None) -> list:
+        """
+        Folds rows that reached the sheet into the totals and returns the new alert events.
+        """
+        today = pd.Timestamp(today if today is not None else datetime.today()).normalize()
+        if df.empty:
+            return []
+        rows = self._keys(df, today)
+        with self._lock:
+            if not self.seeded:
+                return [] # seed() will count them
+            self._roll_over(today)
+            for year, month, day, category, amount in rows:
+                self._add(year, month, day, category, amount)
+            return self._emit({row[3] for row in rows if (row[0], row[1]) == (today.year, today.month)}, today)
+
+    def add_pending(self, txn_id: str, df: pd.DataFrame, today=None) -> list:
+        """
+        Counts a row still waiting in the write-behind journal and returns the new alert events.
+        """
+        return self.add_pending_many([txn_id], df, today)
+
+    def add_pending_many(self, txn_ids: list, df: pd.DataFrame, today=None) -> list:
+        """
+        add_pending for several journal rows in one pass; df holds their validated rows, in txn_ids order.
+        """
+        today = pd.Timestamp(today if today is not None else datetime.today()).normalize()
+        rows = self._keys(df, today)
+        with self._lock:
+            new = [(txn_id, row) for txn_id, row in zip(txn_ids, rows) if txn_id not in self.pending]
+            for txn_id, row in new:
+                self.pending[txn_id] = row
+            if not self.seeded or not new:
+                return []
+            self._roll_over(today)
+            for _, row in new:
+                self._add(*row)
+            return self._emit({row[3] for _, row in new if row[:2] == (today.year, today.month)}, today)
+
+    def settle(self, pending_ids):
+        """
+        Forgets journal rows no longer pending: they were shipped and come back through observe().
+        """
+        pending_ids = set(pending_ids)
+        with self._lock:
+            for txn_id in [txn_id for txn_id in self.pending if txn_id not in pending_ids]:
+                year, month, day, category, amount = self.pending.pop(txn_id)
+                if self.seeded:
+                    self._add(year, month, day if (day, category) in self.days else None, category, -amount)
+
+    def events_since(self, seq: int = 0) -> list:
+        """
+        Alert events newer than `seq` (oldest first), for sessions catching up.
+        """
+        with self._lock:
+            return [event for event in self.events if event["seq"] > seq]
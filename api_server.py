@@ -0,0 +1,226 @@
+import argparse
+import asyncio
+import json
+import math
+from datetime import date
+
+import pandas as pd
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Route
+
+import browser
+import budget_logic
+import dashboard_snapshot
+import data_manager
+import schema
+import tracing
+
+# POSTs arriving within this many seconds of each other are saved together
+BATCH_WINDOW = 0.005
+MAX_BATCH = 500
+MAX_PAGE = 100
+
+
+def _plain(value):
+    # JSON for numpy scalars, timestamps and NaN (null)
+    if isinstance(value, pd.Timestamp):
+        return value.strftime("%Y-%m-%d")
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def _records(df: pd.DataFrame) -> list:
+    return [{col: _plain(value) for col, value in row.items()} for row in df.to_dict(orient="records")]
+
+
+def _json(payload, status: int = 200) -> Response:
+    return Response(json.dumps(payload, default=_plain), status_code=status, media_type="application/json")
+
+
+# --- Read endpoints: (df, rules, query) -> JSON-ready payload ---
+def stats(df: pd.DataFrame, rules: pd.DataFrame, query: dict) -> dict:
+    limit = float(query.get("limit", budget_logic.TOTAL_BUDGET))
+    return {key: _plain(value) for key, value in budget_logic.calculate_burn_rate(df, limit=limit, rollup=data_manager.get_rollup()).items()}
+
+
+def categories(df: pd.DataFrame, rules: pd.DataFrame, query: dict) -> list:
+    status = budget_logic.check_category_limits(df, rules, rollup=data_manager.get_rollup())
+    return _records(status[dashboard_snapshot.CATEGORY_COLUMNS]) if not status.empty else []
+
+
+def transactions(df: pd.DataFrame, rules: pd.DataFrame, query: dict) -> dict:
+    if df.empty:
+        return {"transactions": [], "next": None}
+    after = tuple(int(part) for part in query["after"].split("-")) if query.get("after") else None
+    page, cursor = browser.get_index(df, data_manager.get_derived_cache()).page(
+        start=query.get("start"), end=query.get("end"), category=query.get("category"),
+        currency=query.get("currency"), text=query.get("text"), after=after,
+        limit=min(int(query.get("count", 10)), MAX_PAGE),
+    )
+    rows = schema.to_display(page)[schema.DISPLAY_COLUMNS]
+    return {"transactions": _records(rows), "next": f"{cursor[0]}-{cursor[1]}" if cursor else None}
+
+
+def _respond(budget: str, name: str, render, query: dict) -> bytes:
+    """
+    The response body, or None for an unknown budget. Rendered once per data version, rules,
+    day and query, and kept in the budget's derived cache (see tenants.Tenant) under its memory cap.
+    Only waits on the network while the budget is not loaded yet.
+    """
+    with data_manager.use_tenant(budget):
+        if data_manager.current_tenant() is None:
+            return None
+        df, rules = data_manager.load_data() # Shared dataset cache: served from memory once warm
+        rendered = []
+
+        def build():
+            rendered.append(name)
+            return json.dumps(render(df, rules, query), default=_plain).encode()
+
+        # Content keys (see budget_logic.fingerprint) are small and hashed once per loaded version
+        key = (name, budget_logic.fingerprint(rules), date.today(), tuple(sorted(query.items())))
+        body = data_manager.get_derived_cache().get(budget_logic.fingerprint(df), key, build)
+    if not rendered:
+        tracing.count("api.cache_hits")
+    return body
+
+
+def read_endpoint(name: str, render):
+    async def endpoint(request):
+        query = dict(request.query_params)
+        budget = query.pop("budget", None)
+        try:
+            # Loading can re-overlay pending rows and rendering is O(rows): both stay off the event loop
+            body = await asyncio.to_thread(_respond, budget, name, render, query)
+        except (ValueError, KeyError) as e:
+            return _json({"error": f"Bad query: {e}"}, 400)
+        if body is None:
+            return _json({"error": "Unknown budget"}, 404)
+        return Response(body, media_type="application/json")
+    return endpoint
+
+
+# --- Writes ---
+class WriteBatcher:
+    """
+    Groups POSTed transactions arriving within `window` seconds (at most max_batch)
+    into one data_manager.add_transactions call per budget: one idempotency
+    transaction and one journal fsync for the lot instead of one per request.
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW, max_batch: int = MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._waiting = [] # (budget, entry, future)
+        self._timer = None
+        self._saving = set() # Keeps running batch tasks referenced
+
+    async def submit(self, budget: str, entry: tuple) -> bool:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiting.append((budget, entry, future))
+        if len(self._waiting) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._waiting = self._waiting, []
+        if batch:
+            task = asyncio.ensure_future(self._save(batch))
+            self._saving.add(task)
+            task.add_done_callback(self._saving.discard)
+
+    async def _save(self, batch: list):
+        by_budget = {}
+        for budget, entry, future in batch:
+            by_budget.setdefault(budget, []).append((entry, future))
+        for budget, items in by_budget.items():
+            with tracing.span("api.save_batch", rows=len(items)):
+                try:
+                    results = await asyncio.to_thread(_add_all, budget, [entry for entry, _ in items])
+                except Exception as e:
+                    tracing.record_error("API save", e)
+                    results = [False] * len(items)
+            for (_, future), saved in zip(items, results):
+                if not future.done():
+                    future.set_result(saved)
+
+
+def _add_all(budget: str, entries: list) -> list:
+    with data_manager.use_tenant(budget):
+        return data_manager.add_transactions(entries)
+
+
+def parse_transaction(payload: dict) -> tuple:
+    """
+    add_transaction arguments from a POSTed JSON object; raises ValueError when invalid.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("expected a JSON object")
+    day = pd.Timestamp(payload.get("date") or date.today()).date()
+    amount = float(payload["amount"])
+    currency = str(payload.get("currency", "EUR")).upper()
+    category = str(payload["category"])
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError("amount must be positive")
+    if currency not in budget_logic.RATES:
+        raise ValueError(f"unknown currency {currency}")
+    amount_eur = budget_logic.normalize_currency(amount, currency, day) # Rate in effect on that day
+    return (day, amount, currency, category, str(payload.get("description", "")), amount_eur, payload.get("key"))
+
+
+def build_app(batcher: WriteBatcher = None) -> Starlette:
+    """
+    The JSON API: GET /api/stats, /api/categories, /api/transactions and POST /api/transactions.
+    Every endpoint takes ?budget=<id> when several budgets are hosted (see tenants.json).
+    """
+    batcher = batcher or WriteBatcher()
+
+    async def add(request):
+        budget = request.query_params.get("budget")
+        with data_manager.use_tenant(budget):
+            if data_manager.current_tenant() is None:
+                return _json({"error": "Unknown budget"}, 404)
+        try:
+            entry = parse_transaction(await request.json())
+        except (ValueError, KeyError, TypeError) as e:
+            return _json({"error": f"Bad transaction: {e}"}, 400)
+        if entry[-1] is None and request.headers.get("Idempotency-Key"):
+            entry = entry[:-1] + (request.headers["Idempotency-Key"],)
+        if await batcher.submit(budget, entry):
+            return _json({"saved": True}, 201)
+        return _json({"saved": False, "error": "Could not save; retry with the same key"}, 503)
+
+    return Starlette(routes=[
+        Route("/api/stats", read_endpoint("stats", stats)),
+        Route("/api/categories", read_endpoint("categories", categories)),
+        Route("/api/transactions", read_endpoint("transactions", transactions), methods=["GET"]),
+        Route("/api/transactions", add, methods=["POST"]),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve budget stats and accept transactions as JSON over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on (default: local only)")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args()
+
+    if data_manager.current_tenant() is not None:
+        print("Loading budget data...")
+        data_manager.load_data() # Warm the default budget before the first request
+    print(f"Serving on http://{args.host}:{args.port}/api/stats")
+    uvicorn.run(build_app(), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
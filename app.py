@@ -1,9 +1,19 @@
 # import budget_logic # Will be created later
 # import data_manager # Will be created later
+import time
+from datetime import timedelta
 import streamlit as st
 import pandas as pd
+import browser
 import budget_logic
 import data_manager
+import forecast
+import reports
+import schema
+import tracing
+
+# Collect timings for this rerun (shown in the optional debug panel)
+trace = tracing.start_trace("rerun")
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -13,6 +23,11 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Hosted budgets are picked by the ?budget= link parameter
+if data_manager.current_tenant() is None:
+    st.error("This link does not open a budget. Ask for your personal link.")
+    st.stop()
+
 # --- Theme Toggle & Settings ---
 if "theme" not in st.session_state:
     st.session_state.theme = "dark"
@@ -36,9 +51,21 @@ with st.sidebar:
     
     st.divider()
     if st.button("🔄 Refresh Data"):
-        st.cache_data.clear()
+        data_manager.reset_cache() # Full resync picks up edits made directly in the sheet
         st.rerun()
 
+    # Write-behind queue state
+    sync = data_manager.get_sync_status()
+    if sync["pending"]:
+        st.caption(f"⏳ {sync['pending']} transaction(s) waiting to sync")
+        if sync["last_error"]:
+            st.caption(f":red[Last sync attempt failed: {sync['last_error']}]")
+        if st.button("⬆️ Sync Now"):
+            data_manager.flush_pending()
+            st.rerun()
+    else:
+        st.caption(f"✅ All transactions synced ({sync['flushed']} flushed since startup)")
+
 # --- Dynamic CSS Injection (Polished) ---
 if st.session_state.theme == "dark":
     bg_color = "#0E1117"
@@ -79,13 +106,55 @@ st.markdown(f"""
 # --- Header Section ---
 st.title("💶 Erasmus Budget")
 
+def render_snapshot(state: dict):
+    """
+    Read-only dashboard from a saved snapshot (see dashboard_snapshot.build).
+    """
+    stats = state["stats"]
+    st.caption(f"🕒 Last saved dashboard ({state['saved_at'].replace('T', ' ')}), refreshing...")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Budget Left", f"€{stats['remaining']}", f"{stats['percent_used']}% Used", delta_color="inverse")
+    col2.metric("Daily Limit", f"€{stats['daily_limit']}")
+    col3.metric("Days Left", f"{stats['days_left']}")
+    st.progress(min(stats['percent_used'] / 100, 1.0))
+    if state["trend"]:
+        st.subheader("Spending Trends")
+        st.line_chart(pd.DataFrame(state["trend"]), x="Date", y="Amount_EUR")
+    if state["categories"]:
+        st.subheader("Category Breakdown")
+        st.dataframe(pd.DataFrame(state["categories"]), hide_index=True, use_container_width=True)
+    if state["projected"] is not None:
+        st.caption(f"Projected month-end spend: €{state['projected']:.2f} of €{state['limit']:.2f}")
+    if state["recent"]:
+        st.subheader("Recent Activity")
+        st.dataframe(pd.DataFrame(state["recent"]), hide_index=True, use_container_width=True)
+
+# Cold start: paint the last saved dashboard (marked stale) while the sheet loads
+first_paint = st.empty()
+if not data_manager.is_loaded():
+    last = data_manager.last_dashboard()
+    if last:
+        with first_paint.container():
+            render_snapshot(last)
+
 # Load Data
-with st.spinner("Syncing..."):
-    df = data_manager.get_transactions()
-    rules = data_manager.get_budget_rules()
+with st.spinner("Syncing..."), tracing.span("app.load") as load_span:
+    df, rules = data_manager.load_data() # One round trip for both tabs
+    rollup = data_manager.get_rollup() # Kept current on every sync
+    load_span["rows"] = len(df)
+derived = data_manager.get_derived_cache() # This budget's indexes and daily totals, built once per data version
+first_paint.empty()
+
+bad_rows = data_manager.get_bad_rows()
+if not bad_rows.empty:
+    st.warning(f"Skipped {len(bad_rows)} malformed row(s) in the sheet (rows {', '.join(map(str, bad_rows['Row'].head(10)))}).")
+
+# Budget rule alerts raised by new transactions since this session last looked
+for event in data_manager.new_alerts():
+    st.toast(event["message"], icon="🚨" if event["kind"] == "limit" else "⚠️")
     
 # Calculate Metrics
-stats = budget_logic.calculate_burn_rate(df, limit=total_budget)
+stats = budget_logic.calculate_burn_rate(df, limit=total_budget, rollup=rollup)
 
 # Color Logic for Metric (Inverse: High Usage = Red)
 delta_color = "normal" 
@@ -121,6 +190,19 @@ st.progress(min(stats['percent_used'] / 100, 1.0))
 if stats['percent_used'] > 100:
     st.caption(":red[Over Budget!]")
 
+# How the month went so far, one cumulative pass for all days
+with st.expander("📅 Day by Day", expanded=False):
+    with tracing.span("app.burn_rate_history"):
+        history = budget_logic.burn_rate_history(df, limit=total_budget, cache=derived)
+    today = pd.Timestamp.today().normalize()
+    st.line_chart(history.loc[:today, ["remaining", "daily_limit"]])
+    day = st.slider("Day of month", 1, today.day, today.day) if today.day > 1 else 1
+    past = history.iloc[day - 1]
+    st.caption(
+        f"On day {day}: €{past['total_spent']} spent, €{past['remaining']} left, "
+        f"€{past['daily_limit']}/day to last the month ({past['status']})"
+    )
+
 # Warnings
 if stats['status'] == "CRITICAL":
     st.error("🚨 CRITICAL: You have exceeded your budget!")
@@ -139,10 +221,9 @@ with st.expander("➕ Add Transaction", expanded=False):
         
         submitted = st.form_submit_button("Save Transaction", type="primary")
         if submitted:
-            amount_eur = budget_logic.normalize_currency(amount, currency)
+            amount_eur = budget_logic.normalize_currency(amount, currency, date) # Rate in effect on that day
             if data_manager.add_transaction(date, amount, currency, category, desc, amount_eur):
-                st.success(f"Added {amount} {currency} ({amount_eur} EUR)")
-                st.cache_data.clear() # Clear cache to refresh data next time (if we used cache_data)
+                st.success(f"Added {amount} {currency} ({amount_eur} EUR), syncing in background")
                 st.rerun()
             else:
                 st.error("Failed to save transaction.")
@@ -151,13 +232,22 @@ with st.expander("➕ Add Transaction", expanded=False):
 st.subheader("Spending Trends")
 
 if not df.empty:
-    # Daily Spending Trend
-    daily_trend = df.groupby("Date")["Amount_EUR"].sum().reset_index()
-    st.line_chart(daily_trend, x="Date", y="Amount_EUR")
+    # Spending trend over a window, at most TREND_MAX_POINTS points whatever the history length
+    first_day, last_day = df["Date"].min().date(), df["Date"].max().date()
+    col_res, col_window = st.columns([1, 2])
+    resolution = col_res.radio("Resolution", list(budget_logic.TREND_RESOLUTIONS), horizontal=True)
+    window = col_window.date_input(
+        "Window", value=(max(first_day, last_day - timedelta(days=90)), last_day),
+        min_value=first_day, max_value=last_day,
+    )
+    start, end = (window[0], window[-1]) if window else (first_day, last_day)
+    with tracing.span("app.trend_prep", rows=len(df)):
+        trend = budget_logic.spending_trend(df, resolution, start, end, cache=derived)
+    st.line_chart(trend, x="Date", y="Amount_EUR")
 
 st.subheader("Category Breakdown")
 if not df.empty and not rules.empty:
-    merged_status = budget_logic.check_category_limits(df, rules)
+    merged_status = budget_logic.check_category_limits(df, rules, rollup=rollup)
     
     if not merged_status.empty:
         # Simple Bar Chart for Categories
@@ -176,17 +266,119 @@ if not df.empty and not rules.empty:
             use_container_width=True
         )
 
+    # Month-end projection, computed once per data version and day
+    projection = forecast.forecast_month(df, rules, history=data_manager.get_archived_history(), cache=derived)
+    st.caption(f"Projected month-end spend: €{projection['Projected'].sum():.2f} of €{total_budget:.2f}")
+    overruns = projection[projection["Status"] == "Overrun"]
+    for _, row in overruns.iterrows():
+        st.warning(f"📈 {row['Category']} is on track for €{row['Projected']:.2f}, €{row['Projected_Overrun']:.2f} over its limit.")
+    with st.expander("📈 Month-End Forecast", expanded=False):
+        st.dataframe(
+            projection[["Category", "Spent", "Recurring_Expected", "Variable_Forecast", "Projected", "Monthly_Limit", "Status"]],
+            hide_index=True,
+            use_container_width=True
+        )
+
 # --- Recent Transactions (Bottom Layer) ---
 st.subheader("Recent Activity")
 if not df.empty:
-    # Sort by Date descending
-    df_display = df.sort_values(by="Date", ascending=False).head(10)
+    index = browser.get_index(df, derived) # Built once per data version
+    with st.expander("🔎 Search & Filter"):
+        col_text, col_cat, col_cur = st.columns([2, 1, 1])
+        text = col_text.text_input("Description")
+        category = col_cat.selectbox("Category", ["All"] + sorted(index.postings["Category"]))
+        currency = col_cur.selectbox("Currency", ["All"] + sorted(index.postings["Currency"]))
+        period = st.date_input(
+            "Dates", value=(), min_value=pd.Timestamp(index.dates[0]).date(), max_value=pd.Timestamp(index.dates[-1]).date()
+        )
+
+    # Keyset cursors of the pages visited so far; new filters start over at the newest page
+    filters = (text, category, currency, tuple(period))
+    if st.session_state.get("browser_filters") != filters:
+        st.session_state.browser_filters = filters
+        st.session_state.browser_cursors = [None]
+    cursors = st.session_state.browser_cursors
+
+    with tracing.span("app.recent_activity", rows=len(df)):
+        page, next_cursor = index.page(
+            start=period[0] if period else None,
+            end=period[-1] if period else None,
+            category=None if category == "All" else category,
+            currency=None if currency == "All" else currency,
+            text=text or None,
+            after=cursors[-1],
+        )
+        df_display = schema.to_display(page)
     st.dataframe(
         df_display[["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"]], 
         use_container_width=True, 
         hide_index=True
     )
+    col_newer, col_older = st.columns(2)
+    if col_newer.button("← Newer", disabled=len(cursors) == 1, use_container_width=True):
+        cursors.pop()
+        st.rerun()
+    if col_older.button("Older →", disabled=next_cursor is None, use_container_width=True):
+        cursors.append(next_cursor)
+        st.rerun()
 else:
     st.info("No transactions yet.")
 
+# --- Monthly Reports ---
+if rollup is not None and not rollup.empty:
+    report_months = sorted({f"{year}-{month:02d}" for year, month, _ in rollup.index}, reverse=True)
+else:
+    report_months = sorted(df["Date"].dt.strftime("%Y-%m").unique(), reverse=True) if not df.empty else []
+
+@st.fragment(run_every=1)
+def report_progress(job):
+    # Polls the background job without rerunning the whole dashboard
+    finished, total = job.progress()
+    st.progress(finished / total if total else 1.0, text=f"Rendered {finished} of {total} reports")
+    if job.done:
+        st.rerun(scope="app")
+
+with st.expander("🧾 Monthly Reports", expanded=False):
+    col_months, col_fmt = st.columns([3, 1])
+    chosen = col_months.multiselect("Months", report_months, default=report_months[:1])
+    fmt = col_fmt.radio("Format", ["pdf", "png"], format_func=str.upper, horizontal=True)
+    if st.button("Generate reports", disabled=not chosen):
+        data_manager.start_reports(chosen, fmt, total_budget)
+    job = data_manager.get_report_job()
+    if job is not None and not job.done:
+        report_progress(job)
+    elif job is not None:
+        for month in job.months:
+            if month in job.paths:
+                try:
+                    with open(job.paths[month], "rb") as f:
+                        report = f.read()
+                except OSError: # Superseded by a newer render of the same month
+                    st.info(f"The {month} report changed since; generate it again.")
+                    continue
+                st.download_button(
+                    f"⬇️ {month} ({job.fmt.upper()})", report, file_name=f"budget-report-{month}.{job.fmt}",
+                    mime=reports.FORMATS[job.fmt], key=f"report-{month}-{job.fmt}",
+                )
+            else:
+                st.error(f"Report for {month} failed: {job.errors.get(month)}")
 
+# What the next cold start paints first (kept as is when loading failed)
+data_manager.save_dashboard(df, rules, rollup, total_budget)
+
+# --- Debug Panel (Sidebar) ---
+with st.sidebar:
+    st.divider()
+    if st.toggle("🐞 Debug timings", value=False):
+        st.caption(f"Rerun total: {(time.time() - trace.started) * 1000:.0f} ms")
+        if trace.spans:
+            st.dataframe(pd.DataFrame(trace.spans), hide_index=True, use_container_width=True)
+        st.json(trace.counters)
+        st.caption("Dataset cache")
+        st.json(data_manager.get_dataset_cache().status())
+        st.caption("Hosted budgets")
+        st.json(data_manager.get_tenants().status())
+        if trace.errors:
+            st.json(trace.errors)
+        st.download_button("Export JSON", tracing.export_json(trace), file_name="trace.json")
+        st.download_button("Export Prometheus", tracing.export_prometheus(), file_name="metrics.prom")
@@ -0,0 +1,171 @@
+import argparse
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import browser
+import budget_logic
+import forecast
+import local_cache
+import schema
+import setup_sheet
+from fake_sheets import FakeClient
+from storage import DEFAULT_RULES, RULES_HEADER, SheetsBackend
+
+# Rough Erasmus spending mix: (category, share of transactions, median EUR, spread)
+CATEGORY_PROFILE = [
+    ("Food", 0.55, 9.0, 0.6),
+    ("Fun", 0.20, 15.0, 0.7),
+    ("Travel", 0.10, 45.0, 0.9),
+    ("Other", 0.13, 12.0, 0.8),
+    ("Rent", 0.02, 380.0, 0.1),
+]
+CURRENCY_MIX = {"EUR": 0.5, "CZK": 0.2, "PLN": 0.1, "HUF": 0.08, "GBP": 0.05, "USD": 0.05, "MXN": 0.02}
+
+def generate_transactions(n: int, seed: int = 0, start: str = "2022-09-01", days: int = 3 * 365) -> pd.DataFrame:
+    """
+    Seeded synthetic history shaped like data_manager.get_transactions() output.
+    """
+    rng = np.random.default_rng(seed)
+    names, shares, medians, spreads = zip(*CATEGORY_PROFILE)
+    picks = rng.choice(len(names), size=n, p=np.array(shares) / sum(shares))
+    amount_eur = np.round(np.exp(np.log(np.array(medians))[picks] + rng.normal(size=n) * np.array(spreads)[picks]), 2)
+
+    currencies = rng.choice(list(CURRENCY_MIX), size=n, p=list(CURRENCY_MIX.values()))
+    rates = pd.Series(currencies).map(budget_logic.RATES).to_numpy()
+    dates = pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, days, size=n)), unit="D")
+
+    return pd.DataFrame({
+        "Date": dates,
+        "Amount_Cents": np.round(amount_eur / rates * 100).astype("int64"),
+        "Currency": pd.Categorical(currencies),
+        "Category": pd.Categorical.from_codes(picks, names),
+        "Description": "synthetic",
+        "Amount_EUR_Cents": np.round(amount_eur * 100).astype("int64"),
+    }).astype(schema.TRANSACTION_DTYPES)
+
+def to_sheet_rows(df: pd.DataFrame) -> list:
+    """
+    Rows as a sheet would store them (column order of TRANSACTION_HEADER).
+    """
+    return schema.to_sheet_rows(df)
+
+def measure(fn, *args, repeat: int = 3, setup=None, **kwargs) -> dict:
+    """
+    Best wall time over `repeat` runs plus peak traced memory of one run.
+    `setup` runs untimed before each run, e.g. clear_derived_caches to time a build rather than a cache hit.
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn(*args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": min(timings), "peak_mb": round(peak / 2**20, 2)}
+
+def clear_derived_caches():
+    """
+    Forgets everything computed per data version (content keys, daily totals, indexes, forecasts).
+    """
+    budget_logic._fingerprints.clear()
+    budget_logic._daily_spend_cache.clear()
+    browser._index_cache.clear()
+    forecast._forecast_cache.clear()
+
+# --- Stages mirrored from app.py ---
+def trend_prep(df: pd.DataFrame) -> pd.DataFrame:
+    return budget_logic.spending_trend(df, "Day", df["Date"].max() - pd.Timedelta(days=90), df["Date"].max())
+
+def recent_activity(df: pd.DataFrame) -> pd.DataFrame:
+    return schema.to_display(browser.get_index(df).page()[0])
+
+def run_pipeline(backend, limit: float = budget_logic.TOTAL_BUDGET) -> dict:
+    """
+    load -> compute -> render prep, the same work one app.py rerun does.
+    """
+    df, rules = backend.load_data()
+    rollup = backend.get_rollup()
+    stats = budget_logic.calculate_burn_rate(df, limit=limit, rollup=rollup)
+    status = budget_logic.check_category_limits(df, rules, rollup=rollup)
+    trend_prep(df)
+    recent_activity(df)
+    return {"rows": len(df), "stats": stats, "categories": len(status)}
+
+def bench_size(n: int, latency: float, seed: int, repeat: int) -> dict:
+    df = generate_transactions(n, seed=seed)
+    rules = pd.DataFrame(DEFAULT_RULES, columns=RULES_HEADER)
+    rollup = budget_logic.build_rollup(df)
+
+    results = {
+        "calculate_burn_rate": measure(budget_logic.calculate_burn_rate, df, repeat=repeat),
+        "calculate_burn_rate[rollup]": measure(budget_logic.calculate_burn_rate, df, rollup=rollup, repeat=repeat),
+        "check_category_limits": measure(budget_logic.check_category_limits, df, rules, repeat=repeat),
+        "check_category_limits[rollup]": measure(budget_logic.check_category_limits, df, rules, rollup=rollup, repeat=repeat),
+        "build_rollup": measure(budget_logic.build_rollup, df, repeat=repeat),
+        "convert_to_eur[dated]": measure(budget_logic.convert_to_eur, budget_logic.money(df, "Amount"), df["Currency"], df["Date"], repeat=repeat),
+        "trend_prep": measure(trend_prep, df, repeat=repeat, setup=clear_derived_caches),
+        "recent_activity": measure(recent_activity, df, repeat=repeat, setup=clear_derived_caches),
+    }
+
+    # Full pipeline against a simulated-latency sheet, cold (full sync) then warm (incremental)
+    client = FakeClient()
+    sh = client.create(setup_sheet.SHEET_NAME)
+    setup_sheet.setup_spreadsheet(sh)
+    sh.worksheet("Transactions").append_rows(to_sheet_rows(df))
+    client.latency = latency
+    previous_cache_dir = local_cache.CACHE_DIR
+    with tempfile.TemporaryDirectory() as cache_dir:
+        local_cache.CACHE_DIR = cache_dir
+        try:
+            backend = SheetsBackend(lambda: sh, setup_sheet.SHEET_NAME)
+            results["pipeline[cold]"] = measure(run_pipeline, backend, repeat=1)
+            backend.reset_cache()
+            run_pipeline(backend)
+            results["pipeline[warm]"] = measure(run_pipeline, backend, repeat=repeat)
+        finally:
+            local_cache.CACHE_DIR = previous_cache_dir
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark budget_logic and the app data pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated seconds per Sheets API call")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "latency": args.latency,
+        "results": {},
+    }
+    for n in args.sizes:
+        print(f"Benchmarking {n:,} transactions...")
+        report["results"][str(n)] = bench_size(n, args.latency, args.seed, args.repeat)
+        for name, result in report["results"][str(n)].items():
+            print(f"  {name:32s} {result['seconds'] * 1000:10.1f} ms {result['peak_mb']:10.1f} MB")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
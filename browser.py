@@ -0,0 +1,145 @@
+import re
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+import budget_logic
+import tracing
+from dataset_cache import DerivedCache
+
+TOKEN_PATTERN = re.compile(r"\w+")
+_EMPTY = np.array([], dtype=np.int64)
+
+# Indexes per data version (see budget_logic.fingerprint); process-wide fallback, the app passes each tenant's own cache
+_index_cache = DerivedCache(max_versions=4)
+
+
+def _group_positions(values: np.ndarray) -> dict:
+    # Label -> ascending positions holding it, from one stable sort of the factorized codes
+    codes, uniques = pd.factorize(values)
+    positions = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[positions], np.arange(len(uniques) + 1))
+    return {label: positions[bounds[i]:bounds[i + 1]] for i, label in enumerate(uniques)}
+
+
+class TransactionIndex:
+    """
+    Read-only indexes over a transactions frame for the transaction browser.
+    Rows are ranked by (Date, row); Category, Currency and every word of Description
+    map to sorted posting lists of ranks, so a page is found with binary searches
+    and costs time proportional to the page size, not to the history.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        dates = pd.to_datetime(df["Date"]).to_numpy(dtype="datetime64[ns]").view("int64")
+        self.order = np.argsort(dates, kind="stable") # rank -> row
+        self.dates = dates[self.order]                # sorted, for date range lookups
+        self.postings = {
+            col: _group_positions(df[col].to_numpy(dtype=object)[self.order]) for col in ("Category", "Currency")
+        }
+
+        # Text index: tokenize each distinct description once
+        by_description = _group_positions(df["Description"].to_numpy(dtype=object)[self.order])
+        token_ranks = {}
+        for description, ranks in by_description.items():
+            for token in set(TOKEN_PATTERN.findall(str(description).lower())):
+                token_ranks.setdefault(token, []).append(ranks)
+        self.tokens = {token: np.sort(np.concatenate(parts)) for token, parts in token_ranks.items()}
+        self.vocabulary = sorted(self.tokens)
+        self._prefix_postings = {} # query word -> merged postings, as users type the same words again
+
+    def nbytes(self) -> int:
+        """
+        Memory of the index itself; the frame it serves rows from is the cached dataset's.
+        """
+        arrays = [self.order, self.dates, *self.tokens.values()]
+        arrays += [ranks for postings in self.postings.values() for ranks in postings.values()]
+        return sum(array.nbytes for array in arrays)
+
+    def _rank_of(self, key: tuple) -> int:
+        # Keyset cursor (Date as int ns, row) -> its rank; stays valid as rows are appended
+        date, row = key
+        left, right = np.searchsorted(self.dates, [date, date + 1])
+        return int(left + np.searchsorted(self.order[left:right], row))
+
+    def _text_postings(self, text: str) -> list:
+        # Each query word matches every indexed word it prefixes
+        lists = []
+        for word in TOKEN_PATTERN.findall(text.lower()):
+            if word not in self._prefix_postings:
+                matches = []
+                i = bisect_left(self.vocabulary, word)
+                while i < len(self.vocabulary) and self.vocabulary[i].startswith(word):
+                    matches.append(self.tokens[self.vocabulary[i]])
+                    i += 1
+                if len(matches) > 1:
+                    self._prefix_postings[word] = np.unique(np.concatenate(matches))
+                else:
+                    self._prefix_postings[word] = matches[0] if matches else _EMPTY
+            lists.append(self._prefix_postings[word])
+        return lists
+
+    @staticmethod
+    def _newest(lists: list, lo: int, hi: int, k: int) -> np.ndarray:
+        """
+        Up to k highest ranks in [lo, hi) present in every posting list (all ranks if none given).
+        """
+        if not lists:
+            return np.arange(hi - 1, max(lo, hi - k) - 1, -1)
+        lists = sorted((ranks[np.searchsorted(ranks, lo):np.searchsorted(ranks, hi)] for ranks in lists), key=len)
+        base, others = lists[0], lists[1:]
+        found, end, chunk, total = [], len(base), k, 0
+        # Walk the shortest list backwards, probing the others, in growing chunks
+        while end > 0 and total < k:
+            candidates = base[max(0, end - chunk):end][::-1]
+            for ranks in others:
+                idx = np.searchsorted(ranks, candidates)
+                present = idx < len(ranks)
+                present[present] = ranks[idx[present]] == candidates[present]
+                candidates = candidates[present]
+            found.append(candidates)
+            total += len(candidates)
+            end, chunk = end - chunk, chunk * 2
+        return np.concatenate(found)[:k] if found else _EMPTY
+
+    @tracing.traced("browser.page")
+    def page(self, start=None, end=None, category: str = None, currency: str = None, text: str = None,
+             after: tuple = None, limit: int = 10) -> tuple:
+        """
+        Newest-first page of transactions dated start..end (inclusive days) matching every given filter.
+        Returns (page DataFrame, cursor for the next page or None). Pass the cursor back as `after`.
+        """
+        lo = 0 if start is None else int(np.searchsorted(self.dates, pd.Timestamp(start).value))
+        hi = len(self.dates)
+        if end is not None:
+            hi = int(np.searchsorted(self.dates, (pd.Timestamp(end).normalize() + pd.Timedelta(days=1)).value))
+        if after is not None:
+            hi = min(hi, self._rank_of(after))
+
+        lists = []
+        if category:
+            lists.append(self.postings["Category"].get(category, _EMPTY))
+        if currency:
+            lists.append(self.postings["Currency"].get(currency, _EMPTY))
+        if text:
+            lists.extend(self._text_postings(text))
+
+        ranks = self._newest(lists, lo, hi, limit + 1) # One extra tells whether a next page exists
+        has_more = len(ranks) > limit
+        ranks = ranks[:limit]
+        rows = self.order[ranks]
+        cursor = (int(self.dates[ranks[-1]]), int(rows[-1])) if has_more else None
+        return self.df.iloc[rows], cursor
+
+
+def get_index(df: pd.DataFrame, cache: DerivedCache = None) -> TransactionIndex:
+    """
+    Index for this version of the data, built once and reused across reruns.
+    """
+    def build():
+        with tracing.span("browser.build_index", rows=len(df)):
+            return TransactionIndex(df)
+
+    return (_index_cache if cache is None else cache).get(budget_logic.fingerprint(df), "index", build)
@@ -1,42 +1,189 @@
+import hashlib
+import os
+import weakref
 import pandas as pd
+import numpy as np
 from datetime import datetime, timedelta
+from functools import lru_cache
 import calendar
+import tracing
+from dataset_cache import DerivedCache
 
 # Hardcoded fallback limit
 TOTAL_BUDGET = 1000
 
-def normalize_currency(amount: float, currency: str) -> float:
+# Keys of the month x category spend rollup
+ROLLUP_KEYS = ["Year", "Month", "Category"]
+
+# Latest EUR rates, used for undated conversions and dates before the rate table starts
+RATES = {
+    "EUR": 1.0,
+    "CZK": 0.040, # Updated rate
+    "PLN": 0.23,
+    "GBP": 1.17,
+    "USD": 0.92,
+    "MXN": 0.054, # Approx rate
+    "HUF": 0.0026
+}
+
+# Spending trend chart: resample frequencies and the most points ever sent to the browser
+TREND_RESOLUTIONS = {"Day": "D", "Week": "W-SUN", "Month": "MS"}
+TREND_MAX_POINTS = 200
+
+# Historical rates: one row per (Date, Currency) from which a rate applies
+RATES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fx_rates.csv")
+
+@lru_cache(maxsize=4)
+def load_rate_table(path: str = RATES_FILE) -> pd.DataFrame:
     """
-    Converts input amount to EUR using fixed rates.
+    Loads the historical rate table (Date, Currency, Rate_EUR), sorted by Date for as-of joins.
     """
-    rates = {
-        "EUR": 1.0,
-        "CZK": 0.040, # Updated rate
-        "PLN": 0.23,
-        "GBP": 1.17,
-        "USD": 0.92,
-        "MXN": 0.054, # Approx rate
-        "HUF": 0.0026
-    }
-    return round(amount * rates.get(currency, 1.0), 2)
+    if not os.path.exists(path):
+        return pd.DataFrame({"Date": pd.to_datetime([]), "Currency": [], "Rate_EUR": []})
+    table = pd.read_csv(path, parse_dates=["Date"])
+    return table.sort_values("Date", kind="stable").reset_index(drop=True)
+
+@tracing.traced("budget_logic.convert_to_eur")
+def convert_to_eur(amounts, currencies, dates=None, rate_table: pd.DataFrame = None) -> np.ndarray:
+    """
+    Converts whole Amount/Currency columns to EUR in one pass.
+    With dates, each row uses the latest rate on or before its date (merge_asof);
+    rows with no dated rate fall back to RATES, unknown currencies to 1.0.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    if not len(amounts):
+        return amounts
+    # Currencies repeat heavily: resolve each distinct code once, then broadcast
+    currency_codes, currency_uniques = pd.factorize(pd.Series(currencies), use_na_sentinel=False)
+    currency_uniques = np.asarray(currency_uniques, dtype=object)
+    fallback = np.array([RATES.get(code, 1.0) for code in currency_uniques])[currency_codes]
+    if dates is None:
+        return np.round(amounts * fallback, 2)
+
+    table = load_rate_table() if rate_table is None else rate_table
+    # Memoize: look each distinct (Date, Currency) pair up once
+    dates = pd.Series(dates)
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce')
+    date_codes, date_uniques = pd.factorize(dates)
+    n_currencies = len(currency_uniques)
+    dated = date_codes >= 0 # NaT dates keep the fallback rate
+    pairs, codes = np.unique(date_codes[dated].astype(np.int64) * n_currencies + currency_codes[dated], return_inverse=True)
+    lookup = pd.DataFrame({
+        "Date": np.asarray(date_uniques)[pairs // n_currencies],
+        "Currency": currency_uniques[pairs % n_currencies],
+        "_pos": np.arange(len(pairs)),
+    }).sort_values("Date", kind="stable")
+    right = table[["Date", "Currency", "Rate_EUR"]].astype(
+        {"Date": lookup["Date"].dtype, "Currency": lookup["Currency"].dtype} # merge_asof wants identical key dtypes
+    )
+    joined = pd.merge_asof(lookup, right, on="Date", by="Currency", direction="backward")
+
+    pair_rates = np.empty(len(pairs))
+    pair_rates[joined["_pos"].to_numpy()] = joined["Rate_EUR"].to_numpy(dtype=float)
+    rates = fallback.copy()
+    rates[dated] = pair_rates[codes]
+    rates = np.where(np.isnan(rates), fallback, rates)
+    return np.round(amounts * rates, 2)
 
-def calculate_burn_rate(df: pd.DataFrame, limit: float = TOTAL_BUDGET) -> dict:
+def normalize_currency(amount: float, currency: str, date=None) -> float:
+    """
+    Converts input amount to EUR, at the rate in effect on `date` when given.
+    """
+    if date is None:
+        return round(amount * RATES.get(currency, 1.0), 2)
+    return float(convert_to_eur([amount], [currency], [date])[0])
+
+def money(df: pd.DataFrame, column: str = "Amount_EUR") -> pd.Series:
+    """
+    A money column in euros (float), read from its exact integer cents column when the frame has one
+    (see schema.py), otherwise from the plain float column.
+    """
+    cents = f"{column}_Cents"
+    if cents in df.columns:
+        return (df[cents] / 100).rename(column)
+    return df[column]
+
+def reprice_transactions(df: pd.DataFrame) -> pd.Series:
+    """
+    Recomputes Amount_EUR for a whole history with the rates of each transaction's date.
+    """
+    if df.empty:
+        return pd.Series(dtype=float, name="Amount_EUR")
+    return pd.Series(convert_to_eur(money(df, 'Amount'), df['Currency'], df['Date']), index=df.index, name="Amount_EUR")
+
+@tracing.traced("budget_logic.build_rollup")
+def build_rollup(df: pd.DataFrame) -> pd.Series:
+    """
+    Total Amount_EUR per (Year, Month, Category), as a Series with a sorted MultiIndex.
+    """
+    if df.empty or 'Date' not in df.columns or not {'Amount_EUR', 'Amount_EUR_Cents'} & set(df.columns):
+        index = pd.MultiIndex.from_arrays([[], [], []], names=ROLLUP_KEYS)
+        return pd.Series([], index=index, dtype=float, name="Amount_EUR")
+
+    dates = df['Date']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce')
+    valid = dates.notna()
+    category = df['Category'][valid] if 'Category' in df.columns else "Uncategorized"
+    # Sum exact cents when available, so totals carry no float drift
+    exact = 'Amount_EUR_Cents' in df.columns
+    keyed = pd.DataFrame({
+        "Year": dates[valid].dt.year,
+        "Month": dates[valid].dt.month,
+        "Category": category,
+        "Amount_EUR": df['Amount_EUR_Cents' if exact else 'Amount_EUR'][valid],
+    })
+    rollup = keyed.groupby(ROLLUP_KEYS, observed=True)["Amount_EUR"].sum()
+    if isinstance(rollup.index.levels[2], pd.CategoricalIndex):
+        # Plain labels, so rollups from any source merge and reindex alike
+        rollup.index = rollup.index.set_levels(rollup.index.levels[2].astype("str"), level=2)
+    rollup = rollup.sort_index()
+    return rollup / 100 if exact else rollup
+
+def merge_rollups(*rollups: pd.Series) -> pd.Series:
+    """
+    Adds rollups together, e.g. a stored rollup plus the rows of the latest sync.
+    """
+    rollups = [rollup for rollup in rollups if not rollup.empty]
+    if not rollups:
+        return build_rollup(pd.DataFrame())
+    if len(rollups) == 1:
+        return rollups[0]
+    return pd.concat(rollups).groupby(level=ROLLUP_KEYS).sum().sort_index()
+
+def update_rollup(rollup: pd.Series, new_df: pd.DataFrame) -> pd.Series:
+    """
+    Folds newly added or synced transactions into an existing rollup.
+    """
+    return merge_rollups(rollup, build_rollup(new_df))
+
+def _month_spend(rollup: pd.Series, year: int, month: int) -> pd.Series:
+    # Partial lookup on the sorted index: cost depends on categories, not history
+    try:
+        return rollup.loc[(year, month)]
+    except KeyError:
+        return pd.Series([], index=pd.Index([], name="Category"), dtype=float, name="Amount_EUR")
+
+@tracing.traced("budget_logic.calculate_burn_rate")
+def calculate_burn_rate(df: pd.DataFrame, limit: float = TOTAL_BUDGET, rollup: pd.Series = None) -> dict:
     """
     Calculates the burn rate status for the current month.
+    Pass a rollup (see build_rollup) to skip scanning the transaction history.
     """
     today = datetime.today()
     
     # Filter for current month
-    if not df.empty and 'Date' in df.columns:
-        # Ensure datetime
-        if not pd.api.types.is_datetime64_any_dtype(df['Date']):
-             df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-             
-        current_month_df = df[
-            (df['Date'].dt.month == today.month) & 
-            (df['Date'].dt.year == today.year)
-        ]
-        total_spent = current_month_df['Amount_EUR'].sum()
+    if rollup is not None:
+        total_spent = _month_spend(rollup, today.year, today.month).sum()
+    elif not df.empty and 'Date' in df.columns:
+        # Ensure datetime, without touching the caller's frame
+        dates = df['Date']
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, errors='coerce')
+
+        in_month = (dates.dt.month == today.month) & (dates.dt.year == today.year)
+        total_spent = float(money(df)[in_month].sum())
     else:
         total_spent = 0.0
 
@@ -66,27 +213,177 @@ def calculate_burn_rate(df: pd.DataFrame, limit: float = TOTAL_BUDGET) -> dict:
         "percent_used": min(100, round((total_spent / limit) * 100)) if limit > 0 else 0
     }
 
-def check_category_limits(df: pd.DataFrame, rules_df: pd.DataFrame) -> pd.DataFrame:
+@tracing.traced("budget_logic.burn_rate_history")
+def burn_rate_history(df: pd.DataFrame, limit: float = TOTAL_BUDGET, start=None, end=None,
+                      cache: DerivedCache = None) -> pd.DataFrame:
+    """
+    calculate_burn_rate as of every day of the months from start to end (inclusive; default: this month),
+    counting what was spent in the month up to and including that day.
+    One row per day indexed by Date, with the same keys as calculate_burn_rate, from one cumulative sum.
+    """
+    start = pd.Period(start if start is not None else datetime.today(), "M")
+    end = pd.Period(end, "M") if end is not None else start
+    days = pd.date_range(start.start_time, end.end_time.normalize(), freq="D", name="Date")
+
+    daily = daily_spend(df, cache).reindex(days, fill_value=0.0).to_numpy(dtype=float)
+    month = days.year * 12 + days.month
+    total_spent = pd.Series(daily).groupby(np.asarray(month)).cumsum().to_numpy()
+    remaining = limit - total_spent
+    days_left = (days.days_in_month - days.day).to_numpy()
+    daily_limit = np.divide(remaining, days_left, out=np.zeros(len(days)), where=days_left > 0)
+    percent_used = np.minimum(100, np.round(total_spent / limit * 100)) if limit > 0 else np.zeros(len(days))
+
+    return pd.DataFrame({
+        "total_spent": np.round(total_spent, 2),
+        "remaining": np.round(remaining, 2),
+        "days_left": days_left,
+        "daily_limit": np.round(daily_limit, 2),
+        "status": np.select([remaining < 0, remaining < limit * 0.1], ["CRITICAL", "WARNING"], default="OK"),
+        "percent_used": percent_used.astype(int),
+    }, index=days)
+
+def burn_rate_as_of(df: pd.DataFrame, day, limit: float = TOTAL_BUDGET) -> dict:
+    """
+    The burn rate dict as it stood at the end of `day`.
+    """
+    day = pd.Timestamp(day).normalize()
+    return burn_rate_history(df, limit, start=day, end=day).loc[day].to_dict()
+
+@tracing.traced("budget_logic.evaluate_category_limits")
+def evaluate_category_limits(df: pd.DataFrame, rules_df: pd.DataFrame, start=None, end=None,
+                             rollup: pd.Series = None) -> pd.DataFrame:
+    """
+    Spend vs limits for every rule category in every month from start to end (inclusive).
+    Defaults to the current month. One row per (Year, Month, Category), no per-row Python.
+    Status is "Exceeded" over Monthly_Limit, "Warning" at or over Alert_Threshold, else "OK".
+    """
+    if rules_df.empty:
+        return pd.DataFrame()
+    if rollup is None:
+        rollup = build_rollup(df)
+
+    start = pd.Period(start if start is not None else datetime.today(), "M")
+    end = pd.Period(end, "M") if end is not None else start
+    months = pd.period_range(start, end, freq="M")
+    n_months, n_rules = len(months), len(rules_df)
+
+    # Months x rules grid, broadcast in one shot
+    grid = rules_df.iloc[np.tile(np.arange(n_rules), n_months)].reset_index(drop=True)
+    grid.insert(0, "Year", np.repeat(months.year, n_rules))
+    grid.insert(1, "Month", np.repeat(months.month, n_rules))
+    keys = pd.MultiIndex.from_arrays([grid["Year"], grid["Month"], grid["Category"]], names=ROLLUP_KEYS)
+    spent = rollup.reindex(keys, fill_value=0.0).to_numpy(dtype=float)
+
+    limits = grid["Monthly_Limit"].to_numpy(dtype=float)
+    if "Alert_Threshold" in grid.columns:
+        thresholds = grid["Alert_Threshold"].to_numpy(dtype=float)
+    else:
+        thresholds = np.full(len(grid), np.nan)
+
+    grid["Amount_EUR"] = spent
+    grid["Remaining"] = limits - spent
+    grid["Threshold_Crossed"] = spent >= thresholds # NaN thresholds never trigger
+    grid["Exceeded"] = spent > limits
+    grid["Status"] = np.select(
+        [grid["Exceeded"], grid["Threshold_Crossed"]], ["Exceeded", "Warning"], default="OK"
+    )
+    return grid
+
+@tracing.traced("budget_logic.check_category_limits")
+def check_category_limits(df: pd.DataFrame, rules_df: pd.DataFrame, rollup: pd.Series = None) -> pd.DataFrame:
     """
     Compares spending against category limits.
+    Pass a rollup (see build_rollup) to skip scanning the transaction history.
     """
-    if df.empty or rules_df.empty:
+    if rules_df.empty or (rollup is None and df.empty):
         return pd.DataFrame()
 
     today = datetime.today()
-    # Filter current month
-    current_month_df = df[
-        (df['Date'].dt.month == today.month) & 
-        (df['Date'].dt.year == today.year)
-    ]
-    
-    # Group by category
-    category_spend = current_month_df.groupby("Category")["Amount_EUR"].sum().reset_index()
-    
-    # Merge with rules
-    merged = pd.merge(rules_df, category_spend, on="Category", how="left")
-    merged["Amount_EUR"] = merged["Amount_EUR"].fillna(0)
-    merged["Remaining"] = merged["Monthly_Limit"] - merged["Amount_EUR"]
-    merged["Status"] = merged.apply(lambda x: "Exceeded" if x["Remaining"] < 0 else "OK", axis=1)
-    
-    return merged
+    if rollup is None:
+        # Filter current month
+        current_month_df = df[
+            (df['Date'].dt.month == today.month) & 
+            (df['Date'].dt.year == today.year)
+        ]
+        rollup = build_rollup(current_month_df)
+
+    merged = evaluate_category_limits(df, rules_df, start=today, rollup=rollup)
+    return merged.drop(columns=["Year", "Month"])
+
+# Daily totals per data version (see fingerprint), so chart reruns only touch days, not rows.
+# Process-wide fallback; the app passes each tenant's own cache
+_daily_spend_cache = DerivedCache(max_versions=8)
+# id(frame) -> (weak reference, content key): each loaded frame is hashed once, not once per rerun
+_fingerprints = {}
+
+def fingerprint(df: pd.DataFrame) -> str:
+    """
+    Content key of a frame: a hash of every cell in row order, so any edit (a swapped amount,
+    a re-filed category) is a new version. Computed once per frame object: loaded frames are
+    immutable versions and must not be modified in place.
+    """
+    memo = _fingerprints.get(id(df))
+    if memo is not None and memo[0]() is df:
+        return memo[1]
+    key = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+    # The entry goes away with the frame, before its id can be reused
+    _fingerprints[id(df)] = (weakref.ref(df, lambda _, frame_id=id(df): _fingerprints.pop(frame_id, None)), key)
+    return key
+
+def daily_spend(df: pd.DataFrame, cache: DerivedCache = None) -> pd.Series:
+    """
+    Amount_EUR per calendar day (days without spending omitted), sorted by date.
+    Kept per data version in `cache` (default: a small process-wide one).
+    """
+    if df.empty or 'Date' not in df.columns:
+        return pd.Series([], index=pd.DatetimeIndex([], name="Date"), dtype=float, name="Amount_EUR")
+
+    def compute():
+        dates = df['Date']
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = pd.to_datetime(dates, errors='coerce')
+        return money(df).groupby(dates.dt.normalize().rename("Date")).sum().sort_index()
+
+    return (_daily_spend_cache if cache is None else cache).get(fingerprint(df), "daily_spend", compute)
+
+def lttb(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Indices of the n_out points kept by Largest-Triangle-Three-Buckets downsampling.
+    Keeps the first and last point, and per bucket the point spanning the largest
+    triangle with the previous pick and the next bucket's average, so spikes survive.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int) # n_out - 2 buckets between the endpoints
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    picked = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_hi = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[hi:next_hi].mean(), y[hi:next_hi].mean()
+        area = np.abs((x[picked] - avg_x) * (y[lo:hi] - y[picked]) - (x[picked] - x[lo:hi]) * (avg_y - y[picked]))
+        picked = lo + int(area.argmax())
+        keep[i + 1] = picked
+    return keep
+
+@tracing.traced("budget_logic.spending_trend")
+def spending_trend(df: pd.DataFrame, resolution: str = "Day", start=None, end=None,
+                   max_points: int = TREND_MAX_POINTS, cache: DerivedCache = None) -> pd.DataFrame:
+    """
+    Spend per day/week/month between start and end (inclusive), with empty periods as 0,
+    downsampled with LTTB to at most max_points rows (Date, Amount_EUR) for charting.
+    """
+    daily = daily_spend(df, cache)
+    if start is not None or end is not None:
+        daily = daily.loc[pd.Timestamp(start) if start is not None else None:
+                          pd.Timestamp(end) if end is not None else None]
+    if daily.empty:
+        return pd.DataFrame({"Date": pd.to_datetime([]), "Amount_EUR": pd.Series([], dtype=float)})
+
+    trend = daily.resample(TREND_RESOLUTIONS[resolution]).sum()
+    keep = lttb(trend.index.asi8, trend.to_numpy(), max_points)
+    return trend.iloc[keep].rename("Amount_EUR").rename_axis("Date").reset_index()
@@ -0,0 +1,79 @@
+import json
+import os
+from datetime import datetime
+
+import pandas as pd
+
+import browser
+import budget_logic
+import forecast
+import schema
+
+# Bump when the saved layout changes; files in an older layout are ignored
+SNAPSHOT_VERSION = 1
+# Days of daily spend kept for the trend chart
+TREND_DAYS = 90
+CATEGORY_COLUMNS = ["Category", "Amount_EUR", "Monthly_Limit", "Status", "Remaining"]
+
+
+def _columns(df: pd.DataFrame) -> dict:
+    # Column -> list of plain values, dates as ISO strings
+    out = df.copy()
+    for col in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[col]):
+            out[col] = out[col].dt.strftime("%Y-%m-%d")
+    return out.to_dict(orient="list")
+
+
+def build(df: pd.DataFrame, rules: pd.DataFrame, rollup: pd.Series = None, limit: float = budget_logic.TOTAL_BUDGET,
+          history: pd.DataFrame = None, cache=None) -> dict:
+    """
+    What the first screen shows (burn rate, category status, trend, recent rows) as plain JSON values.
+    `history` and `cache` are passed on (see forecast.forecast_month).
+    """
+    stats = budget_logic.calculate_burn_rate(df, limit=limit, rollup=rollup)
+    state = {
+        "version": SNAPSHOT_VERSION,
+        "saved_at": datetime.now().isoformat(timespec="seconds"),
+        "limit": float(limit),
+        "stats": {key: value.item() if hasattr(value, "item") else value for key, value in stats.items()},
+        "categories": {},
+        "projected": None,
+        "trend": {},
+        "recent": {},
+    }
+    if df.empty:
+        return state
+
+    last_day = df["Date"].max().normalize()
+    state["trend"] = _columns(budget_logic.spending_trend(df, "Day", last_day - pd.Timedelta(days=TREND_DAYS), last_day, cache=cache))
+    page, _ = browser.get_index(df, cache).page()
+    state["recent"] = _columns(schema.to_display(page)[schema.DISPLAY_COLUMNS])
+    if not rules.empty:
+        status = budget_logic.check_category_limits(df, rules, rollup=rollup)
+        if not status.empty:
+            state["categories"] = _columns(status[CATEGORY_COLUMNS])
+        state["projected"] = round(float(forecast.forecast_month(df, rules, history=history, cache=cache)["Projected"].sum()), 2)
+    return state
+
+
+def save(path: str, state: dict):
+    """
+    Writes the state atomically: a cold start never reads half a file.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def load(path: str) -> dict:
+    """
+    The last saved state, or None if there is none (or it is unreadable, or in an older layout).
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get("version") == SNAPSHOT_VERSION else None
@@ -1,7 +1,24 @@
-import gspread
-from google.oauth2.service_account import Credentials
+import contextlib
+import contextvars
+import os
+from datetime import date
 import pandas as pd
 import streamlit as st
+import alerts
+import budget_logic
+import dashboard_snapshot
+import forecast
+import local_cache
+import quota
+import reports
+import schema
+import snapshots
+import tenants
+import tracing
+from dataset_cache import DatasetCache, DerivedCache
+from storage import SheetsBackend, SQLiteBackend, StorageBackend, TRANSACTION_HEADER, parse_transactions
+import write_queue
+from write_queue import WriteQueue
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -10,95 +27,521 @@ SCOPES = [
 
 SHEET_NAME = "Personal Finance Tracker"
 
+# "sheets" (default), "sqlite" for the local engine, or "fake" for an in-memory Sheets double
+STORAGE_BACKEND = os.environ.get("BUDGET_BACKEND", "sheets")
+
+# Shared by every session on the service account. Sheets allows 60 reads/min per user:
+# a bucket of BURST tokens refilled at RATE/s never exceeds BURST + 60 * RATE in a minute
+SHEETS_RATE = float(os.environ.get("BUDGET_SHEETS_RATE", "0.8"))
+SHEETS_BURST = int(os.environ.get("BUDGET_SHEETS_BURST", "12"))
+
+# Seconds an explicit idempotency key, or failing that an identical row, blocks a repeat write:
+# long enough for double clicks and reruns during a slow save, short enough for a second real coffee
+IDEMPOTENCY_TTL = 24 * 3600
+DUPLICATE_WINDOW = 30
+
+# Seconds before a cached dataset is revalidated in the background
+# Archived months only change when partitions.py runs, which forces a full resync (see _alert_engine)
+DATASET_TTLS = {"transactions": 60, "rollup": 60, "budget_rules": 600, "archived_history": 3600}
+
+# JSON object mapping tenant ids (the ?budget= link parameter) to spreadsheet titles.
+# Without it the app serves SHEET_NAME alone. Ids act as access links: make them hard to guess.
+TENANTS_FILE = os.environ.get("BUDGET_TENANTS_FILE", "tenants.json")
+DEFAULT_TENANT = "default"
+# Last computed first screen per tenant, painted on the next cold start
+DASHBOARD_FILE = "dashboard.json"
+# Memory all tenants' cached datasets share before the least recently used are dropped
+TENANT_CACHE_MB = int(os.environ.get("BUDGET_TENANT_CACHE_MB", "512"))
+
 @st.cache_resource
 def get_client():
     """
-    Connects to Google Sheets using credentials.
+    Connects to Google Sheets using credentials, behind the process-wide quota limiter.
     """
     try:
-        # Check if authenticating via secrets (Cloud) or local file
-        # We try-except checking st.secrets because accessing it outside streamlit might be tricky
-        try:
-            if "gcp_service_account" in st.secrets:
-                creds = Credentials.from_service_account_info(
-                    st.secrets["gcp_service_account"], scopes=SCOPES
-                )
-                return gspread.authorize(creds)
-        except Exception:
-            pass # Fallback to local file
-
-        # Local development
-        creds = Credentials.from_service_account_file(
-            ".streamlit/credentials.json", scopes=SCOPES
-        )
-        return gspread.authorize(creds)
+        with tracing.span("sheets.auth"):
+            return quota.QuotaClient(_authorize(), rate=SHEETS_RATE, burst=SHEETS_BURST)
     except Exception as e:
-        print(f"Connection Error: {e}") # Print to console for debugging
+        tracing.record_error("Connection", e) # Console and the debug panel's trace
         # st.error(f"Failed to connect to Google Sheets: {e}")
         return None
 
+def _authorize():
+    """
+    Builds an authorized gspread client from Cloud secrets or the local credentials file.
+    """
+    # Imported here: they are slow to import and a cold start paints before it needs them
+    import gspread
+    from google.oauth2.service_account import Credentials
 
-def get_transactions() -> pd.DataFrame:
+    # Check if authenticating via secrets (Cloud) or local file
+    # We try-except checking st.secrets because accessing it outside streamlit might be tricky
+    try:
+        if "gcp_service_account" in st.secrets:
+            creds = Credentials.from_service_account_info(
+                st.secrets["gcp_service_account"], scopes=SCOPES
+            )
+            return gspread.authorize(creds)
+    except Exception:
+        pass # Fallback to local file
+
+    # Local development
+    creds = Credentials.from_service_account_file(
+        ".streamlit/credentials.json", scopes=SCOPES
+    )
+    return gspread.authorize(creds)
+
+
+def get_spreadsheet(sheet_name: str = SHEET_NAME):
     """
-    Fetches all transactions.
+    Cached spreadsheet handle (None when offline).
     """
     client = get_client()
-    if not client: return pd.DataFrame()
-    
+    if not client: return None
+    return client.open(sheet_name) # Opened once per process by QuotaClient
+
+
+@st.cache_resource
+def get_routes() -> dict:
+    """
+    Tenant id -> spreadsheet title, read once per process from TENANTS_FILE.
+    """
+    return tenants.load_routes(TENANTS_FILE) or {DEFAULT_TENANT: SHEET_NAME}
+
+# Tenant chosen by code serving requests outside Streamlit (see use_tenant)
+_tenant_override = contextvars.ContextVar("tenant_override", default=None)
+
+@contextlib.contextmanager
+def use_tenant(tenant_id: str):
+    """
+    Routes data_manager calls in this thread/task to `tenant_id` (None: the default routing).
+    """
+    token = _tenant_override.set(tenant_id)
     try:
-        sh = client.open(SHEET_NAME)
-        ws = sh.worksheet("Transactions")
-        data = ws.get_all_records()
-        df = pd.DataFrame(data)
-        
-        # Ensure correct types
-        if not df.empty:
-            df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-            df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
-            df['Amount_EUR'] = pd.to_numeric(df['Amount_EUR'], errors='coerce')
+        yield
+    finally:
+        _tenant_override.reset(token)
+
+def current_tenant() -> str:
+    """
+    Tenant id of this session (the ?budget= link parameter when several budgets are hosted),
+    or None when the link names no known budget.
+    """
+    routes = get_routes()
+    override = _tenant_override.get()
+    if override is not None:
+        return override if override in routes else None
+    if list(routes) == [DEFAULT_TENANT]:
+        return DEFAULT_TENANT
+    tenant = st.query_params.get("budget")
+    return tenant if tenant in routes else None
+
+@st.cache_resource
+def get_tenants() -> tenants.TenantPool:
+    """
+    Process-wide pool of hosted budgets under one memory cap for cached datasets.
+    """
+    return tenants.TenantPool(_make_tenant, max_bytes=TENANT_CACHE_MB * 2**20)
+
+def get_tenant() -> tenants.Tenant:
+    """
+    The budget this session works on.
+    """
+    tenant_id = current_tenant()
+    if tenant_id is None:
+        raise LookupError("This link does not open a known budget")
+    return get_tenants().get(tenant_id)
+
+@st.cache_resource
+def _fake_client() -> quota.QuotaClient:
+    from fake_sheets import FakeClient # Imports gspread for its exception types
+    return quota.QuotaClient(
+        FakeClient(latency=float(os.environ.get("BUDGET_FAKE_LATENCY", "0"))), rate=SHEETS_RATE, burst=SHEETS_BURST
+    )
+
+def _make_backend(tenant_id: str, sheet_name: str) -> StorageBackend:
+    """
+    Storage backend selected by BUDGET_BACKEND for one tenant's spreadsheet.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteBackend(os.path.join(local_cache.CACHE_DIR, tenants.tenant_file("budget.sqlite", tenant_id, DEFAULT_TENANT)))
+    if STORAGE_BACKEND == "fake":
+        import setup_sheet # Imports gspread, which only the fake and the CLIs need here
+        client = _fake_client()
+        setup_sheet.setup_spreadsheet(client.create(sheet_name))
+        sh = client.open(sheet_name)
+        backend = SheetsBackend(lambda: sh, sheet_name, cache_key=f"fake:{sheet_name}")
+        backend.reset_cache() # The fake starts empty every process
+        return backend
+    # Every tenant goes through the one authorized client and its quota limiter
+    return SheetsBackend(lambda: get_spreadsheet(sheet_name), sheet_name)
+
+def _make_tenant(tenant_id: str) -> tenants.Tenant:
+    sheet_name = get_routes()[tenant_id]
+    store = snapshots.SnapshotStore(
+        os.path.join(local_cache.CACHE_DIR, "snapshots"), tenants.tenant_file("transactions", tenant_id, default=None)
+    )
+    return tenants.Tenant(tenant_id, sheet_name, _make_backend(tenant_id, sheet_name), DatasetCache(DATASET_TTLS), store)
+
+def get_backend() -> StorageBackend:
+    """
+    This session's storage backend.
+    """
+    return get_tenant().backend
+
+
+def _report(action: str, error: Exception):
+    """
+    Logs a failed Sheets operation and tells the user, gently when it is only the quota.
+    """
+    tracing.record_error(action, error)
+    if quota.is_quota_error(error):
+        st.warning(f"Google Sheets is busy ({action.lower()} hit the rate limit). Showing the last synced data; try again in a minute.")
+    else:
+        st.error(f"Error {action.lower()}: {error}")
+
+def _pending_transactions() -> pd.DataFrame:
+    if not get_backend().write_behind:
+        return schema.empty_transactions()
+    return parse_transactions(TRANSACTION_HEADER, get_write_queue().pending_rows())[0]
+
+def _publish(tenant: tenants.Tenant, df: pd.DataFrame) -> pd.DataFrame:
+    # Sessions share one read-only snapshot per synced version instead of a frame each
+    return tenant.snapshots.publish(df) if tenant.snapshots else df
+
+def _transactions_loader(tenant: tenants.Tenant):
+    # Bound to the tenant here: revalidation runs in a thread that has no use_tenant() or Streamlit context
+    return lambda: _publish(tenant, tenant.backend.get_transactions())
+
+def _with_pending(df: pd.DataFrame) -> pd.DataFrame:
+    # Rows still waiting in the write-behind journal show up immediately
+    tenant = get_tenant()
+    if not tenant.backend.write_behind:
         return df
+    pending = _write_queue(tenant).pending_items()
+    if not pending:
+        return df
+    with tenant.lock:
+        if tenant.view and tenant.view[0] is df and tenant.view[1] == tuple(pending):
+            return tenant.view[2] # Built once per (sync, add), not once per rerun
+    # Only synced versions are published: an add must not rewrite the whole history on disk
+    view = schema.concat([df, parse_transactions(TRANSACTION_HEADER, list(pending.values()))[0]])
+    nbytes = int(view.memory_usage(deep=True).sum())
+    with tenant.lock:
+        tenant.view = (df, tuple(pending), view, nbytes)
+    return view
+
+def get_dataset_cache() -> DatasetCache:
+    """
+    This tenant's TTL / stale-while-revalidate cache of loaded datasets.
+    """
+    return get_tenant().datasets
+
+def get_derived_cache() -> DerivedCache:
+    """
+    This tenant's values derived per data version: pass it as `cache` to daily_spend,
+    spending_trend, burn_rate_history, browser.get_index and forecast_month.
+    """
+    return get_tenant().derived
+
+def get_transactions() -> pd.DataFrame:
+    """
+    Fetches all transactions.
+    """
+    tenant = get_tenant()
+    backend = tenant.backend
+    try:
+        df = tenant.datasets.get("transactions", _transactions_loader(tenant))
+        get_tenants().trim() # Room for this tenant's data comes out of the least recently used ones
+        return _with_pending(df)
     except Exception as e:
-        st.error(f"Error reading transactions: {e}")
-        return pd.DataFrame()
+        _report("Reading transactions", e)
+        return _with_pending(backend.cached_transactions())
+
+def load_data() -> tuple:
+    """
+    Fetches (transactions, budget_rules), served from the dataset cache when warm.
+    A cold start loads both in as few round trips as the backend allows.
+    """
+    tenant = get_tenant()
+    backend, cache = tenant.backend, tenant.datasets
+    try:
+        if not cache.has("transactions") and not cache.has("budget_rules"):
+            # Versions from before the load: a flush landing meanwhile must not be overwritten by older data
+            versions = cache.version("transactions"), cache.version("budget_rules")
+            df, rules = backend.load_data()
+            df = _publish(tenant, df)
+            cache.put("transactions", df, versions[0])
+            cache.put("budget_rules", rules, versions[1])
+        else:
+            df = cache.get("transactions", _transactions_loader(tenant))
+            rules = cache.get("budget_rules", backend.get_budget_rules)
+        get_tenants().trim()
+        _track_alerts(df, rules)
+        return _with_pending(df), rules
+    except Exception as e:
+        _report("Loading data", e)
+        return _with_pending(backend.cached_transactions()), pd.DataFrame()
+
+def get_rollup() -> pd.Series:
+    """
+    Month x category spend, including rows not yet flushed to the sheet.
+    """
+    try:
+        rollup = get_dataset_cache().get("rollup", get_backend().get_rollup)
+    except Exception as e:
+        _report("Reading spend rollup", e)
+        return None # Callers fall back to scanning the transactions
+    return budget_logic.update_rollup(rollup, _pending_transactions())
+
+def is_loaded() -> bool:
+    """
+    Whether this tenant's transactions are in memory, so load_data() will not wait on the network.
+    """
+    return get_dataset_cache().has("transactions")
+
+def _dashboard_path() -> str:
+    return os.path.join(local_cache.CACHE_DIR, tenants.tenant_file(DASHBOARD_FILE, get_tenant().id, DEFAULT_TENANT))
+
+def last_dashboard() -> dict:
+    """
+    The first screen saved by save_dashboard() (see dashboard_snapshot.build), or None.
+    """
+    return dashboard_snapshot.load(_dashboard_path())
+
+def save_dashboard(df: pd.DataFrame, rules: pd.DataFrame, rollup: pd.Series, limit: float):
+    """
+    Saves the first screen for the next cold start, once per data version, limit and day.
+    Skipped without rules: load_data() failed or is offline, and the saved screen is better than none.
+    """
+    if rules.empty:
+        return
+    tenant = get_tenant()
+    key = (
+        budget_logic.fingerprint(df), int(pd.util.hash_pandas_object(rules, index=False).sum()),
+        float(limit), date.today(),
+    )
+    if tenant.dashboard_key == key:
+        return
+    try:
+        dashboard_snapshot.save(_dashboard_path(), dashboard_snapshot.build(df, rules, rollup, limit, get_archived_history(), tenant.derived))
+    except OSError as e:
+        tracing.record_error("Saving dashboard snapshot", e) # Only the next cold start is slower
+    tenant.dashboard_key = key
+
+@st.cache_resource
+def get_report_renderer() -> reports.ReportRenderer:
+    """
+    The process pool rendering monthly reports, shared by every session and tenant.
+    """
+    return reports.ReportRenderer(int(os.environ.get("BUDGET_REPORT_WORKERS", "0")) or None)
+
+def start_reports(months: list, fmt: str, limit: float) -> reports.ReportJob:
+    """
+    Renders this tenant's reports for months ("YYYY-MM") in the background and returns the job
+    (see get_report_job). The data is aggregated once here; workers only draw.
+    """
+    tenant = get_tenant()
+    df, rules = load_data()
+    payloads = reports.aggregate(df, rules, get_rollup(), months, limit, tenant.derived)
+    out_dir = os.path.join(local_cache.CACHE_DIR, tenants.tenant_file("reports", tenant.id, DEFAULT_TENANT))
+    job = get_report_renderer().submit(payloads, out_dir, fmt)
+    tenant.reports = job
+    return job
+
+def get_report_job() -> reports.ReportJob:
+    """
+    This tenant's most recent report job, or None.
+    """
+    return get_tenant().reports
+
+def get_bad_rows() -> pd.DataFrame:
+    """
+    Sheet rows skipped by the last loads because they failed validation (Row, Reason).
+    """
+    return get_backend().bad_rows
+
+def invalidate(*datasets: str, drop: bool = False):
+    """
+    Marks cached datasets stale ("transactions", "rollup", "budget_rules"); all of them if none given.
+    """
+    cache = get_dataset_cache()
+    if datasets:
+        cache.invalidate(*datasets, drop=drop)
+    elif drop:
+        cache.clear()
+    else:
+        cache.invalidate(*DATASET_TTLS)
+
+def reset_cache():
+    """
+    Forgets the local transaction cache so the next read is a full sync.
+    """
+    get_backend().reset_cache()
+    invalidate(drop=True)
+
+def get_archived_history() -> pd.DataFrame:
+    """
+    Archived transactions of the closed months the forecast looks back on (see forecast.history_months).
+    """
+    backend = get_backend()
+    try:
+        return get_dataset_cache().get("archived_history", lambda: backend.get_archive(forecast.history_months()))
+    except Exception as e:
+        _report("Reading archived months", e)
+        return schema.empty_transactions() # The forecast falls back to the active months
 
 def get_budget_rules() -> pd.DataFrame:
     """
     Fetches budget rules.
     """
-    client = get_client()
-    if not client: return pd.DataFrame()
-    
     try:
-        sh = client.open(SHEET_NAME)
-        ws = sh.worksheet("Budget_Rules")
-        data = ws.get_all_records()
-        return pd.DataFrame(data)
+        return get_dataset_cache().get("budget_rules", get_backend().get_budget_rules)
     except Exception as e:
-        st.error(f"Error reading budget rules: {e}")
+        _report("Reading budget rules", e)
         return pd.DataFrame()
 
-def add_transaction(date, amount, currency, category, desc, amount_eur):
+def _write_queue(tenant: tenants.Tenant) -> WriteQueue:
+    with tenant.lock:
+        if tenant.queue is None:
+            # Bound to the tenant, not the session: the flusher runs outside any rerun
+            def on_flush():
+                tenant.datasets.invalidate("transactions", "rollup", drop=True)
+                _alert_engine(tenant).settle(queue.pending_items()) # Shipped rows now count once they sync back
+
+            queue = WriteQueue(
+                os.path.join(local_cache.CACHE_DIR, tenants.tenant_file(write_queue.JOURNAL_FILE, tenant.id, DEFAULT_TENANT)),
+                on_flush=on_flush,
+            )
+            queue.start(lambda: tenant.backend)
+            tenant.queue = queue
+        return tenant.queue
+
+def get_write_queue() -> WriteQueue:
     """
-    Appends a new transaction row.
+    This tenant's write-behind queue, with its background flusher running.
     """
-    client = get_client()
-    if not client: return False
-    
-    try:
-        sh = client.open(SHEET_NAME)
-        ws = sh.worksheet("Transactions")
-        
+    return _write_queue(get_tenant())
+
+def _alert_engine(tenant: tenants.Tenant) -> alerts.AlertEngine:
+    with tenant.lock:
+        if tenant.alerts is None:
+            engine = alerts.AlertEngine()
+            if tenant.backend.write_behind:
+                pending = _write_queue(tenant).pending_items()
+                df, valid = _parse_rows(list(pending.values()))
+                engine.add_pending_many([txn_id for txn_id, ok in zip(pending, valid) if ok], df)
+            # A rebuilt cache re-seeds the totals; alerts already fired stay fired
+            def on_sync(new_df, full):
+                if full:
+                    engine.seed(new_df)
+                    tenant.datasets.invalidate("archived_history") # Full resyncs follow archive runs
+                else:
+                    engine.observe(new_df)
+
+            tenant.backend.on_sync = on_sync
+            tenant.alerts = engine
+        return tenant.alerts
+
+def get_alert_engine() -> alerts.AlertEngine:
+    """
+    This tenant's alert engine, fed by every sync and every new transaction.
+    """
+    return _alert_engine(get_tenant())
+
+def _track_alerts(df: pd.DataFrame, rules: pd.DataFrame):
+    engine = get_alert_engine()
+    if not rules.empty:
+        engine.set_rules(rules)
+    if not engine.seeded:
+        engine.seed(df) # Synced rows only; journal rows are tracked by id
+
+def new_alerts() -> list:
+    """
+    Alert events this session has not shown yet.
+    """
+    events = get_alert_engine().events_since(st.session_state.get("alerts_seen", 0))
+    if events:
+        st.session_state["alerts_seen"] = events[-1]["seq"]
+    return events
+
+def add_transaction(date, amount, currency, category, desc, amount_eur, key: str = None):
+    """
+    Saves a new transaction row.
+    Remote backends return as soon as the row is in the local journal; the sheet write happens in the background.
+    A repeat of `key` (default: the row's content key, for DUPLICATE_WINDOW seconds) is
+    acknowledged without writing, so double submits and reruns never save a row twice.
+    """
+    return add_transactions([(date, amount, currency, category, desc, amount_eur, key)])[0]
+
+def _parse_rows(rows: list) -> tuple:
+    # One vectorized parse for many rows; valid[i] tells whether rows[i] made it into the frame
+    df, bad_rows = parse_transactions(TRANSACTION_HEADER, rows, first_row=0)
+    bad = set(bad_rows["Row"].tolist())
+    return df, [i not in bad for i in range(len(rows))]
+
+def add_transactions(entries: list) -> list:
+    """
+    Saves several transactions (add_transaction argument tuples, key optional) with one
+    idempotency transaction and one journal write, or one append_rows call. Returns a flag per entry.
+    """
+    rows, explicit = [], []
+    for date, amount, currency, category, desc, amount_eur, *key in entries:
         # Row format: [Date, Amount, Currency, Category, Description, Amount_EUR]
-        row = [
-            str(date), 
-            float(amount), 
-            currency, 
-            category, 
-            desc, 
-            float(amount_eur)
-        ]
-        ws.append_row(row)
-        return True
+        rows.append([str(date), float(amount), currency, category, desc, float(amount_eur)])
+        explicit.append(key[0] if key else None)
+    new_df, valid = _parse_rows(rows)
+    content_keys = iter(schema.row_keys(new_df))
+    claims = []
+    for row, is_valid, key in zip(rows, valid, explicit):
+        content = f"row:{next(content_keys) if is_valid else row}"
+        key, ttl = (content, DUPLICATE_WINDOW) if key is None else (key, IDEMPOTENCY_TTL)
+        claims.append((f"{current_tenant()}:{key}", ttl)) # The same coffee in two budgets is two rows
+
+    fresh = []
+    try:
+        claimed = local_cache.claim_keys(claims)
+        fresh = [i for i, ok in enumerate(claimed) if ok]
+        if len(fresh) < len(entries):
+            tracing.count("transactions.duplicates", len(entries) - len(fresh)) # Already saved
+        if not fresh:
+            return [True] * len(entries)
+        # Position of each valid row in new_df
+        frame_rows = dict(zip([i for i, ok in enumerate(valid) if ok], range(len(new_df))))
+        fresh_df = new_df.iloc[[frame_rows[i] for i in fresh if valid[i]]]
+        backend = get_backend()
+        engine = get_alert_engine()
+        if backend.write_behind:
+            # Pending rows are overlaid on cached data, so nothing needs reloading yet
+            txn_ids = get_write_queue().enqueue_many([rows[i] for i in fresh])
+            engine.add_pending_many([txn_id for txn_id, i in zip(txn_ids, fresh) if valid[i]], fresh_df)
+        else:
+            backend.append_rows([rows[i] for i in fresh])
+            invalidate("transactions", "rollup", drop=True) # Rules are unaffected
+            engine.observe(fresh_df)
+        return [True] * len(entries)
     except Exception as e:
-        st.error(f"Error saving transaction: {e}")
-        return False
+        if fresh:
+            local_cache.release_key(*(claims[i][0] for i in fresh)) # Nothing was saved: a retry must go through
+        _report("Saving transaction", e)
+        return [False] * len(entries)
+
+def flush_pending() -> int:
+    """
+    Ships queued rows right away instead of waiting for the background flusher.
+    """
+    try:
+        return get_write_queue().flush(get_backend)
+    except Exception as e:
+        _report("Syncing transactions", e)
+        return 0
+
+def get_sync_status() -> dict:
+    """
+    Pending/flushed counters of the write-behind queue (idle when the backend writes directly).
+    """
+    tenant = get_tenant()
+    if not tenant.backend.write_behind:
+        # No journal or flusher thread for a backend that never queues
+        return {"pending": 0, "flushed": 0, "last_error": None, "last_flush": None}
+    return _write_queue(tenant).status()
@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+import tracing
+
+
+def _nbytes(value) -> int:
+    # Memory held by a cached DataFrame/Series (strings included), bytes, or anything reporting its own nbytes()
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, bytes):
+        return len(value)
+    if callable(getattr(value, "nbytes", None)):
+        return int(value.nbytes())
+    return 0
+
+
+class _Entry:
+    __slots__ = ("value", "loaded_at", "expires_at", "version", "nbytes")
+
+    def __init__(self, value, ttl: float, version: int, nbytes: int = 0):
+        self.value = value
+        self.loaded_at = time.time()
+        self.expires_at = self.loaded_at + ttl
+        self.version = version
+        self.nbytes = nbytes
+
+
+class DatasetCache:
+    """
+    In-process cache of loaded datasets with a TTL per dataset.
+    Expired entries are served as-is while one background thread reloads them
+    (stale-while-revalidate), so reruns never wait on the network once warm.
+    Cached values are shared between sessions and must be treated as read-only.
+    """
+
+    def __init__(self, ttls: dict, default_ttl: float = 60.0):
+        self.ttls = dict(ttls)
+        self.default_ttl = default_ttl
+        self._entries = {}
+        self._versions = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _ttl(self, key: str) -> float:
+        return self.ttls.get(key, self.default_ttl)
+
+    def has(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def version(self, key: str) -> int:
+        """
+        Current invalidation count of a dataset: pass it to put() when loading outside get().
+        """
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def put(self, key: str, value, version: int = None):
+        nbytes = _nbytes(value) # Measured once, outside the lock
+        with self._lock:
+            current = self._versions.get(key, 0)
+            ttl = self._ttl(key)
+            if version not in (None, current):
+                if key not in self._entries:
+                    return # Dropped while loading: the next read must load for itself
+                ttl = 0 # Invalidated while loading: keep the value but treat it as stale
+            self._entries[key] = _Entry(value, ttl, current, nbytes)
+
+    def get(self, key: str, loader):
+        """
+        Fresh value, or the stale one while a background reload runs.
+        Only a missing entry makes the caller wait for loader().
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            version = self._versions.get(key, 0)
+        if entry is None:
+            value = loader()
+            self.put(key, value, version)
+            return value
+        if time.time() >= entry.expires_at:
+            self._refresh_async(key, loader, version)
+        return entry.value
+
+    def invalidate(self, *keys: str, drop: bool = False):
+        """
+        Marks datasets stale (next read revalidates in the background),
+        or drops them so the next read loads synchronously.
+        """
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                if drop:
+                    self._entries.pop(key, None)
+                elif key in self._entries:
+                    self._entries[key].expires_at = 0
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+        self.invalidate(*keys, drop=True)
+
+    def nbytes(self) -> int:
+        """
+        Memory held by the cached values, as measured when they were stored.
+        """
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def status(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                key: {
+                    "age_seconds": round(now - entry.loaded_at, 1),
+                    "stale": now >= entry.expires_at,
+                    "refreshing": key in self._refreshing,
+                    "bytes": entry.nbytes,
+                }
+                for key, entry in self._entries.items()
+            }
+
+    def _refresh_async(self, key: str, loader, version: int):
+        with self._lock:
+            if key in self._refreshing:
+                return # One reload per dataset in flight
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                with tracing.span(f"cache.revalidate.{key}"):
+                    value = loader()
+                self.put(key, value, version)
+            except Exception as e:
+                # Keep serving the stale copy; the next read tries again
+                tracing.record_error(f"Revalidate {key}", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f"revalidate-{key}", daemon=True).start()
+
+
+class DerivedCache:
+    """
+    Values computed from a data version (daily totals, search indexes, forecasts, API responses),
+    grouped by version: only the max_versions most recently used versions are kept, so an old
+    frame is never pinned for long, and each version keeps at most max_entries values.
+    One per tenant (see tenants.Tenant); nbytes() counts towards the tenant pool's memory cap.
+    """
+
+    def __init__(self, max_versions: int = 2, max_entries: int = 256):
+        self.max_versions = max_versions
+        self.max_entries = max_entries
+        self._versions = OrderedDict() # version -> OrderedDict(key -> (value, nbytes))
+        self._lock = threading.Lock()
+
+    def get(self, version: str, key, compute):
+        """
+        The value for key at this version, computed (outside the lock) on first use.
+        """
+        with self._lock:
+            entries = self._versions.get(version)
+            if entries is not None:
+                self._versions.move_to_end(version)
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key][0]
+        value = compute()
+        nbytes = _nbytes(value)
+        with self._lock:
+            entries = self._versions.setdefault(version, OrderedDict())
+            self._versions.move_to_end(version)
+            entries[key] = (value, nbytes)
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            while len(self._versions) > self.max_versions:
+                self._versions.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._versions.clear()
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(nbytes for entries in self._versions.values() for _, nbytes in entries.values())
@@ -0,0 +1,164 @@
+import time
+import gspread
+from gspread.utils import a1_range_to_grid_range
+
+
+class FakeWorksheet:
+    """
+    In-memory stand-in for gspread.Worksheet.
+    Values come back as strings, like the formatted values the Sheets API returns.
+    """
+
+    def __init__(self, spreadsheet, title: str, values: list = None):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self._values = [list(row) for row in (values or [])]
+
+    def _read(self, range_name: str = None) -> list:
+        values = [["" if cell is None else str(cell) for cell in row] for row in self._values]
+        if range_name:
+            grid = a1_range_to_grid_range(range_name)
+            rows = values[grid.get("startRowIndex", 0):grid.get("endRowIndex")]
+            start_col, end_col = grid.get("startColumnIndex", 0), grid.get("endColumnIndex")
+            values = [row[start_col:end_col] for row in rows]
+        # The API trims trailing blank rows
+        while values and not any(values[-1]):
+            values.pop()
+        return values
+
+    def get_values(self, range_name: str = None, **kwargs) -> list:
+        self.spreadsheet.client._call("get_values")
+        return self._read(range_name)
+
+    def get_all_values(self, **kwargs) -> list:
+        return self.get_values()
+
+    def get_all_records(self, **kwargs) -> list:
+        values = self.get_values()
+        if not values:
+            return []
+        header = values[0]
+        return [dict(zip(header, row + [""] * (len(header) - len(row)))) for row in values[1:]]
+
+    def row_values(self, row: int, **kwargs) -> list:
+        self.spreadsheet.client._call("row_values")
+        rows = self._read()
+        return rows[row - 1] if row <= len(rows) else []
+
+    def batch_get(self, ranges: list, **kwargs) -> list:
+        self.spreadsheet.client._call("batch_get")
+        return [self._read(a1) for a1 in ranges]
+
+    def append_row(self, values: list, **kwargs):
+        return self.append_rows([values])
+
+    def append_rows(self, values: list, **kwargs):
+        self.spreadsheet.client._call("append_rows")
+        self._values.extend(list(row) for row in values)
+        return {"updates": {"updatedRows": len(values)}}
+
+    def update(self, range_name: str = None, values: list = None, **kwargs):
+        self.spreadsheet.client._call("update")
+        grid = a1_range_to_grid_range(range_name or "A1")
+        start_row, start_col = grid.get("startRowIndex", 0), grid.get("startColumnIndex", 0)
+        for i, row in enumerate(values or []):
+            while len(self._values) <= start_row + i:
+                self._values.append([])
+            target = self._values[start_row + i]
+            target.extend([""] * (start_col + len(row) - len(target)))
+            target[start_col:start_col + len(row)] = row
+
+    def delete_rows(self, start_index: int, end_index: int = None):
+        self.spreadsheet.client._call("delete_rows")
+        del self._values[start_index - 1:(end_index or start_index)]
+
+    def clear(self):
+        self.spreadsheet.client._call("clear")
+        self._values = []
+
+    def update_title(self, title: str):
+        self.spreadsheet.client._call("update_title")
+        worksheets = self.spreadsheet._worksheets
+        worksheets[title] = worksheets.pop(self.title)
+        self.title = title
+
+
+class FakeSpreadsheet:
+    """
+    In-memory stand-in for gspread.Spreadsheet.
+    """
+
+    def __init__(self, client, title: str):
+        self.client = client
+        self.title = title
+        self.id = f"fake-{abs(hash(title))}"
+        self._worksheets = {}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.client._call("worksheet")
+        if title not in self._worksheets:
+            raise gspread.WorksheetNotFound(title)
+        return self._worksheets[title]
+
+    def worksheets(self) -> list:
+        self.client._call("worksheets")
+        return list(self._worksheets.values())
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, **kwargs) -> FakeWorksheet:
+        self.client._call("add_worksheet")
+        ws = FakeWorksheet(self, title)
+        self._worksheets[title] = ws
+        return ws
+
+    def del_worksheet(self, worksheet: FakeWorksheet):
+        self.client._call("del_worksheet")
+        self._worksheets.pop(worksheet.title, None)
+
+    def values_batch_get(self, ranges: list, params: dict = None) -> dict:
+        self.client._call("values_batch_get")
+        value_ranges = []
+        for a1 in ranges:
+            title, _, cells = a1.partition("!")
+            if title not in self._worksheets:
+                # What the real API answers with a 400
+                raise ValueError(f"Unable to parse range: {a1}")
+            values = self._worksheets[title]._read(cells or None)
+            value_range = {"range": a1, "majorDimension": "ROWS"}
+            if values:
+                value_range["values"] = values
+            value_ranges.append(value_range)
+        return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+
+class FakeClient:
+    """
+    In-memory stand-in for an authorized gspread.Client.
+    Every API call sleeps `latency` seconds and is counted in `calls`.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self._spreadsheets = {}
+
+    def _call(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def open(self, title: str) -> FakeSpreadsheet:
+        self._call("open")
+        if title not in self._spreadsheets:
+            raise gspread.SpreadsheetNotFound(title)
+        return self._spreadsheets[title]
+
+    def create(self, title: str) -> FakeSpreadsheet:
+        self._call("create")
+        sh = FakeSpreadsheet(self, title)
+        sh.add_worksheet("Sheet1")
+        self._spreadsheets[title] = sh
+        return sh
+
+    def list_spreadsheet_files(self) -> list:
+        self._call("list_spreadsheet_files")
+        return [{"id": sh.id, "name": title} for title, sh in self._spreadsheets.items()]
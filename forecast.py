@@ -0,0 +1,156 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import budget_logic
+import schema
+import tracing
+from dataset_cache import DerivedCache
+
+# Days of history behind the rolling burn rate (whole weeks, so every weekday counts equally)
+LOOKBACK_DAYS = 56
+# Shorter histories are padded with empty days up to this: one big first purchase is not a daily rate
+MIN_LOOKBACK_DAYS = 28
+# Pseudo-days pulling each weekday's rate towards the category's flat rate when data is thin
+WEEKDAY_SHRINKAGE = 4.0
+# A (category, amount) seen once a month, around the same day, in RECURRING_MIN_MONTHS of the last RECURRING_MONTHS months
+RECURRING_MONTHS = 3
+RECURRING_MIN_MONTHS = 2
+RECURRING_DAY_SPREAD = 5
+# Amounts within ~10% of each other count as the same recurring expense (FX moves rent a bit)
+AMOUNT_BUCKET = np.log(1.1)
+
+FORECAST_COLUMNS = ["Category", "Spent", "Recurring_Expected", "Variable_Forecast", "Projected"]
+
+# Forecasts per (data version, day, lookback); widget reruns reuse them. Process-wide fallback,
+# the app passes each tenant's own cache
+_forecast_cache = DerivedCache(max_versions=8)
+
+
+def _recurring(frame: pd.DataFrame, current: int) -> pd.DataFrame:
+    """
+    Recurring expenses by (Category, Bucket): their typical amount and whether this month's is already in.
+    `frame` holds Category, Bucket, Month (year * 12 + month), Day (of month) and Amount for the last
+    RECURRING_MONTHS months up to as_of; `current` is the month being forecast.
+    """
+    past = frame[frame["Month"] < current]
+    stats = past.groupby(["Category", "Bucket"], observed=True).agg(
+        months=("Month", "nunique"), count=("Month", "size"), amount=("Amount", "median"),
+        first_day=("Day", "min"), last_day=("Day", "max"),
+    )
+    stats = stats[
+        (stats["months"] >= RECURRING_MIN_MONTHS) & (stats["count"] == stats["months"])
+        & (stats["last_day"] - stats["first_day"] <= RECURRING_DAY_SPREAD)
+    ]
+    paid = frame[frame["Month"] == current].set_index(["Category", "Bucket"]).index
+    stats["paid"] = stats.index.isin(paid)
+    return stats[["amount", "paid"]]
+
+
+@tracing.traced("forecast.compute")
+def _compute(df: pd.DataFrame, as_of: pd.Timestamp, lookback_days: int) -> pd.DataFrame:
+    month_start = as_of.replace(day=1)
+    month_end = month_start + pd.offsets.MonthEnd(0)
+    window_start = min(as_of - pd.Timedelta(days=lookback_days - 1), month_start)
+    history_start = (pd.Period(month_start, "M") - RECURRING_MONTHS).start_time
+
+    dates = pd.to_datetime(df["Date"], errors="coerce")
+    first_day = dates.min()
+    in_range = ((dates >= history_start) & (dates < as_of + pd.Timedelta(days=1)) & df["Category"].notna()).to_numpy()
+    dates = dates[in_range].dt.normalize()
+    amounts = budget_logic.money(df)[in_range].to_numpy(dtype=float)
+    categories, labels = pd.factorize(df["Category"].to_numpy(dtype=object)[in_range])
+    n_cat = len(labels)
+    if not n_cat:
+        return pd.DataFrame(columns=FORECAST_COLUMNS)
+
+    # Recurring expenses (rent, subscriptions) are forecast by amount, not by daily rate
+    buckets = np.round(np.log(np.maximum(np.abs(amounts), 0.01)) / AMOUNT_BUCKET).astype(np.int64)
+    months = (dates.dt.year * 12 + dates.dt.month).to_numpy()
+    keyed = pd.DataFrame({"Category": categories, "Bucket": buckets, "Month": months, "Day": dates.dt.day.to_numpy(), "Amount": amounts})
+    recurring = _recurring(keyed, month_start.year * 12 + month_start.month)
+    is_recurring = keyed.set_index(["Category", "Bucket"]).index.isin(recurring.index)
+    pending = recurring[~recurring["paid"]].groupby(level="Category")["amount"].sum()
+    recurring_expected = np.zeros(n_cat)
+    recurring_expected[pending.index.to_numpy()] = pending.to_numpy()
+
+    # Categories x days spend matrix over the window, in one bincount
+    n_days = (as_of - window_start).days + 1
+    day = ((dates - window_start).dt.days).to_numpy()
+    in_window = day >= 0
+    matrix = np.bincount(
+        categories[in_window] * n_days + day[in_window], weights=amounts[in_window], minlength=n_cat * n_days
+    ).reshape(n_cat, n_days)
+    variable = np.bincount(
+        categories[in_window & ~is_recurring] * n_days + day[in_window & ~is_recurring],
+        weights=amounts[in_window & ~is_recurring], minlength=n_cat * n_days,
+    ).reshape(n_cat, n_days)
+    spent = matrix[:, (month_start - window_start).days:].sum(axis=1)
+
+    # Rolling rate per weekday over the lookback (the whole history if shorter, but at least MIN_LOOKBACK_DAYS),
+    # shrunk towards the flat daily rate
+    history_days = (as_of - first_day.normalize()).days + 1
+    lookback = variable[:, -max(1, min(lookback_days, max(MIN_LOOKBACK_DAYS, history_days))):]
+    lookback_weekdays = (pd.date_range(end=as_of, periods=lookback.shape[1], freq="D").weekday).to_numpy()
+    weekday_days = np.bincount(lookback_weekdays, minlength=7)
+    weekday_spend = np.stack([lookback[:, lookback_weekdays == w].sum(axis=1) for w in range(7)], axis=1)
+    flat_rate = lookback.sum(axis=1, keepdims=True) / lookback.shape[1]
+    weekday_rate = (weekday_spend + WEEKDAY_SHRINKAGE * flat_rate) / (weekday_days + WEEKDAY_SHRINKAGE)
+
+    # Remaining days of the month, counted per weekday
+    remaining = pd.date_range(as_of + pd.Timedelta(days=1), month_end, freq="D").weekday.to_numpy()
+    variable_forecast = weekday_rate @ np.bincount(remaining, minlength=7)
+
+    return pd.DataFrame({
+        "Category": labels.astype(str),
+        "Spent": np.round(spent, 2),
+        "Recurring_Expected": np.round(recurring_expected, 2),
+        "Variable_Forecast": np.round(variable_forecast, 2),
+        "Projected": np.round(spent + recurring_expected + variable_forecast, 2),
+    })
+
+
+def history_months(as_of=None, lookback_days: int = LOOKBACK_DAYS) -> list:
+    """
+    (year, month) of the closed months a forecast as of `as_of` reads. Where those months
+    are archived (see partitions.py), pass their rows to forecast_month as `history`.
+    """
+    as_of = pd.Timestamp(as_of if as_of is not None else datetime.today()).normalize()
+    month = pd.Period(as_of, "M")
+    first = min(month - RECURRING_MONTHS, pd.Period(as_of - pd.Timedelta(days=lookback_days - 1), "M"))
+    return [(period.year, period.month) for period in pd.period_range(first, month - 1, freq="M")]
+
+
+def forecast_month(df: pd.DataFrame, rules_df: pd.DataFrame = None, as_of=None,
+                   lookback_days: int = LOOKBACK_DAYS, history: pd.DataFrame = None,
+                   cache: DerivedCache = None) -> pd.DataFrame:
+    """
+    Projected end-of-month spend per category: spent so far, recurring expenses still due,
+    and the rolling weekday-weighted burn rate over the days left.
+    `history` holds archived rows of the months df no longer has (see history_months).
+    Results are kept per data version in `cache` (default: a small process-wide one).
+    With rules, adds Monthly_Limit, Projected_Overrun and Status ("Overrun", "At Risk", "OK").
+    """
+    as_of = pd.Timestamp(as_of if as_of is not None else datetime.today()).normalize()
+    if history is not None and history.empty:
+        history = None
+    if df.empty and history is None:
+        result = pd.DataFrame(columns=FORECAST_COLUMNS)
+    else:
+        key = ("forecast", history is not None and budget_logic.fingerprint(history), as_of, lookback_days)
+        result = (_forecast_cache if cache is None else cache).get(
+            budget_logic.fingerprint(df), key,
+            lambda: _compute(df if history is None else schema.concat([history, df]), as_of, lookback_days),
+        )
+
+    if rules_df is None or rules_df.empty:
+        return result.copy()
+    merged = rules_df.merge(result, on="Category", how="left")
+    merged[FORECAST_COLUMNS[1:]] = merged[FORECAST_COLUMNS[1:]].astype(float).fillna(0.0)
+    limits = merged["Monthly_Limit"].to_numpy(dtype=float)
+    thresholds = merged["Alert_Threshold"].to_numpy(dtype=float) if "Alert_Threshold" in merged.columns else limits
+    projected = merged["Projected"].to_numpy()
+    merged["Projected_Overrun"] = np.round(np.maximum(projected - limits, 0.0), 2)
+    merged["Status"] = np.select([projected > limits, projected >= thresholds], ["Overrun", "At Risk"], default="OK")
+    return merged
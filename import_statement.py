@@ -0,0 +1,353 @@
+import argparse
+import os
+import re
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+import budget_logic
+import local_cache
+import quota
+import schema
+import setup_sheet
+from storage import PARTITION_PREFIX, SheetsBackend
+
+# Statement rows parsed and normalized at a time; memory stays flat whatever the file size
+CHUNK_ROWS = 5000
+# New rows per append_rows call
+BATCH_ROWS = 1000
+
+# Statement columns (lowercased) recognised for each Transactions field, first match wins
+COLUMN_ALIASES = {
+    "Date": ["date", "booking date", "transaction date", "completed date", "started date", "value date", "posted"],
+    "Amount": ["amount", "transaction amount", "value"],
+    "Currency": ["currency", "ccy"],
+    "Description": ["description", "payee", "merchant", "name", "details", "memo", "reference", "narrative"],
+    "Category": ["category"],
+}
+
+# Lowercase description keywords per category, for statements without one
+CATEGORY_KEYWORDS = {
+    "Rent": ["rent", "miete", "loyer", "nájem", "czynsz", "landlord"],
+    "Travel": ["ryanair", "wizz", "easyjet", "flixbus", "airbnb", "booking.com", "uber", "bolt", "rail", "train", "airline"],
+    "Food": ["lidl", "aldi", "tesco", "albert", "biedronka", "spar", "billa", "carrefour", "restaurant", "cafe", "bistro", "pizza", "kebab"],
+    "Fun": ["spotify", "netflix", "cinema", "kino", "club", "bar", "pub", "museum", "concert", "steam"],
+}
+
+# Fixed local date formats tried (vectorized) before per-row inference
+DAYFIRST_FORMATS = ["%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y", "%d/%m/%y", "%d.%m.%y"]
+MONTHFIRST_FORMATS = ["%m/%d/%Y", "%m/%d/%y"]
+
+OFX_TOKEN = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+OFX_FIELDS = {"DTPOSTED": "Date", "TRNAMT": "Amount", "NAME": "Name", "MEMO": "Memo", "CURSYM": "Currency"}
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".ofx", ".qfx"):
+        return "ofx"
+    if ext in (".xml", ".camt", ".053"):
+        return "camt"
+    return "csv"
+
+
+def map_columns(columns: list, overrides: dict = None) -> dict:
+    """
+    {statement column: Transactions field} from COLUMN_ALIASES, with explicit overrides taking precedence.
+    """
+    overrides = {field: column for field, column in (overrides or {}).items() if column}
+    lowered = {str(column).strip().lower(): column for column in columns}
+    mapping = {column: field for field, column in overrides.items()}
+    for field, aliases in COLUMN_ALIASES.items():
+        if field in overrides:
+            continue
+        match = next((lowered[alias] for alias in aliases if alias in lowered and lowered[alias] not in mapping), None)
+        if match is not None:
+            mapping[match] = field
+    missing = {"Date", "Amount"} - set(mapping.values())
+    if missing:
+        raise ValueError(f"Statement has no {' or '.join(sorted(missing))} column (columns: {', '.join(map(str, columns))})")
+    return mapping
+
+
+def read_csv_chunks(path: str, overrides: dict = None, delimiter: str = ",", chunk_rows: int = CHUNK_ROWS):
+    """
+    Yields frames of up to chunk_rows statement rows, with columns renamed to Transactions fields.
+    """
+    mapping = None
+    for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, sep=delimiter, chunksize=chunk_rows,
+                             encoding="utf-8-sig"):
+        if mapping is None:
+            mapping = map_columns(list(chunk.columns), overrides)
+        yield chunk[list(mapping)].rename(columns=mapping)
+
+
+def read_ofx_chunks(path: str, chunk_rows: int = CHUNK_ROWS):
+    """
+    Yields frames of <STMTTRN> records from an OFX/QFX file (SGML or XML flavour), line by line.
+    """
+    currency, record, rows = "", None, []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            for closing, tag, text in OFX_TOKEN.findall(line):
+                tag, text = tag.upper(), text.strip()
+                if tag == "CURDEF" and not closing:
+                    currency = text
+                elif tag == "STMTTRN":
+                    if closing and record is not None:
+                        rows.append(record)
+                        record = None
+                    elif not closing:
+                        record = {}
+                elif record is not None and not closing and tag in OFX_FIELDS:
+                    record[OFX_FIELDS[tag]] = text
+            if len(rows) >= chunk_rows:
+                yield _ofx_frame(rows, currency)
+                rows = []
+    if rows:
+        yield _ofx_frame(rows, currency)
+
+
+def _ofx_frame(rows: list, currency: str) -> pd.DataFrame:
+    frame = pd.DataFrame(rows).reindex(columns=["Date", "Amount", "Name", "Memo", "Currency"])
+    name, memo = frame["Name"].fillna(""), frame["Memo"].fillna("")
+    return pd.DataFrame({
+        "Date": frame["Date"].fillna("").str[:8], # YYYYMMDD[HHMMSS[.XXX]][TZ]
+        "Amount": frame["Amount"],
+        "Currency": frame["Currency"].fillna(currency),
+        "Description": (name + " " + memo.where(memo != name, "")).str.strip(),
+    })
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _text(elem, *path: str) -> str:
+    # Text of the first descendant reached through `path` (local tag names), else ""
+    for node in elem.iter():
+        if _local(node.tag) != path[0]:
+            continue
+        if len(path) == 1:
+            return (node.text or "").strip()
+        found = _text(node, *path[1:])
+        if found:
+            return found
+    return ""
+
+
+def read_camt_chunks(path: str, chunk_rows: int = CHUNK_ROWS):
+    """
+    Yields frames of booked entries (<Ntry>) from an ISO 20022 camt.052/053/054 file.
+    Entries are parsed as they close and then cleared, so the tree never holds the whole statement.
+    """
+    rows = []
+    for _, elem in ET.iterparse(path, events=("end",)):
+        if _local(elem.tag) != "Ntry":
+            continue
+        row = {"Date": "", "Amount": "", "Currency": "", "Description": ""}
+        debit = False
+        for child in elem:
+            name = _local(child.tag)
+            if name == "Amt":
+                row["Amount"], row["Currency"] = (child.text or "").strip(), child.get("Ccy", "")
+            elif name == "CdtDbtInd":
+                debit = (child.text or "").strip() == "DBIT"
+            elif name in ("BookgDt", "ValDt") and not row["Date"]:
+                row["Date"] = next((d.text or "" for d in child if _local(d.tag) in ("Dt", "DtTm")), "")[:10]
+        # Who was paid (or who paid), then the remittance text
+        party = _text(elem, "Cdtr" if debit else "Dbtr", "Nm")
+        remittance = _text(elem, "Ustrd") or _text(elem, "AddtlNtryInf")
+        row["Description"] = " ".join(text for text in (party, remittance) if text)
+        if debit and row["Amount"]:
+            row["Amount"] = "-" + row["Amount"] # Statement amounts are unsigned; debits are spend
+        rows.append(row)
+        elem.clear()
+        if len(rows) >= chunk_rows:
+            yield pd.DataFrame(rows)
+            rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+
+def categorize(descriptions: pd.Series, default: str = "Other") -> np.ndarray:
+    """
+    Category per description from CATEGORY_KEYWORDS (matched at word starts), one vectorized match per category.
+    """
+    lowered = descriptions.fillna("").astype("str").str.lower()
+    conditions = [
+        lowered.str.contains(r"\b(?:" + "|".join(re.escape(word) for word in words) + ")", regex=True).to_numpy()
+        for words in CATEGORY_KEYWORDS.values()
+    ]
+    return np.select(conditions, list(CATEGORY_KEYWORDS), default=default)
+
+
+def normalize(chunk: pd.DataFrame, currency: str = "EUR", category: str = None, decimal: str = ".",
+              dayfirst: bool = False, positive_spend: bool = False) -> tuple:
+    """
+    Statement rows -> (compact Transactions frame of the expenses, rows that did not parse).
+    Spend is negative on bank statements (or positive with positive_spend); the other side is income and is left out.
+    Amount_EUR uses the rate in effect on each row's date, for the whole chunk at once.
+    """
+    amounts = chunk["Amount"].astype("str").str.replace(r"[\s '€$£]", "", regex=True)
+    if decimal != ".":
+        amounts = amounts.str.replace(".", "", regex=False).str.replace(decimal, ".", regex=False)
+    else:
+        amounts = amounts.str.replace(",", "", regex=False)
+    amounts = pd.to_numeric(amounts, errors="coerce")
+    # ISO and OFX dates in one fast pass, then common local formats; only the rest pay for inference
+    dates = pd.to_datetime(chunk["Date"], format="ISO8601", errors="coerce")
+    text = chunk["Date"].astype("str").str.strip()
+    for fmt in [*(DAYFIRST_FORMATS if dayfirst else MONTHFIRST_FORMATS), "mixed"]:
+        leftover = dates.isna() & (text != "")
+        if not leftover.any():
+            break
+        dates[leftover] = pd.to_datetime(text[leftover], format=fmt, dayfirst=dayfirst, errors="coerce")
+    invalid = int((amounts.isna() | dates.isna()).sum())
+
+    spend = (amounts > 0 if positive_spend else amounts < 0) & dates.notna()
+    amounts, dates = amounts[spend].abs(), dates[spend].dt.normalize()
+    currencies = chunk["Currency"][spend] if "Currency" in chunk.columns else pd.Series(currency, index=amounts.index)
+    currencies = currencies.fillna("").astype("str").str.strip().str.upper().replace("", currency)
+    descriptions = chunk["Description"][spend].fillna("").astype("str").str.strip() if "Description" in chunk.columns \
+        else pd.Series("", index=amounts.index)
+    if category:
+        categories = np.full(len(amounts), category, dtype=object)
+    else:
+        categories = categorize(descriptions)
+        if "Category" in chunk.columns:
+            given = chunk["Category"][spend].fillna("").astype("str").str.strip()
+            categories = np.where(given != "", given, categories)
+
+    df, bad = schema.from_frame(pd.DataFrame({
+        "Date": dates,
+        "Amount": amounts,
+        "Currency": currencies,
+        "Category": categories,
+        "Description": descriptions,
+        "Amount_EUR": budget_logic.convert_to_eur(amounts, currencies, dates),
+    }))
+    return df, invalid + len(bad)
+
+
+class ExistingRows:
+    """
+    Counts of content keys (see schema.row_keys) already in the spreadsheet.
+    The Transactions tab is looked up in the local key index after an incremental
+    sync; archived month tabs (see partitions.py) are read as the import reaches them.
+    A statement row is new once it occurs more often than the sheet already holds it,
+    so two identical coffees on one day both import, and a re-run imports nothing.
+    """
+
+    def __init__(self, sh, backend):
+        self.sh = sh
+        self.cache_key = backend.cache_key
+        self.archived = {}
+        self.seen = {}
+        self.months = set()
+        self.titles = {ws.title for ws in sh.worksheets()}
+        backend.get_transactions() # Only downloads rows added since the last sync
+
+    def _add_tab(self, title: str):
+        values, = [r.get("values", []) for r in self.sh.values_batch_get([title])["valueRanges"]]
+        if len(values) < 2:
+            return
+        df, _ = schema.from_rows(values[0], values[1:])
+        for key in schema.row_keys(df).tolist():
+            self.archived[key] = self.archived.get(key, 0) + 1
+
+    def new_rows(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Boolean mask of the rows of df not already in the sheet (nor earlier in this import).
+        """
+        for month in df["Date"].dt.to_period("M").unique():
+            title = f"{PARTITION_PREFIX}{month.year:04d}_{month.month:02d}"
+            if month not in self.months and title in self.titles:
+                self._add_tab(title)
+            self.months.add(month)
+        keys = schema.row_keys(df).tolist()
+        synced = local_cache.key_counts(self.cache_key, keys)
+        new = np.empty(len(df), dtype=bool)
+        for i, key in enumerate(keys):
+            seen = self.seen.get(key, 0)
+            new[i] = seen >= synced.get(key, 0) + self.archived.get(key, 0)
+            self.seen[key] = seen + 1
+        return new
+
+
+def import_statement(sh, path: str, fmt: str = None, overrides: dict = None, delimiter: str = ",",
+                     chunk_rows: int = CHUNK_ROWS, batch_rows: int = BATCH_ROWS, dry_run: bool = False,
+                     backend: SheetsBackend = None, **options) -> dict:
+    """
+    Streams a CSV/OFX/CAMT statement into the Transactions tab.
+    `backend` reads the sheet through the app's local cache (default: one on `sh` under the app's sheet name).
+    `options` go to normalize(). Returns counts: read, invalid, expenses, duplicates, imported, append_calls.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt == "csv":
+        chunks = read_csv_chunks(path, overrides, delimiter, chunk_rows)
+    elif fmt == "ofx":
+        chunks = read_ofx_chunks(path, chunk_rows)
+    elif fmt == "camt":
+        chunks = read_camt_chunks(path, chunk_rows)
+    else:
+        raise ValueError(f"Unknown statement format: {fmt}")
+
+    existing = ExistingRows(sh, backend or SheetsBackend(lambda: sh, setup_sheet.SHEET_NAME))
+    ws = sh.worksheet("Transactions")
+    stats = dict.fromkeys(["read", "invalid", "expenses", "duplicates", "imported", "append_calls"], 0)
+    batch = []
+
+    def write(rows: list):
+        if rows and not dry_run:
+            ws.append_rows(rows)
+            stats["append_calls"] += 1
+        stats["imported"] += len(rows)
+
+    for chunk in chunks:
+        stats["read"] += len(chunk)
+        df, invalid = normalize(chunk, **options)
+        stats["invalid"] += invalid
+        stats["expenses"] += len(df)
+        new = existing.new_rows(df)
+        stats["duplicates"] += int((~new).sum())
+        batch.extend(schema.to_sheet_rows(df[new]))
+        while len(batch) >= batch_rows:
+            write(batch[:batch_rows])
+            del batch[:batch_rows]
+    write(batch)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import a bank statement (CSV, OFX/QFX or camt.053 XML) into the Transactions tab.")
+    parser.add_argument("path", help="Statement file")
+    parser.add_argument("--format", choices=["csv", "ofx", "camt"], help="Defaults to the file extension")
+    parser.add_argument("--currency", default="EUR", help="Currency of rows without one (default: EUR)")
+    parser.add_argument("--category", help="Put every row in this category instead of guessing from the description")
+    parser.add_argument("--positive-spend", action="store_true", help="Spend is positive in this statement (credit card exports)")
+    parser.add_argument("--dayfirst", action="store_true", help="Dates are DD/MM/YYYY")
+    parser.add_argument("--decimal", default=".", help="Decimal separator of CSV amounts (e.g. ',')")
+    parser.add_argument("--delimiter", default=",", help="CSV field separator (e.g. ';')")
+    for field in ("Date", "Amount", "Currency", "Description", "Category"):
+        parser.add_argument(f"--{field.lower()}-column", help=f"CSV column holding {field}")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be imported without writing")
+    args = parser.parse_args()
+
+    overrides = {field: getattr(args, f"{field.lower()}_column") for field in COLUMN_ALIASES}
+    print(f"Connecting to '{setup_sheet.SHEET_NAME}'...")
+    sh = quota.QuotaClient(setup_sheet.authorize()).open(setup_sheet.SHEET_NAME)
+    stats = import_statement(
+        sh, args.path, fmt=args.format, overrides=overrides, delimiter=args.delimiter, dry_run=args.dry_run,
+        currency=args.currency, category=args.category, decimal=args.decimal, dayfirst=args.dayfirst,
+        positive_spend=args.positive_spend,
+    )
+    income = stats["read"] - stats["invalid"] - stats["expenses"]
+    print(f"Read {stats['read']} row(s): {stats['expenses']} expense(s), {income} income, {stats['invalid']} unreadable; "
+          f"{stats['duplicates']} expense(s) already in the sheet.")
+    verb = "Would import" if args.dry_run else "Imported"
+    print(f"{verb} {stats['imported']} row(s) in {stats['append_calls']} append call(s).")
+
+if __name__ == "__main__":
+    main()
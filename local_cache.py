@@ -0,0 +1,241 @@
+import contextlib
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import pandas as pd
+import budget_logic
+import schema
+import tracing
+
+# Local on-disk state lives next to the app unless overridden (tests, Cloud)
+CACHE_DIR = os.environ.get("BUDGET_CACHE_DIR", ".budget_cache")
+CACHE_DB = "transactions.sqlite"
+# Idempotency keys older than this are forgotten
+IDEMPOTENCY_RETENTION = 24 * 3600
+
+
+_schema_ready = set() # Database paths whose tables exist in this process
+
+
+@contextlib.contextmanager
+def _connect():
+    # One transaction on a connection that is closed afterwards; the schema is checked once per database
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, CACHE_DB)
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            if path not in _schema_ready:
+                _create_schema(conn)
+                _schema_ready.add(path)
+            yield conn
+    finally:
+        conn.close()
+
+
+def _create_schema(conn: sqlite3.Connection):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS sync_state ("
+        "sheet TEXT PRIMARY KEY, header TEXT NOT NULL, cursor INTEGER NOT NULL, "
+        "archived INTEGER NOT NULL DEFAULT 0)"
+    )
+    if "archived" not in [row[1] for row in conn.execute("PRAGMA table_info(sync_state)")]:
+        # Caches created before partitioning
+        conn.execute("ALTER TABLE sync_state ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, created REAL NOT NULL)")
+
+
+def _table(sheet_name: str, prefix: str = "tx_") -> str:
+    # One table per spreadsheet so a header change only drops that sheet's rows
+    return prefix + hashlib.sha1(sheet_name.encode()).hexdigest()[:12]
+
+
+@tracing.traced("cache.load_transactions")
+def load_transactions(sheet_name: str) -> tuple:
+    """
+    Returns (compact DataFrame, header, cursor) for the cached copy of a sheet.
+    The cursor is the number of sheet data rows already synced.
+    """
+    with _connect() as conn:
+        state = conn.execute(
+            "SELECT header, cursor FROM sync_state WHERE sheet = ?", (sheet_name,)
+        ).fetchone()
+        if state is None:
+            return schema.empty_transactions(), [], 0
+
+        header, cursor = json.loads(state[0]), state[1]
+        try:
+            df = pd.read_sql(f"SELECT * FROM {_table(sheet_name)} ORDER BY _row", conn)
+        except (pd.errors.DatabaseError, sqlite3.OperationalError):
+            # Synced an empty sheet: there is a cursor but no table yet
+            return schema.empty_transactions(), header, cursor
+
+    df = df.drop(columns="_row")
+    if list(df.columns) != schema.TRANSACTION_COLUMNS:
+        # Written by an older layout: start over with a full sync
+        reset(sheet_name)
+        return schema.empty_transactions(), [], 0
+    # Rows were validated before they were stored, and Dates are ISO strings (fast fixed-format path)
+    df["Date"] = pd.to_datetime(df["Date"], format="ISO8601")
+    return schema.restore_dtypes(df), header, cursor
+
+
+def archived_rows(sheet_name: str) -> int:
+    """
+    Rows the sheet's partition manifest reported as archived at the last sync.
+    """
+    with _connect() as conn:
+        state = conn.execute("SELECT archived FROM sync_state WHERE sheet = ?", (sheet_name,)).fetchone()
+    return state[0] if state else 0
+
+
+def load_rollup(sheet_name: str) -> pd.Series:
+    """
+    Month x category spend of everything synced so far (see budget_logic.build_rollup).
+    """
+    with _connect() as conn:
+        try:
+            df = pd.read_sql(f"SELECT * FROM {_table(sheet_name, 'ru_')}", conn)
+        except (pd.errors.DatabaseError, sqlite3.OperationalError):
+            return budget_logic.build_rollup(pd.DataFrame())
+    return df.set_index(budget_logic.ROLLUP_KEYS)["Amount_EUR"].sort_index()
+
+
+def _update_rollup(conn: sqlite3.Connection, sheet_name: str, new_df: pd.DataFrame):
+    delta = budget_logic.build_rollup(new_df)
+    if delta.empty:
+        return
+    table = _table(sheet_name, "ru_")
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {table} ("
+        "Year INTEGER, Month INTEGER, Category TEXT, Amount_EUR REAL, "
+        "PRIMARY KEY (Year, Month, Category))"
+    )
+    conn.executemany(
+        f"INSERT INTO {table} VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (Year, Month, Category) DO UPDATE SET Amount_EUR = Amount_EUR + excluded.Amount_EUR",
+        [(int(year), int(month), category, float(amount)) for (year, month, category), amount in delta.items()],
+    )
+
+
+def _exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def _add_keys(conn: sqlite3.Connection, table: str, df: pd.DataFrame):
+    counts = pd.Series(schema.row_keys(df)).value_counts()
+    conn.executemany(
+        f"INSERT INTO {table} VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET count = count + excluded.count",
+        [(int(key), int(count)) for key, count in counts.items()],
+    )
+
+
+def _keys_table(conn: sqlite3.Connection, sheet_name: str) -> str:
+    # Content key -> number of synced rows with it; built from the cached rows the first time
+    table = _table(sheet_name, "ck_")
+    if not _exists(conn, table):
+        conn.execute(f"CREATE TABLE {table} (key INTEGER PRIMARY KEY, count INTEGER NOT NULL)")
+        if _exists(conn, _table(sheet_name)):
+            cached = pd.read_sql(f"SELECT Date, Amount_Cents, Currency, Description FROM {_table(sheet_name)}", conn)
+            cached["Date"] = pd.to_datetime(cached["Date"], format="ISO8601")
+            _add_keys(conn, table, cached)
+    return table
+
+
+def key_counts(sheet_name: str, keys) -> dict:
+    """
+    How many synced rows carry each content key (see schema.row_keys); keys never seen are left out.
+    Primary key lookups on the local index, no Sheets read.
+    """
+    keys = [int(key) for key in set(keys)]
+    found = {}
+    with _connect() as conn:
+        table = _keys_table(conn, sheet_name)
+        for start in range(0, len(keys), 500): # SQLite caps bound parameters
+            chunk = keys[start:start + 500]
+            found.update(conn.execute(
+                f"SELECT key, count FROM {table} WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+            ).fetchall())
+    return found
+
+
+def claim_key(key: str, ttl: float) -> bool:
+    """
+    Records an idempotency key; False if it was already claimed less than ttl seconds ago.
+    Atomic across threads and processes sharing the cache.
+    """
+    return claim_keys([(key, ttl)])[0]
+
+
+def claim_keys(claims: list) -> list:
+    """
+    claim_key for several (key, ttl) pairs in one transaction; a key repeated in the list is claimed once.
+    """
+    now = time.time()
+    with _connect() as conn:
+        claimed = [
+            conn.execute(
+                "INSERT INTO idempotency_keys VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET created = excluded.created WHERE created < ?",
+                (key, now, now - ttl),
+            ).rowcount > 0
+            for key, ttl in claims
+        ]
+        conn.execute("DELETE FROM idempotency_keys WHERE created < ?", (now - IDEMPOTENCY_RETENTION,))
+    return claimed
+
+
+def release_key(*keys: str):
+    """
+    Forgets claimed keys, e.g. when the write they guarded failed and may be retried.
+    """
+    with _connect() as conn:
+        conn.executemany("DELETE FROM idempotency_keys WHERE key = ?", [(key,) for key in keys])
+
+
+@tracing.traced("cache.append_transactions")
+def append_transactions(sheet_name: str, header: list, new_df: pd.DataFrame, since: int, cursor: int, archived: int = 0) -> bool:
+    """
+    Appends rows synced from sheet row `since` up to `cursor`, folds them into the rollup
+    and the content key index and advances the sync cursor in one transaction. `archived`
+    is the manifest's archived row count the cursor is relative to.
+    Returns False, changing nothing, when another process (e.g. an import) moved the cursor
+    past `since` first: its sync already stored these rows.
+    """
+    with _connect() as conn:
+        # Claim the cursor first: the UPDATE takes the write lock, so a concurrent sync waits and then loses
+        moved = conn.execute(
+            "UPDATE sync_state SET header = ?, cursor = ?, archived = ? WHERE sheet = ? AND cursor = ?",
+            (json.dumps(header), cursor, archived, sheet_name, since),
+        ).rowcount
+        if not moved and not since:
+            # First sync of this sheet, unless another process got there first
+            moved = conn.execute(
+                "INSERT OR IGNORE INTO sync_state (sheet, header, cursor, archived) VALUES (?, ?, ?, ?)",
+                (sheet_name, json.dumps(header), cursor, archived),
+            ).rowcount
+        if not moved:
+            tracing.count("cache.sync_conflicts")
+            return False
+        if not new_df.empty:
+            _update_rollup(conn, sheet_name, new_df)
+            _add_keys(conn, _keys_table(conn, sheet_name), new_df) # Before the rows land, or a first build counts them twice
+            stored = new_df.copy()
+            if "Date" in stored.columns:
+                stored["Date"] = stored["Date"].dt.strftime("%Y-%m-%dT%H:%M:%S")
+            stored.insert(0, "_row", range(since, since + len(stored)))
+            stored.to_sql(_table(sheet_name), conn, if_exists="append", index=False)
+    return True
+
+
+def reset(sheet_name: str):
+    """
+    Drops the cached rows and cursor so the next load does a full sync.
+    """
+    with _connect() as conn:
+        conn.execute(f"DROP TABLE IF EXISTS {_table(sheet_name)}")
+        conn.execute(f"DROP TABLE IF EXISTS {_table(sheet_name, 'ru_')}")
+        conn.execute(f"DROP TABLE IF EXISTS {_table(sheet_name, 'ck_')}")
+        conn.execute("DELETE FROM sync_state WHERE sheet = ?", (sheet_name,))
@@ -0,0 +1,103 @@
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import schema
+import setup_sheet
+from storage import MANIFEST_HEADER, MANIFEST_TAB, PARTITION_PREFIX, parse_manifest
+
+
+def partition_title(year: int, month: int) -> str:
+    return f"{PARTITION_PREFIX}{year:04d}_{month:02d}"
+
+
+def _summaries(title: str, df: pd.DataFrame) -> pd.DataFrame:
+    # Manifest rows for one month: row count and spend per category
+    by_category = df.groupby("Category", observed=True)["Amount_EUR_Cents"].agg(["size", "sum"])
+    return pd.DataFrame({
+        "Partition": title,
+        "Year": int(df["Date"].dt.year.iloc[0]),
+        "Month": int(df["Date"].dt.month.iloc[0]),
+        "Category": by_category.index.astype("str"),
+        "Rows": by_category["size"].to_numpy(),
+        "Amount_EUR": by_category["sum"].to_numpy() / 100,
+    })
+
+
+def compact_manifest(manifest: pd.DataFrame) -> list:
+    """
+    One manifest row per (partition, category), as sheet values with the header first.
+    Months archived in several runs (late entries) collapse into a single summary.
+    """
+    keys = ["Partition", "Year", "Month", "Category"]
+    merged = manifest.groupby(keys, as_index=False)[["Rows", "Amount_EUR"]].sum().sort_values(keys)
+    merged["Amount_EUR"] = merged["Amount_EUR"].round(2)
+    return [MANIFEST_HEADER] + merged[MANIFEST_HEADER].values.tolist()
+
+
+def archive_closed_months(sh, before=None) -> dict:
+    """
+    Moves rows of months before `before` (default: the current month) out of the
+    Transactions tab into one tab per month, and records per-category summaries in
+    the manifest so loaders never have to read those months again.
+    Rows with an invalid Date or amount stay in the Transactions tab.
+    Not safe against concurrent appends: run it while nobody is adding transactions.
+    Returns {partition tab: rows moved}.
+    """
+    cutoff = pd.Period(before if before is not None else datetime.today(), "M")
+    ws = sh.worksheet("Transactions")
+    values = ws.get_all_values()
+    if len(values) < 2:
+        return {}
+    header, rows = values[0], [row[:len(values[0])] for row in values[1:]]
+    rows = [row for row in rows if any(cell != "" for cell in row)]
+
+    # Validated, typed view of the same rows; `valid` maps it back to sheet rows
+    df, bad = schema.from_frame(pd.DataFrame(rows, columns=header), first_row=0)
+    valid = np.setdiff1d(np.arange(len(rows)), bad["Row"].to_numpy())
+    months = df["Date"].dt.to_period("M")
+    closed = (months < cutoff).to_numpy()
+    if not closed.any():
+        return {}
+
+    moved, summaries = {}, []
+    for month in sorted(months[closed].unique()):
+        in_month = (months == month).to_numpy()
+        title = partition_title(month.year, month.month)
+        partition = setup_sheet.ensure_worksheet(sh, title, header)
+        # RAW like the app's own writes: Sheets must not turn a description such as "=1+1" into a formula
+        partition.append_rows([rows[i] for i in valid[in_month]], value_input_option="RAW")
+        moved[title] = int(in_month.sum())
+        summaries.append(_summaries(title, df[in_month]))
+
+    manifest_ws = setup_sheet.ensure_worksheet(sh, MANIFEST_TAB, MANIFEST_HEADER, rows=100, cols=len(MANIFEST_HEADER))
+    manifest = pd.concat([parse_manifest(manifest_ws.get_all_values()), *summaries], ignore_index=True)
+    manifest_ws.clear()
+    manifest_ws.update(range_name="A1", values=compact_manifest(manifest))
+
+    # Partitions and manifest are written first, so an interrupted run only ever duplicates rows
+    archived = set(valid[closed].tolist())
+    keep = [row for i, row in enumerate(rows) if i not in archived]
+    if keep:
+        ws.update(range_name="A2", values=keep, value_input_option="RAW")
+    ws.delete_rows(len(keep) + 2, len(values))
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive closed months of the Transactions tab into monthly partitions.")
+    parser.add_argument("--before", help="Archive months before this one (YYYY-MM); defaults to the current month")
+    args = parser.parse_args()
+
+    print(f"Connecting to '{setup_sheet.SHEET_NAME}'...")
+    sh = setup_sheet.authorize().open(setup_sheet.SHEET_NAME)
+    moved = archive_closed_months(sh, before=args.before)
+    if not moved:
+        print("Nothing to archive.")
+    for title, count in moved.items():
+        print(f"Archived {count} row(s) to {title}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import random
+import threading
+import time
+
+import tracing
+
+# Sheets API calls that only read, so they may be retried after a 5xx and shared between callers
+READ_METHODS = {
+    "open", "worksheet", "worksheets", "values_batch_get", "fetch_sheet_metadata",
+    "get_values", "get_all_values", "get_all_records", "row_values", "batch_get",
+    "list_spreadsheet_files",
+}
+
+
+def status_code(error: Exception):
+    """
+    HTTP status of a gspread APIError (or anything carrying a response), else None.
+    """
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def is_quota_error(error: Exception) -> bool:
+    return status_code(error) == 429
+
+
+def is_transient_error(error: Exception) -> bool:
+    code = status_code(error)
+    return code == 429 or (code is not None and code >= 500) or isinstance(error, (ConnectionError, TimeoutError))
+
+
+def with_backoff(fn, retryable=is_transient_error, retries: int = 5, base_delay: float = 1.0, max_delay: float = 32.0):
+    """
+    Calls fn(), retrying retryable errors with full-jitter exponential backoff.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == retries or not retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            tracing.count("sheets.retries")
+            time.sleep(delay)
+
+
+class TokenBucket:
+    """
+    Allows `rate` calls per second on average and bursts of up to `capacity`.
+    Callers over budget reserve a token and sleep until it is theirs, so waits stay first come, first served.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Takes one token, sleeping if needed. Returns the seconds waited.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            tracing.count("sheets.throttled_seconds", wait)
+            time.sleep(wait)
+        return wait
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer:
+    """
+    Merges identical concurrent calls: the first caller runs fn, the others wait for its result.
+    Shared results must be treated as read-only.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            tracing.count("sheets.coalesced")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+class _Proxy:
+    """
+    Forwards attribute access to a gspread object; method calls go through QuotaClient.call.
+    """
+
+    def __init__(self, quota, target):
+        self._quota = quota
+        self._target = target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            return self._quota.call(attr, args, kwargs, write=name not in READ_METHODS)
+        return method
+
+
+class QuotaSpreadsheet(_Proxy):
+    """
+    Spreadsheet handle with cached worksheet handles and coalesced batch reads.
+    """
+
+    def __init__(self, quota, target):
+        super().__init__(quota, target)
+        self._worksheets = {}
+
+    def worksheet(self, title: str):
+        ws = self._worksheets.get(title)
+        if ws is None:
+            ws = _Proxy(self._quota, self._quota.call(self._target.worksheet, (title,), {}))
+            self._worksheets[title] = ws
+        return ws
+
+    def add_worksheet(self, title: str, *args, **kwargs):
+        ws = _Proxy(self._quota, self._quota.call(self._target.add_worksheet, (title,) + args, kwargs, write=True))
+        self._worksheets[title] = ws
+        return ws
+
+    def del_worksheet(self, worksheet):
+        self._worksheets.pop(worksheet.title, None)
+        target = worksheet._target if isinstance(worksheet, _Proxy) else worksheet
+        return self._quota.call(self._target.del_worksheet, (target,), {}, write=True)
+
+    def values_batch_get(self, ranges: list, params: dict = None):
+        key = (self._target.id, tuple(ranges), repr(params))
+        return self._quota.call(self._target.values_batch_get, (ranges,), {"params": params}, key=key)
+
+
+class QuotaClient(_Proxy):
+    """
+    Wraps an authorized gspread client (or fake_sheets.FakeClient) so that every API call
+    takes a token from a shared bucket, identical concurrent reads are merged into one
+    request, and 429/5xx answers are retried with jittered exponential backoff.
+    Spreadsheets opened by title are cached for the life of the client.
+    """
+
+    def __init__(self, client, rate: float = 0.8, burst: int = 12, retries: int = 5, base_delay: float = 1.0):
+        super().__init__(self, client)
+        self.bucket = TokenBucket(rate, burst)
+        self.coalescer = Coalescer()
+        self.retries = retries
+        self.base_delay = base_delay
+        self._spreadsheets = {}
+        self._lock = threading.Lock()
+
+    def call(self, fn, args: tuple, kwargs: dict, write: bool = False, key=None):
+        """
+        Runs fn(*args, **kwargs) under the rate limit and retry policy.
+        Writes are only retried on 429: after a 5xx the write may already have landed.
+        """
+        def attempt():
+            self.bucket.acquire()
+            return fn(*args, **kwargs)
+
+        def run():
+            return with_backoff(
+                attempt, is_quota_error if write else is_transient_error,
+                retries=self.retries, base_delay=self.base_delay,
+            )
+        return self.coalescer.do(key, run) if key is not None else run()
+
+    def open(self, title: str) -> QuotaSpreadsheet:
+        with self._lock:
+            sh = self._spreadsheets.get(title)
+        if sh is None:
+            # Drive lookup by title happens once per process, not once per read
+            with tracing.span("sheets.open"):
+                sh = QuotaSpreadsheet(self, self.call(self._target.open, (title,), {}, key=("open", title)))
+            tracing.count("sheets.calls")
+            with self._lock:
+                sh = self._spreadsheets.setdefault(title, sh)
+        return sh
+
+    def create(self, title: str, *args, **kwargs) -> QuotaSpreadsheet:
+        sh = QuotaSpreadsheet(self, self.call(self._target.create, (title,) + args, kwargs, write=True))
+        with self._lock:
+            self._spreadsheets[title] = sh
+        return sh
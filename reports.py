@@ -0,0 +1,245 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+import budget_logic
+import tracing
+
+# Bump when the report layout changes: every cached report is rendered again
+REPORT_VERSION = 1
+FORMATS = {"pdf": "application/pdf", "png": "image/png"}
+STATUS_COLORS = {"Exceeded": "#FF4B4B", "Warning": "#FFA500", "OK": "#00CC96", "No limit": "#8C8C8C"}
+
+
+def aggregate(df: pd.DataFrame, rules: pd.DataFrame, rollup: pd.Series, months: list,
+              limit: float = budget_logic.TOTAL_BUDGET, cache=None) -> dict:
+    """
+    Report inputs per month ("YYYY-MM" -> plain dict), sliced from one month x category rollup
+    and one daily spend series (kept in `cache`, see budget_logic.daily_spend), so workers
+    receive a few hundred bytes per month.
+    """
+    if rollup is None:
+        rollup = budget_logic.build_rollup(df)
+    periods = sorted({pd.Period(month, "M") for month in months})
+    if not periods:
+        return {}
+    daily = budget_logic.daily_spend(df, cache)
+    status = budget_logic.evaluate_category_limits(df, rules, periods[0], periods[-1], rollup=rollup)
+
+    payloads = {}
+    for period in periods:
+        ruled = status[(status["Year"] == period.year) & (status["Month"] == period.month)] if not status.empty else status
+        categories = [
+            {"Category": str(row.Category), "Amount_EUR": round(float(row.Amount_EUR), 2),
+             "Monthly_Limit": float(row.Monthly_Limit), "Status": str(row.Status)}
+            for row in ruled.itertuples()
+        ]
+        try:
+            spent = rollup.loc[(period.year, period.month)]
+        except KeyError:
+            spent = pd.Series(dtype=float)
+        ruled_names = {category["Category"] for category in categories}
+        categories += [
+            {"Category": str(name), "Amount_EUR": round(float(amount), 2), "Monthly_Limit": None, "Status": "No limit"}
+            for name, amount in spent.items() if str(name) not in ruled_names
+        ]
+        days = daily.loc[period.start_time:period.end_time]
+        payloads[str(period)] = {
+            "month": str(period),
+            "days_in_month": period.days_in_month,
+            "limit": float(limit),
+            "total": round(float(spent.sum()), 2),
+            "categories": categories,
+            "daily": [[int(day.day), round(float(amount), 2)] for day, amount in days.items()],
+        }
+    return payloads
+
+
+def version_key(payload: dict, fmt: str) -> str:
+    """
+    Content hash of a month's report inputs: unchanged months keep their cached file.
+    """
+    raw = json.dumps([REPORT_VERSION, fmt, payload], sort_keys=True)
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+def render_report(payload: dict, path: str, fmt: str) -> str:
+    """
+    Draws one month's report (category bars vs limits, daily trend, limit compliance) to path.
+    Runs in a worker process.
+    """
+    # Imported here: only the workers ever load matplotlib
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8.27, 11.69)) # A4 portrait
+    bars, trend, table = fig.subplots(3, 1, gridspec_kw={"height_ratios": [3, 3, 2]})
+    fig.suptitle(f"Spending report {payload['month']}: €{payload['total']:.2f} of €{payload['limit']:.2f}", fontsize=14)
+
+    categories = payload["categories"]
+    names = [category["Category"] for category in categories]
+    bars.bar(names, [category["Amount_EUR"] for category in categories],
+             color=[STATUS_COLORS.get(category["Status"], "#8C8C8C") for category in categories])
+    limits = [np.nan if category["Monthly_Limit"] is None else category["Monthly_Limit"] for category in categories]
+    if names:
+        bars.scatter(names, limits, marker="_", s=900, color="black", label="Monthly limit", zorder=3)
+        bars.legend(loc="upper right")
+    bars.set_title("Spend by category")
+    bars.set_ylabel("€")
+
+    days = np.arange(1, payload["days_in_month"] + 1)
+    spend = np.zeros(len(days))
+    for day, amount in payload["daily"]:
+        spend[day - 1] = amount
+    trend.bar(days, spend, color="#9DB4FF", label="Daily spend")
+    cumulative = trend.twinx()
+    cumulative.plot(days, np.cumsum(spend), color="#1F3A93", label="Cumulative")
+    cumulative.plot(days, days * payload["limit"] / len(days), color="#FF4B4B", linestyle="--", label="Budget pace")
+    cumulative.set_ylabel("Cumulative €")
+    cumulative.legend(loc="upper left")
+    if not payload["daily"] and payload["total"]:
+        trend.text(0.5, 0.5, "Daily detail archived", ha="center", va="center", transform=trend.transAxes)
+    trend.set_title("Daily trend")
+    trend.set_xlim(0.5, len(days) + 0.5)
+
+    table.axis("off")
+    if categories:
+        rows = [[
+            category["Category"], f"€{category['Amount_EUR']:.2f}",
+            "-" if category["Monthly_Limit"] is None else f"€{category['Monthly_Limit']:.2f}", category["Status"],
+        ] for category in categories]
+        table.table(cellText=rows, colLabels=["Category", "Spent", "Limit", "Status"], loc="center", cellLoc="center")
+    table.set_title("Limit compliance")
+
+    fig.tight_layout()
+    fig.savefig(path + ".tmp", format=fmt, dpi=110)
+    os.replace(path + ".tmp", path) # A half-written report never looks cached
+    return path
+
+
+class ReportJob:
+    """
+    One batch of monthly reports in flight. Safe to poll from any session.
+    """
+
+    def __init__(self, months: list, fmt: str):
+        self.months = list(months)
+        self.fmt = fmt
+        self.paths = {}  # month -> rendered file
+        self.errors = {} # month -> message
+        self._lock = threading.Lock()
+
+    def _finish(self, month: str, path: str = None, error: str = None):
+        with self._lock:
+            if path:
+                self.paths[month] = path
+            else:
+                self.errors[month] = error
+
+    def progress(self) -> tuple:
+        """
+        (finished, total) months, failed ones included.
+        """
+        with self._lock:
+            return len(self.paths) + len(self.errors), len(self.months)
+
+    @property
+    def done(self) -> bool:
+        finished, total = self.progress()
+        return finished == total
+
+
+class ReportRenderer:
+    """
+    Renders monthly reports on a process pool shared by every session and tenant, so
+    charts never block a rerun. Files are cached by content (see version_key).
+    A pool broken by a dying worker (out of memory, a crash in matplotlib) is replaced,
+    and the months it lost are tried once more on the new one.
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # Spawned, not forked: the app process runs threads (flushers, revalidation)
+                self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def submit(self, payloads: dict, out_dir: str, fmt: str = "pdf") -> ReportJob:
+        """
+        Starts rendering every month in payloads (see aggregate) into out_dir and returns the job.
+        Months whose inputs did not change since their last render are done immediately.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown report format {fmt}")
+        os.makedirs(out_dir, exist_ok=True)
+        job = ReportJob(payloads, fmt)
+        for month, payload in payloads.items():
+            path = os.path.join(out_dir, f"report-{month}-{version_key(payload, fmt)}.{fmt}")
+            if os.path.exists(path):
+                tracing.count("reports.cached")
+                job._finish(month, path)
+                continue
+            self._render(job, month, payload, path, out_dir)
+        return job
+
+    def _render(self, job: ReportJob, month: str, payload: dict, path: str, out_dir: str, retries: int = 1):
+        pool = self._executor()
+        try:
+            future = pool.submit(render_report, payload, path, job.fmt)
+        except BrokenProcessPool as e:
+            self._broken(job, month, payload, path, out_dir, retries, pool, e)
+            return
+        future.add_done_callback(
+            lambda future: self._done(job, month, payload, path, out_dir, retries, pool, future)
+        )
+
+    def _broken(self, job: ReportJob, month: str, payload: dict, path: str, out_dir: str, retries: int, pool, error):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None # The next submit starts a fresh pool
+        pool.shutdown(wait=False, cancel_futures=True)
+        tracing.count("reports.pool_broken")
+        if retries:
+            self._render(job, month, payload, path, out_dir, retries - 1)
+        else:
+            tracing.record_error(f"Report {month}", error)
+            job._finish(month, error=str(error))
+
+    def _done(self, job: ReportJob, month: str, payload: dict, path: str, out_dir: str, retries: int, pool, future):
+        try:
+            path = future.result()
+        except BrokenProcessPool as e:
+            self._broken(job, month, payload, path, out_dir, retries, pool, e)
+            return
+        except Exception as e:
+            tracing.record_error(f"Report {month}", e)
+            job._finish(month, error=str(e))
+            return
+        tracing.count("reports.rendered")
+        # Older finished versions of this month's report in the same format are superseded;
+        # other formats and other renders' .tmp files are left alone
+        for entry in os.listdir(out_dir):
+            if (entry.startswith(f"report-{month}-") and entry.endswith(f".{job.fmt}")
+                    and os.path.join(out_dir, entry) != path):
+                try:
+                    os.remove(os.path.join(out_dir, entry))
+                except OSError:
+                    pass
+        job._finish(month, path)
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+# Compact in-memory layout of the Transactions tab. Money is held as exact
+# integer cents; repeated labels are categoricals.
+TRANSACTION_DTYPES = {
+    "Date": "datetime64[ns]",
+    "Amount_Cents": "int64",
+    "Currency": "category",
+    "Category": "category",
+    "Description": "str",
+    "Amount_EUR_Cents": "int64",
+}
+TRANSACTION_COLUMNS = list(TRANSACTION_DTYPES)
+CATEGORICAL_COLUMNS = [col for col, dtype in TRANSACTION_DTYPES.items() if dtype == "category"]
+
+# Columns shown to people (and written to the sheet), in sheet order
+DISPLAY_COLUMNS = ["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"]
+
+
+def empty_transactions() -> pd.DataFrame:
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in TRANSACTION_DTYPES.items()})
+
+
+def empty_bad_rows() -> pd.DataFrame:
+    return pd.DataFrame({"Row": pd.Series(dtype="int64"), "Reason": pd.Series(dtype="str")})
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype("datetime64[ns]")
+    # Fast fixed-format pass first; only the leftovers pay for format inference
+    dates = pd.to_datetime(values, format="ISO8601", errors="coerce")
+    leftover = dates.isna() & values.notna() & (values.astype("str") != "")
+    if leftover.any():
+        dates[leftover] = pd.to_datetime(values[leftover], format="mixed", errors="coerce")
+    return dates.astype("datetime64[ns]")
+
+
+def _to_cents(values: pd.Series) -> pd.Series:
+    return np.round(pd.to_numeric(values, errors="coerce") * 100)
+
+
+def from_frame(raw: pd.DataFrame, first_row: int = 2) -> tuple:
+    """
+    Validates and converts a sheet-shaped frame (DISPLAY_COLUMNS, any dtypes) in one vectorized pass.
+    Returns (compact DataFrame, bad rows). Bad rows carry their sheet row number
+    (first_row is the row number of raw's first record) and a reason, and are left out of the frame.
+    """
+    if raw.empty:
+        return empty_transactions(), empty_bad_rows()
+    raw = raw.reindex(columns=DISPLAY_COLUMNS) # Missing columns fail validation below
+
+    dates = _parse_dates(raw["Date"])
+    amount = _to_cents(raw["Amount"])
+    amount_eur = _to_cents(raw["Amount_EUR"])
+
+    reason = np.select(
+        [dates.isna().to_numpy(), amount.isna().to_numpy(), amount_eur.isna().to_numpy()],
+        ["invalid Date", "invalid Amount", "invalid Amount_EUR"],
+        default="",
+    )
+    bad = reason != ""
+    good = ~bad
+
+    df = pd.DataFrame({
+        "Date": dates[good].to_numpy(),
+        "Amount_Cents": amount[good].to_numpy().astype("int64"),
+        "Currency": pd.Categorical(raw["Currency"][good].fillna("").astype("str")),
+        "Category": pd.Categorical(raw["Category"][good].fillna("").astype("str")),
+        "Description": raw["Description"][good].fillna("").astype("str").to_numpy(dtype=object),
+        "Amount_EUR_Cents": amount_eur[good].to_numpy().astype("int64"),
+    })
+    bad_rows = pd.DataFrame({
+        "Row": np.flatnonzero(bad) + first_row,
+        "Reason": reason[bad],
+    }) if bad.any() else empty_bad_rows()
+    return df, bad_rows
+
+
+def from_rows(header: list, values: list, first_row: int = 2) -> tuple:
+    """
+    Same as from_frame, for raw sheet values (header plus list of rows).
+    Blank rows are skipped silently, as the sheet UI leaves them around.
+    """
+    if not header:
+        return empty_transactions(), empty_bad_rows()
+    rows, row_numbers = [], []
+    for offset, row in enumerate(values):
+        if any(cell != "" for cell in row):
+            rows.append(row[:len(header)])
+            row_numbers.append(first_row + offset)
+    df, bad_rows = from_frame(pd.DataFrame(rows, columns=header), first_row=0)
+    if not bad_rows.empty:
+        bad_rows["Row"] = np.asarray(row_numbers, dtype="int64")[bad_rows["Row"].to_numpy()]
+    return df, bad_rows
+
+
+def restore_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Re-applies the compact dtypes to already validated data (e.g. read back from SQLite).
+    """
+    if df.empty:
+        return empty_transactions()
+    return df.astype({col: dtype for col, dtype in TRANSACTION_DTYPES.items() if col in df.columns})
+
+
+def concat(frames: list) -> pd.DataFrame:
+    """
+    pd.concat that keeps Currency/Category categorical across frames with different categories.
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return empty_transactions()
+    if len(frames) == 1:
+        return frames[0]
+    out = pd.concat(frames, ignore_index=True)
+    for col in CATEGORICAL_COLUMNS:
+        if col in out.columns and not isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype("category")
+    return out
+
+
+def to_display(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sheet-shaped view with euro amounts, for small slices (tables, exports, sheet writes).
+    """
+    if "Amount_EUR_Cents" not in df.columns:
+        return df
+    return pd.DataFrame({
+        "Date": df["Date"],
+        "Amount": df["Amount_Cents"] / 100,
+        "Currency": df["Currency"].astype("str"),
+        "Category": df["Category"].astype("str"),
+        "Description": df["Description"],
+        "Amount_EUR": df["Amount_EUR_Cents"] / 100,
+    }, index=df.index)
+
+
+def to_sheet_rows(df: pd.DataFrame) -> list:
+    """
+    Rows as the sheet stores them: DISPLAY_COLUMNS order, ISO dates.
+    """
+    out = to_display(df)[DISPLAY_COLUMNS]
+    out["Date"] = out["Date"].dt.strftime("%Y-%m-%d")
+    return out.values.tolist()
+
+
+def row_keys(df: pd.DataFrame) -> np.ndarray:
+    """
+    Content key per transaction (signed 64-bit hash) of what identifies it on a statement:
+    day, amount, currency and description. Category is left out, as people re-file rows.
+    """
+    if df.empty:
+        return np.array([], dtype=np.int64)
+    return pd.util.hash_pandas_object(pd.DataFrame({
+        "Date": df["Date"].dt.normalize().to_numpy(dtype="datetime64[ns]").view("int64"),
+        "Amount": df["Amount_Cents"].to_numpy(),
+        "Currency": df["Currency"].astype("str").to_numpy(dtype=object),
+        "Description": df["Description"].astype("str").str.strip().str.lower().to_numpy(dtype=object),
+    }), index=False).to_numpy().view(np.int64)
@@ -1,5 +1,7 @@
 import gspread
+from gspread.utils import rowcol_to_a1
 from google.oauth2.service_account import Credentials
+from storage import TRANSACTION_HEADER, RULES_HEADER, DEFAULT_RULES, MANIFEST_TAB, MANIFEST_HEADER
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -8,71 +10,71 @@ SCOPES = [
 
 SHEET_NAME = "Personal Finance Tracker"
 
-def setup_sheet():
-    print(f"Connecting to '{SHEET_NAME}'...")
+def authorize():
+    """
+    gspread client from the service account file used by the command line tools.
+    """
     creds = Credentials.from_service_account_file(
         ".streamlit/credentials.json", scopes=SCOPES
     )
-    client = gspread.authorize(creds)
+    return gspread.authorize(creds)
+
+def setup_sheet(client=None):
+    print(f"Connecting to '{SHEET_NAME}'...")
+    if client is None:
+        client = authorize()
     
     try:
         sh = client.open(SHEET_NAME)
-        
-        # 1. Setup Transactions Tab
-        try:
-            ws_trans = sh.worksheet("Transactions")
-            print("Transactions tab exists.")
-        except gspread.WorksheetNotFound:
-            print("Creating Transactions tab...")
-            # Check if Sheet1 exists and is empty, rename it
-            try:
-                ws_default = sh.worksheet("Sheet1")
-                if not ws_default.get_all_values():
-                    ws_default.update_title("Transactions")
-                    ws_trans = ws_default
-                    print("Renamed Sheet1 to Transactions.")
-                else:
-                    ws_trans = sh.add_worksheet("Transactions", rows=1000, cols=10)
-            except gspread.WorksheetNotFound:
-                 ws_trans = sh.add_worksheet("Transactions", rows=1000, cols=10)
+        setup_spreadsheet(sh)
+    except Exception as e:
+        print(f"Error setting up sheet: {e}")
 
-        # Update Headers for Transactions
-        headers_trans = ["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"]
-        current_headers = ws_trans.row_values(1)
-        if not current_headers:
-            ws_trans.update(range_name="A1:F1", values=[headers_trans])
-            print("Added headers to Transactions.")
-        
-        # 2. Setup Budget_Rules Tab
+def ensure_worksheet(sh, title: str, header: list, rows: int = 1000, cols: int = 10, initial_rows: list = None):
+    """
+    Returns the worksheet called `title`, creating it and writing `header` first if needed.
+    `initial_rows` go below a header written here (e.g. default rules), never into an existing tab.
+    """
+    try:
+        ws = sh.worksheet(title)
+        print(f"{title} tab exists.")
+    except gspread.WorksheetNotFound:
+        print(f"Creating {title} tab...")
+        ws = sh.add_worksheet(title, rows=rows, cols=max(cols, len(header)))
+
+    if not ws.row_values(1):
+        ws.update(range_name=f"A1:{rowcol_to_a1(1, len(header))}", values=[header])
+        print(f"Added headers to {title}.")
+        if initial_rows:
+            ws.update(range_name=f"A2:{rowcol_to_a1(1 + len(initial_rows), len(header))}", values=initial_rows)
+            print(f"Added {len(initial_rows)} default rows to {title}.")
+    return ws
+
+def setup_spreadsheet(sh):
+    """
+    Creates the Transactions and Budget_Rules tabs (with headers and default rules) if missing.
+    Works on any gspread-compatible spreadsheet, including fake_sheets.FakeSpreadsheet.
+    """
+    # 1. Transactions: a new spreadsheet's empty Sheet1 becomes the Transactions tab
+    try:
+        sh.worksheet("Transactions")
+    except gspread.WorksheetNotFound:
         try:
-            ws_rules = sh.worksheet("Budget_Rules")
-            print("Budget_Rules tab exists.")
+            ws_default = sh.worksheet("Sheet1")
+            if not ws_default.get_all_values():
+                ws_default.update_title("Transactions")
+                print("Renamed Sheet1 to Transactions.")
         except gspread.WorksheetNotFound:
-            print("Creating Budget_Rules tab...")
-            ws_rules = sh.add_worksheet("Budget_Rules", rows=100, cols=5)
-        
-        # Update Headers for Budget_Rules
-        headers_rules = ["Category", "Monthly_Limit", "Alert_Threshold"]
-        current_headers_rules = ws_rules.row_values(1)
-        if not current_headers_rules:
-            ws_rules.update(range_name="A1:C1", values=[headers_rules])
-            print("Added headers to Budget_Rules.")
-            
-            # Add Default Rules
-            default_rules = [
-                ["Rent", 400, 380],
-                ["Food", 300, 270],
-                ["Travel", 200, 180],
-                ["Fun", 100, 90],
-                ["Other", 50, 45]
-            ]
-            ws_rules.update(range_name="A2:C6", values=default_rules)
-            print("Added default budget rules.")
+            pass
+    ensure_worksheet(sh, "Transactions", TRANSACTION_HEADER)
 
-        print("Sheet setup complete.")
+    # 2. Budget rules, seeded with the defaults
+    ensure_worksheet(sh, "Budget_Rules", RULES_HEADER, rows=100, cols=5, initial_rows=DEFAULT_RULES)
 
-    except Exception as e:
-        print(f"Error setting up sheet: {e}")
+    # 3. Manifest of archived months (see partitions.py)
+    ensure_worksheet(sh, MANIFEST_TAB, MANIFEST_HEADER, rows=100, cols=len(MANIFEST_HEADER))
+
+    print("Sheet setup complete.")
 
 if __name__ == "__main__":
     setup_sheet()
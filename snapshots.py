@@ -0,0 +1,73 @@
+import os
+import threading
+import weakref
+
+import pandas as pd
+
+import tracing
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError: # Optional: without it sessions share the loaded frame in memory
+    pa = None
+
+
+class SnapshotStore:
+    """
+    Immutable, versioned snapshots of one tenant's transactions as Arrow IPC files.
+    publish() writes the next version once and memory-maps it read-only: every session
+    reads the same pages (file-backed, so they live in the OS page cache rather than the
+    Python heap), and moving to a new version is a reference swap. Sessions still holding
+    an older version keep their mapping until they drop it. Publishing the frame of the
+    current version again (a sync that found no new rows) writes nothing.
+    """
+
+    def __init__(self, directory: str, name: str):
+        self.directory = directory
+        self.name = name
+        self.version = 0
+        self._published = None # (weakref to the source frame, its mapped copy) of the current version
+        self._lock = threading.Lock()
+
+    def _path(self, version: int) -> str:
+        return os.path.join(self.directory, f"{self.name}-{os.getpid()}-{version}.arrow")
+
+    def publish(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Publishes df as the next version and returns its read-only mapped copy (df itself without pyarrow).
+        """
+        if pa is None or df.empty:
+            return df
+        with self._lock:
+            if self._published and self._published[0]() is df:
+                tracing.count("snapshots.unchanged")
+                return self._published[1] # Same frame, so downstream caches keyed on it stay warm
+            path = self._path(self.version + 1)
+            try:
+                with tracing.span("snapshot.publish"):
+                    table = pa.Table.from_pandas(df)
+                    os.makedirs(self.directory, exist_ok=True)
+                    with pa.OSFile(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                    os.replace(path + ".tmp", path) # Readers never see a half-written version
+                    # split_blocks keeps every column a view of the mapped buffers
+                    frame = pa.ipc.open_file(pa.memory_map(path)).read_all().to_pandas(split_blocks=True)
+            except OSError as e:
+                tracing.record_error("Publishing snapshot", e)
+                return df # Keep serving the heap copy
+            self.version += 1
+            self._published = (weakref.ref(df), frame)
+            self._sweep(keep=path)
+        tracing.count("snapshots.published")
+        return frame
+
+    def _sweep(self, keep: str):
+        # Unlinking a mapped file is safe: its pages stay until the last reader lets go
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if entry.startswith(f"{self.name}-") and entry.endswith(".arrow") and path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass # Still mapped on Windows: the next publish retries
@@ -0,0 +1,405 @@
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import pandas as pd
+import budget_logic
+import local_cache
+import schema
+import tracing
+
+# Row format of the Transactions tab
+TRANSACTION_HEADER = ["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"]
+RULES_HEADER = ["Category", "Monthly_Limit", "Alert_Threshold"]
+DEFAULT_RULES = [
+    ["Rent", 400, 380],
+    ["Food", 300, 270],
+    ["Travel", 200, 180],
+    ["Fun", 100, 90],
+    ["Other", 50, 45]
+]
+
+# Closed months archived out of the Transactions tab (see partitions.py):
+# one "Transactions_YYYY_MM" tab per month, summarized in the manifest tab
+PARTITION_PREFIX = "Transactions_"
+MANIFEST_TAB = "Partitions"
+MANIFEST_HEADER = ["Partition", "Year", "Month", "Category", "Rows", "Amount_EUR"]
+
+
+def parse_transactions(header: list, values: list, first_row: int = 2) -> tuple:
+    """
+    Builds a compact typed DataFrame from raw sheet rows (as returned by get_values).
+    Returns (DataFrame, bad rows); see schema.from_rows.
+    """
+    with tracing.span("parse.transactions", rows=len(values)) as record:
+        df, bad_rows = schema.from_rows(header, values, first_row)
+        record["bad_rows"] = len(bad_rows)
+    return df, bad_rows
+
+
+def parse_rules(values: list) -> pd.DataFrame:
+    """
+    Builds a typed DataFrame from the raw Budget_Rules tab (header row first).
+    """
+    if not values:
+        return pd.DataFrame()
+    header = values[0]
+    rows = [row[:len(header)] for row in values[1:] if any(cell != "" for cell in row)]
+    df = pd.DataFrame(rows, columns=header)
+    for col in ("Monthly_Limit", "Alert_Threshold"):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def parse_manifest(values: list) -> pd.DataFrame:
+    """
+    Builds a typed DataFrame from the raw partition manifest tab (header row first).
+    """
+    if len(values) < 2:
+        return pd.DataFrame(columns=MANIFEST_HEADER)
+    df = pd.DataFrame([row[:len(MANIFEST_HEADER)] for row in values[1:] if any(cell != "" for cell in row)],
+                      columns=values[0][:len(MANIFEST_HEADER)])
+    for col in ("Year", "Month", "Rows"):
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype("int64")
+    df["Amount_EUR"] = pd.to_numeric(df["Amount_EUR"], errors='coerce').fillna(0.0)
+    return df
+
+
+def manifest_rollup(manifest: pd.DataFrame) -> pd.Series:
+    """
+    Month x category spend of the archived months, straight from their summaries.
+    """
+    if manifest is None or manifest.empty:
+        return budget_logic.build_rollup(pd.DataFrame())
+    return manifest.groupby(budget_logic.ROLLUP_KEYS)["Amount_EUR"].sum().sort_index()
+
+
+class StorageBackend:
+    """
+    Interface behind data_manager's get_transactions / get_budget_rules / add_transaction.
+    Methods raise on failure; data_manager turns errors into UI messages.
+    """
+    name = "base"
+    # Remote backends get new rows through the local write-behind journal
+    write_behind = False
+    # Rows the last load skipped as malformed (Row, Reason)
+    bad_rows = schema.empty_bad_rows()
+    # Called as on_sync(new_df, full) with the rows each sync brought in (full: the cache was rebuilt)
+    on_sync = None
+
+    def get_transactions(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def get_budget_rules(self) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def load_data(self) -> tuple:
+        return self.get_transactions(), self.get_budget_rules()
+
+    def append_rows(self, rows: list):
+        raise NotImplementedError
+
+    def get_rollup(self) -> pd.Series:
+        """
+        Month x category spend (see budget_logic.build_rollup).
+        Backends that keep it up to date incrementally override this.
+        """
+        return budget_logic.build_rollup(self.get_transactions())
+
+    def get_archive(self, months: list) -> pd.DataFrame:
+        """
+        Archived transactions of the given (year, month)s; backends that never archive have none.
+        """
+        return schema.empty_transactions()
+
+    def cached_transactions(self) -> pd.DataFrame:
+        """
+        Best local copy to show when a read fails.
+        """
+        return schema.empty_transactions()
+
+    def reset_cache(self):
+        pass
+
+    def nbytes(self) -> int:
+        """
+        Memory held by in-memory copies of the data (counted in the tenant pool's cap).
+        """
+        return 0
+
+    def release(self):
+        """
+        Drops in-memory copies; the next read rebuilds them from the local cache.
+        """
+
+
+class SheetsBackend(StorageBackend):
+    """
+    Google Sheets, or anything exposing the same API (see fake_sheets.FakeClient).
+    Transaction reads go through the local_cache sync cursor and only cover the
+    active Transactions tab; archived months are represented by their manifest summaries.
+    """
+    name = "sheets"
+    write_behind = True
+
+    def __init__(self, open_spreadsheet, sheet_name: str, cache_key: str = None):
+        # open_spreadsheet() returns a cached handle, or None when offline
+        self.open_spreadsheet = open_spreadsheet
+        self.sheet_name = sheet_name
+        self.cache_key = cache_key or sheet_name
+        # Whether the sheet has a partition manifest tab (None until checked),
+        # and the manifest as of the last sync
+        self.partitioned = None
+        self.manifest = None
+        # Sessions share this backend: one sync at a time, or two could append the same rows to the cache
+        self._sync_lock = threading.RLock()
+        # (frame, header, cursor) as of the last sync: later syncs only add the new rows to it
+        self._synced = None
+
+    def _load_cached(self) -> tuple:
+        # The local cache is only read back on a cold start, or after a reset or another process's sync
+        if self._synced is None:
+            self._synced = local_cache.load_transactions(self.cache_key)
+        return self._synced
+
+    def _batch_values(self, sh, ranges: list) -> list:
+        with tracing.span("sheets.values_batch_get", ranges=len(ranges)) as record:
+            response = sh.values_batch_get(ranges)
+            values = [value_range.get("values", []) for value_range in response["valueRanges"]]
+            record["rows"] = sum(len(rows) for rows in values)
+        tracing.count("sheets.calls")
+        tracing.count("sheets.bytes_in", len(json.dumps(response)))
+        tracing.count("sheets.rows_in", record["rows"])
+        return values
+
+    def _fetch(self, sh, cursor: int, *extra_ranges: str) -> list:
+        """
+        Header, rows past the cursor, extra_ranges and the manifest (if any) in one round trip.
+        Returns [header_values, new_values, *extra values]; the manifest lands in self.manifest.
+        """
+        if self.partitioned is None:
+            # Sheets set up before partitioning have no manifest tab; checked once per process
+            self.partitioned = MANIFEST_TAB in [ws.title for ws in sh.worksheets()]
+            tracing.count("sheets.calls")
+        ranges = ["Transactions!1:1", f"Transactions!A{cursor + 2}:Z", *extra_ranges]
+        if not self.partitioned:
+            return self._batch_values(sh, ranges)
+        *values, manifest_values = self._batch_values(sh, ranges + [MANIFEST_TAB])
+        self.manifest = parse_manifest(manifest_values)
+        return values
+
+    def _sync(self, sh, cached, header, cursor, header_values, new_values) -> pd.DataFrame:
+        """
+        Merges rows fetched past the cursor into the local cache.
+        """
+        live_header = header_values[0] if header_values else []
+        archived = int(self.manifest["Rows"].sum()) if self.manifest is not None else 0
+        if cursor and (live_header != header or archived != local_cache.archived_rows(self.cache_key)):
+            # Columns changed, or closed months were archived, since the last sync: the cursor is meaningless
+            local_cache.reset(self.cache_key)
+            cached, cursor = schema.empty_transactions(), 0
+            new_values, = self._batch_values(sh, ["Transactions!A2:Z"])
+
+        new_df, bad_rows = parse_transactions(live_header, new_values, first_row=cursor + 2)
+        # Bad rows are skipped past and never cached: keep reporting the ones this process has seen
+        if not cursor:
+            self.bad_rows = bad_rows
+        elif not bad_rows.empty:
+            self.bad_rows = pd.concat([self.bad_rows, bad_rows], ignore_index=True)
+        df = cached if new_df.empty and cursor else schema.concat([cached, new_df]) # Same frame when nothing changed
+        if local_cache.append_transactions(self.cache_key, live_header, new_df, cursor, cursor + len(new_values), archived):
+            self._synced = (df, live_header, cursor + len(new_values))
+        else:
+            self._synced = None # Another process moved the cursor: the next sync starts from what it stored
+        if self.on_sync:
+            self.on_sync(new_df, not cursor)
+        return df
+
+    def get_transactions(self) -> pd.DataFrame:
+        """
+        Serves the local cache and only downloads rows appended since the last sync.
+        Rows edited or deleted in the sheet are picked up by reset_cache().
+        """
+        with self._sync_lock:
+            cached, header, cursor = self._load_cached()
+            sh = self.open_spreadsheet()
+            if not sh: return cached # Offline: last synced copy is better than nothing
+
+            header_values, new_values = self._fetch(sh, cursor)
+            return self._sync(sh, cached, header, cursor, header_values, new_values)
+
+    def get_budget_rules(self) -> pd.DataFrame:
+        sh = self.open_spreadsheet()
+        if not sh: return pd.DataFrame()
+        rules_values, = self._batch_values(sh, ["Budget_Rules"])
+        return parse_rules(rules_values)
+
+    def load_data(self) -> tuple:
+        """
+        Fetches (transactions, budget_rules) with a single values_batch_get round trip.
+        """
+        with self._sync_lock:
+            cached, header, cursor = self._load_cached()
+            sh = self.open_spreadsheet()
+            if not sh: return cached, pd.DataFrame()
+
+            header_values, new_values, rules_values = self._fetch(sh, cursor, "Budget_Rules")
+            df = self._sync(sh, cached, header, cursor, header_values, new_values)
+        return df, parse_rules(rules_values)
+
+    def get_partition(self, year: int, month: int) -> pd.DataFrame:
+        """
+        Transactions of one archived month, read on demand from its tab.
+        """
+        sh = self.open_spreadsheet()
+        if not sh: return schema.empty_transactions()
+        values, = self._batch_values(sh, [f"{PARTITION_PREFIX}{year:04d}_{month:02d}"])
+        return parse_transactions(values[0] if values else [], values[1:])[0]
+
+    def get_archive(self, months: list) -> pd.DataFrame:
+        """
+        The archived ones among months, read in one round trip; the manifest tells which exist.
+        """
+        if self.manifest is None and self.partitioned is not False:
+            self.get_transactions() # Picks up the manifest
+        if self.manifest is None or self.manifest.empty:
+            return schema.empty_transactions()
+        archived = set(zip(self.manifest["Year"], self.manifest["Month"]))
+        titles = [f"{PARTITION_PREFIX}{year:04d}_{month:02d}" for year, month in months if (year, month) in archived]
+        sh = self.open_spreadsheet()
+        if not titles or not sh:
+            return schema.empty_transactions()
+        return schema.concat([
+            parse_transactions(values[0] if values else [], values[1:])[0] for values in self._batch_values(sh, titles)
+        ])
+
+    def append_rows(self, rows: list):
+        sh = self.open_spreadsheet()
+        if not sh:
+            raise ConnectionError("Google Sheets client unavailable")
+        with tracing.span("sheets.append_rows", rows=len(rows)):
+            sh.worksheet("Transactions").append_rows(rows) # quota.QuotaClient caches the worksheet handle
+        tracing.count("sheets.calls")
+        tracing.count("sheets.bytes_out", len(json.dumps(rows, default=str)))
+        tracing.count("sheets.rows_out", len(rows))
+
+    def get_rollup(self) -> pd.Series:
+        # Active rows are rolled up by local_cache on every sync, archived months come from the manifest
+        if self.manifest is None and self.partitioned is not False:
+            self.get_transactions() # Manifest and local cache must describe the same split
+        return budget_logic.merge_rollups(manifest_rollup(self.manifest), local_cache.load_rollup(self.cache_key))
+
+    def cached_transactions(self) -> pd.DataFrame:
+        synced = self._synced
+        return synced[0] if synced else local_cache.load_transactions(self.cache_key)[0]
+
+    def reset_cache(self):
+        with self._sync_lock:
+            local_cache.reset(self.cache_key)
+            self._synced = None
+        self.bad_rows = schema.empty_bad_rows()
+        self.partitioned = None # Picks up a manifest tab created since
+
+    def nbytes(self) -> int:
+        synced = self._synced
+        return int(synced[0].memory_usage(deep=True).sum()) if synced else 0
+
+    def release(self):
+        with self._sync_lock:
+            self._synced = None
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Local single-file engine for heavy users and offline benchmarks.
+    Dates are stored as ISO text so the Date index also sorts chronologically.
+    """
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS transactions (
+                    Date TEXT, Amount REAL, Currency TEXT, Category TEXT,
+                    Description TEXT, Amount_EUR REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (Date);
+                CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions (Category, Date);
+                CREATE TABLE IF NOT EXISTS budget_rules (
+                    Category TEXT PRIMARY KEY, Monthly_Limit REAL, Alert_Threshold REAL
+                );
+                CREATE TABLE IF NOT EXISTS rollup (
+                    Year INTEGER, Month INTEGER, Category TEXT, Amount_EUR REAL,
+                    PRIMARY KEY (Year, Month, Category)
+                );
+                -- Every insert keeps the month x category rollup current
+                CREATE TRIGGER IF NOT EXISTS trg_transactions_rollup
+                AFTER INSERT ON transactions WHEN NEW.Date IS NOT NULL
+                BEGIN
+                    INSERT INTO rollup VALUES (
+                        CAST(strftime('%Y', NEW.Date) AS INTEGER),
+                        CAST(strftime('%m', NEW.Date) AS INTEGER),
+                        COALESCE(NEW.Category, ''),
+                        COALESCE(NEW.Amount_EUR, 0)
+                    )
+                    ON CONFLICT (Year, Month, Category) DO UPDATE SET Amount_EUR = Amount_EUR + excluded.Amount_EUR;
+                END;
+            """)
+            if not conn.execute("SELECT 1 FROM rollup LIMIT 1").fetchone():
+                # Databases created before the trigger existed
+                conn.execute("""
+                    INSERT INTO rollup
+                    SELECT CAST(strftime('%Y', Date) AS INTEGER), CAST(strftime('%m', Date) AS INTEGER),
+                           COALESCE(Category, ''), SUM(COALESCE(Amount_EUR, 0))
+                    FROM transactions WHERE Date IS NOT NULL GROUP BY 1, 2, 3
+                """)
+            if not conn.execute("SELECT COUNT(*) FROM budget_rules").fetchone()[0]:
+                conn.executemany("INSERT INTO budget_rules VALUES (?, ?, ?)", DEFAULT_RULES)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # One transaction, then the connection is closed (sqlite3's own context manager only commits)
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_transactions(self, start=None, end=None, category: str = None) -> pd.DataFrame:
+        """
+        All transactions, or an indexed slice by date range [start, end) and category.
+        """
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("Date >= ?")
+            params.append(str(pd.Timestamp(start).date()))
+        if end is not None:
+            clauses.append("Date < ?")
+            params.append(str(pd.Timestamp(end).date()))
+        if category is not None:
+            clauses.append("Category = ?")
+            params.append(category)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with self._connect() as conn:
+            df = pd.read_sql(f"SELECT * FROM transactions{where} ORDER BY rowid", conn, params=params)
+        df, self.bad_rows = schema.from_frame(df)
+        return df
+
+    def get_budget_rules(self) -> pd.DataFrame:
+        with self._connect() as conn:
+            return pd.read_sql("SELECT * FROM budget_rules ORDER BY rowid", conn)
+
+    def get_rollup(self) -> pd.Series:
+        with self._connect() as conn:
+            df = pd.read_sql("SELECT * FROM rollup", conn)
+        return df.set_index(budget_logic.ROLLUP_KEYS)["Amount_EUR"].sort_index()
+
+    def append_rows(self, rows: list):
+        with self._connect() as conn:
+            conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?)", rows)
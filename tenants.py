@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import tracing
+from dataset_cache import DerivedCache
+
+# Bytes the cached datasets of all tenants may take together before the least recently used are dropped
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+def load_routes(path: str) -> dict:
+    """
+    Tenant id -> spreadsheet title from a JSON object file; {} when there is no file.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        routes = json.load(f)
+    if not isinstance(routes, dict):
+        raise ValueError(f"{path} must map tenant ids to spreadsheet titles")
+    return {str(tenant): str(title) for tenant, title in routes.items()}
+
+
+def tenant_file(name: str, tenant_id: str, default: str) -> str:
+    """
+    Per-tenant variant of a local file name (journal, database); the default tenant keeps `name`.
+    """
+    if tenant_id == default:
+        return name
+    stem, ext = os.path.splitext(name)
+    # Tenant ids come from configuration, not from the file system: hash them into safe names
+    return f"{stem}-{hashlib.sha1(tenant_id.encode()).hexdigest()[:12]}{ext}"
+
+
+class Tenant:
+    """
+    One hosted budget: its storage backend, dataset cache, values derived from its data
+    and transaction snapshots, plus the write-behind queue and alert engine, which are
+    created on first use.
+    """
+
+    def __init__(self, tenant_id: str, sheet_name: str, backend, datasets, snapshots=None):
+        self.id = tenant_id
+        self.sheet_name = sheet_name
+        self.backend = backend
+        self.datasets = datasets
+        self.derived = DerivedCache() # Indexes, daily totals, forecasts and API responses of recent versions
+        self.snapshots = snapshots # SnapshotStore, or None to share plain frames
+        self.view = None # (synced frame, pending journal ids, in-memory overlay, its bytes)
+        self.dashboard_key = None # Data version of the last saved dashboard snapshot
+        self.queue = None
+        self.alerts = None
+        self.reports = None # Latest ReportJob
+        self.lock = threading.RLock() # Guards the lazily created parts
+
+
+def _nbytes(tenant: Tenant) -> int:
+    view = tenant.view[3] if tenant.view else 0
+    synced = tenant.backend.nbytes() if tenant.backend else 0 # The backend's last synced frame
+    return tenant.datasets.nbytes() + tenant.derived.nbytes() + view + synced
+
+
+class TenantPool:
+    """
+    Tenants of this process in least-recently-used order.
+    Tenants share the process (one authorized client, one quota); their cached
+    datasets, derived values and synced frames share one memory budget: trim() drops those of the tenants
+    used longest ago until the total fits in max_bytes. A dropped tenant keeps its
+    backend, journal and alert state and reloads from the local cache on its next visit.
+    """
+
+    def __init__(self, factory, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.factory = factory # tenant id -> Tenant
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._tenants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id: str) -> Tenant:
+        with self._lock:
+            tenant = self._tenants.get(tenant_id)
+            if tenant is None:
+                tenant = self._tenants[tenant_id] = self.factory(tenant_id)
+            self._tenants.move_to_end(tenant_id)
+            return tenant
+
+    def trim(self) -> int:
+        """
+        Drops least recently used tenants' cached data until all fits in max_bytes and
+        returns the bytes freed. The most recent tenant is never trimmed.
+        """
+        with self._lock:
+            tenants = list(self._tenants.values())
+        sizes = [_nbytes(tenant) for tenant in tenants]
+        excess = sum(sizes) - self.max_bytes
+        freed = 0
+        for tenant, size in zip(tenants[:-1], sizes):
+            if freed >= excess:
+                break
+            if size:
+                tenant.datasets.clear()
+                tenant.derived.clear()
+                tenant.view = None
+                if tenant.backend:
+                    tenant.backend.release()
+                freed += size
+                self.evictions += 1
+                tracing.count("tenants.evicted")
+        return freed
+
+    def status(self) -> dict:
+        with self._lock:
+            tenants = list(self._tenants.values())
+        return {
+            "tenants": len(tenants),
+            "cached_bytes": sum(_nbytes(tenant) for tenant in tenants),
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
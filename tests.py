@@ -1,6 +1,45 @@
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
 import unittest
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import uvicorn
+import numpy as np
 import pandas as pd
-from budget_logic import calculate_burn_rate, normalize_currency, check_category_limits, TOTAL_BUDGET
+import benchmark
+import alerts
+import api_server
+import browser
+import budget_logic
+import dashboard_snapshot
+import data_manager
+import forecast
+import import_statement
+import local_cache
+import partitions
+import quota
+import reports
+import schema
+import setup_sheet
+import tenants
+import tracing
+from fake_sheets import FakeClient, FakeWorksheet
+from storage import SheetsBackend, SQLiteBackend, DEFAULT_RULES, TRANSACTION_HEADER
+from write_queue import WriteQueue
+from dataset_cache import DatasetCache
+from budget_logic import (
+    calculate_burn_rate, normalize_currency, check_category_limits, TOTAL_BUDGET,
+    build_rollup, update_rollup, convert_to_eur, reprice_transactions, evaluate_category_limits, money,
+    lttb, spending_trend, burn_rate_history, burn_rate_as_of,
+)
 
 class TestBudgetLogic(unittest.TestCase):
 
@@ -12,6 +51,30 @@ class TestBudgetLogic(unittest.TestCase):
         # Unknown currency fallback
         self.assertEqual(normalize_currency(50, "XYZ"), 50.0)
 
+    def test_vectorized_conversion_uses_rate_as_of_date(self):
+        rate_table = pd.DataFrame({
+            "Date": pd.to_datetime(["2024-01-01", "2024-06-01"]),
+            "Currency": ["CZK", "CZK"],
+            "Rate_EUR": [0.040, 0.050]
+        })
+        converted = convert_to_eur(
+            [1000, 1000, 1000, 1000, 50],
+            ["CZK", "CZK", "CZK", "CZK", "XYZ"],
+            ["2023-12-31", "2024-05-31", "2024-06-01", None, "2024-06-01"],
+            rate_table=rate_table
+        )
+        # Before the table starts and undated rows use the fixed rate; unknown currency stays 1:1
+        self.assertEqual(converted.tolist(), [40.0, 40.0, 50.0, 40.0, 50.0])
+
+    def test_reprice_matches_scalar_conversion(self):
+        df = pd.DataFrame({
+            "Date": pd.to_datetime(["2024-03-01", "2024-03-02"]),
+            "Amount": [1000.0, 20.0],
+            "Currency": ["CZK", "GBP"]
+        })
+        expected = [normalize_currency(1000, "CZK", "2024-03-01"), normalize_currency(20, "GBP", "2024-03-02")]
+        self.assertEqual(reprice_transactions(df).tolist(), expected)
+
     def test_burn_rate_calculation(self):
         # Mock dataframe
         data = {
@@ -63,5 +126,1004 @@ class TestBudgetLogic(unittest.TestCase):
         self.assertTrue(food_status["Remaining"] < 0)
         self.assertEqual(food_status["Status"], "Exceeded")
 
+    def test_multi_month_limits_with_alert_threshold(self):
+        df = pd.DataFrame({
+            "Date": pd.to_datetime(["2024-01-10", "2024-02-10", "2024-03-10"]),
+            "Category": ["Food", "Food", "Food"],
+            "Amount_EUR": [100.0, 280.0, 320.0]
+        })
+        rules_df = pd.DataFrame({"Category": ["Food", "Fun"], "Monthly_Limit": [300, 100], "Alert_Threshold": [270, 90]})
+
+        result = evaluate_category_limits(df, rules_df, start="2024-01", end="2024-03")
+        food = result[result["Category"] == "Food"]
+        self.assertEqual(len(result), 6) # 3 months x 2 categories
+        self.assertEqual(food["Status"].tolist(), ["OK", "Warning", "Exceeded"])
+        self.assertEqual(food["Remaining"].tolist(), [200.0, 20.0, -20.0])
+        self.assertEqual(result[result["Category"] == "Fun"]["Amount_EUR"].tolist(), [0.0, 0.0, 0.0])
+
+class TestSchema(unittest.TestCase):
+
+    def test_compact_frame_and_bad_rows(self):
+        header = ["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"]
+        df, bad = schema.from_rows(header, [
+            ["2024-03-01", "12.3", "CZK", "Food", "Lunch", "0.49"],
+            ["not a date", "5", "EUR", "Fun", "", "5"],
+            ["", "", "", "", "", ""], # Blank rows are skipped, not reported
+            ["2024-03-02", "abc", "EUR", "Fun", "", "5"],
+            ["03/04/2024", "7", "EUR", "Fun", "", "7"], # Non-ISO dates still parse
+        ])
+        self.assertEqual(df["Amount_Cents"].tolist(), [1230, 700])
+        self.assertEqual(df["Amount_EUR_Cents"].tolist(), [49, 700])
+        self.assertIsInstance(df["Category"].dtype, pd.CategoricalDtype)
+        self.assertEqual(bad.to_dict("list"), {"Row": [3, 5], "Reason": ["invalid Date", "invalid Amount"]})
+        self.assertEqual(schema.to_display(df)["Amount_EUR"].tolist(), [0.49, 7.0])
+
+    def test_budget_logic_does_not_mutate_input(self):
+        today = pd.Timestamp.today().strftime("%Y-%m-%d")
+        df = pd.DataFrame({"Date": [today], "Amount_EUR": [5.0]})
+        stats = calculate_burn_rate(df, limit=100)
+        self.assertEqual(stats["total_spent"], 5.0)
+        self.assertEqual(df["Date"].tolist(), [today])
+
+        compact, _ = schema.from_rows(["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"],
+                                      [[today, "0.1", "EUR", "Food", "", "0.1"]] * 3)
+        self.assertEqual(calculate_burn_rate(compact, limit=100)["total_spent"], 0.3)
+        self.assertEqual(build_rollup(compact).tolist(), [0.3])
+
+class TestBurnRateHistory(unittest.TestCase):
+
+    def test_every_day_from_one_pass(self):
+        df = pd.DataFrame({
+            "Date": pd.to_datetime(["2024-02-01", "2024-02-10", "2024-02-10", "2024-03-05"]),
+            "Amount_EUR": [100.0, 850.0, 10.0, 5.0],
+        })
+        history = burn_rate_history(df, 1000, start="2024-02", end="2024-03")
+        self.assertEqual(len(history), 29 + 31)
+        self.assertEqual(history.loc["2024-02-09", "total_spent"], 100.0)
+        self.assertEqual(history.loc["2024-02-10", "status"], "WARNING")
+        self.assertEqual(history.loc["2024-03-01", "total_spent"], 0.0) # New month starts from zero
+        self.assertEqual(history.loc["2024-03-05", "daily_limit"], round(995 / 26, 2))
+
+    def test_as_of_today_matches_calculate_burn_rate(self):
+        today = pd.Timestamp.today().normalize()
+        df = pd.DataFrame({"Date": [today.replace(day=1), today], "Amount_EUR": [120.0, 30.5]})
+        self.assertEqual(burn_rate_as_of(df, today, limit=500), calculate_burn_rate(df, limit=500))
+
+class TestSpendingTrend(unittest.TestCase):
+
+    def test_lttb_keeps_endpoints_and_spikes(self):
+        y = np.zeros(1000)
+        y[417] = 50.0
+        keep = lttb(np.arange(1000), y, 20)
+        self.assertEqual(len(keep), 20)
+        self.assertEqual((keep[0], keep[-1]), (0, 999))
+        self.assertIn(417, keep)
+
+    def test_resolution_window_and_point_budget(self):
+        df = benchmark.generate_transactions(5000, seed=1, start="2023-01-01", days=730)
+        weekly = spending_trend(df, "Week", "2023-03-01", "2023-03-31")
+        in_window = df[(df["Date"] >= "2023-03-01") & (df["Date"] <= "2023-03-31")]
+        self.assertAlmostEqual(weekly["Amount_EUR"].sum(), money(in_window).sum(), places=6)
+        self.assertEqual(len(weekly), 5)
+
+        daily = spending_trend(df, "Day", max_points=50)
+        self.assertEqual(len(daily), 50) # 730 days in, constant-size payload out
+        self.assertEqual(daily["Date"].iloc[0], df["Date"].min())
+
+    def test_new_version_when_amounts_swap_days(self):
+        dates = pd.to_datetime(["2024-03-01", "2024-03-02"])
+        before = pd.DataFrame({"Date": dates, "Category": ["Food", "Food"], "Amount_EUR": [10.0, 20.0]})
+        after = pd.DataFrame({"Date": dates, "Category": ["Food", "Food"], "Amount_EUR": [20.0, 10.0]})
+        self.assertEqual(spending_trend(before)["Amount_EUR"].tolist(), [10.0, 20.0])
+        self.assertEqual(spending_trend(after)["Amount_EUR"].tolist(), [20.0, 10.0])
+
+class TestForecast(unittest.TestCase):
+
+    def setUp(self):
+        forecast._forecast_cache.clear()
+        # Rent on the 28th of Jan-Mar, 10 EUR of food daily, 30 EUR of fun every Saturday
+        days = pd.date_range("2024-01-01", "2024-04-10")
+        saturdays = days[days.weekday == 5]
+        rent = pd.to_datetime(["2024-01-28", "2024-02-27", "2024-03-28"])
+        self.df = schema.from_frame(pd.DataFrame({
+            "Date": [*days, *saturdays, *rent],
+            "Amount": [10.0] * len(days) + [30.0] * len(saturdays) + [600.0, 610.0, 605.0],
+            "Currency": "EUR",
+            "Category": ["Food"] * len(days) + ["Fun"] * len(saturdays) + ["Rent"] * 3,
+            "Description": "",
+            "Amount_EUR": [10.0] * len(days) + [30.0] * len(saturdays) + [600.0, 610.0, 605.0],
+        }))[0]
+
+    def test_recurring_weekday_projection(self):
+        result = forecast.forecast_month(self.df, as_of="2024-04-10").set_index("Category")
+        self.assertEqual(result.loc["Rent", "Recurring_Expected"], 605.0) # Not paid yet this month
+        self.assertEqual(result.loc["Rent", "Variable_Forecast"], 0.0) # Rent does not inflate the daily rate
+        self.assertAlmostEqual(result.loc["Food", "Projected"], 300.0, places=1)
+        # Only the Saturdays left in April (13, 20, 27) carry Fun spend, shrunk a little towards the flat rate
+        self.assertGreater(result.loc["Fun", "Variable_Forecast"], 75.0)
+        self.assertLess(result.loc["Fun", "Variable_Forecast"], 90.0)
+
+    def test_overruns_against_rules_and_cached_per_version(self):
+        rules = pd.DataFrame({
+            "Category": ["Food", "Rent", "Travel"], "Monthly_Limit": [250.0, 700.0, 100.0],
+            "Alert_Threshold": [200.0, 600.0, 80.0],
+        })
+        with mock.patch.object(forecast, "_compute", wraps=forecast._compute) as compute:
+            result = forecast.forecast_month(self.df, rules, as_of="2024-04-10")
+            forecast.forecast_month(self.df, rules, as_of="2024-04-10")
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(result["Status"].tolist(), ["Overrun", "At Risk", "OK"])
+        self.assertAlmostEqual(result["Projected_Overrun"].iloc[0], 50.0, places=1)
+        self.assertEqual(result["Projected"].iloc[2], 0.0) # Nothing spent, nothing forecast
+
+    def test_archived_months_and_short_histories(self):
+        # Closed months archived out of the active data still feed the rate and the recurring rent
+        archived = self.df["Date"] < "2024-04-01"
+        split = forecast.forecast_month(self.df[~archived], as_of="2024-04-10", history=self.df[archived])
+        pd.testing.assert_frame_equal(split, forecast.forecast_month(self.df, as_of="2024-04-10"))
+        self.assertEqual(forecast.history_months("2024-04-10"), [(2024, 1), (2024, 2), (2024, 3)])
+
+        # One big first purchase is not a daily rate
+        first = self.df.iloc[:1].assign(Amount_EUR_Cents=29000, Date=pd.Timestamp("2024-04-10"))
+        projected = forecast.forecast_month(first, as_of="2024-04-10")["Projected"].iloc[0]
+        self.assertLess(projected, 2 * 290)
+
+    def test_new_version_after_recategorizing(self):
+        rows = pd.DataFrame({"Date": pd.to_datetime(["2024-04-01", "2024-04-02"]), "Category": ["Food", "Fun"], "Amount_EUR": [10.0, 20.0]})
+        refiled = rows.assign(Category=["Fun", "Food"])
+        forecast.forecast_month(rows, as_of="2024-04-02")
+        result = forecast.forecast_month(refiled, as_of="2024-04-02").sort_values("Category")
+        self.assertEqual(result[["Category", "Spent"]].values.tolist(), [["Food", 20.0], ["Fun", 10.0]])
+
+class TestDashboardSnapshot(unittest.TestCase):
+
+    def test_round_trip_and_stale_layouts(self):
+        today = pd.Timestamp.today().normalize()
+        df = benchmark.generate_transactions(500, seed=3, start=str((today - pd.Timedelta(days=59)).date()), days=60)
+        rules = pd.DataFrame({"Category": ["Food", "Rent"], "Monthly_Limit": [300.0, 400.0], "Alert_Threshold": [270.0, 380.0]})
+        state = dashboard_snapshot.build(df, rules, limit=1000)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = f"{tmp}/dashboard.json"
+            dashboard_snapshot.save(path, state)
+            self.assertEqual(dashboard_snapshot.load(path), state)
+            self.assertEqual(state["stats"], calculate_burn_rate(df, limit=1000))
+            self.assertEqual(state["categories"]["Category"], ["Food", "Rent"])
+            self.assertEqual(len(state["recent"]["Date"]), 10)
+
+            dashboard_snapshot.save(path, dict(state, version=0)) # Written by an older layout
+            self.assertIsNone(dashboard_snapshot.load(path))
+            self.assertIsNone(dashboard_snapshot.load(f"{tmp}/missing.json"))
+
+    def test_data_manager_defers_sheets_imports(self):
+        # The first paint must not wait for gspread / google-auth
+        code = "import sys, data_manager; print('gspread' in sys.modules, 'google.oauth2' in sys.modules)"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.stdout.split(), ["False", "False"])
+
+class TestReports(unittest.TestCase):
+
+    def setUp(self):
+        self.df = benchmark.generate_transactions(400, seed=5, start="2024-01-01", days=90)
+        self.rules = pd.DataFrame({"Category": ["Food"], "Monthly_Limit": [50.0], "Alert_Threshold": [40.0]})
+
+    def test_aggregate_slices_one_rollup_per_month(self):
+        payloads = reports.aggregate(self.df, self.rules, None, ["2024-02", "2024-01"], limit=800)
+        self.assertEqual(list(payloads), ["2024-01", "2024-02"])
+        january = payloads["2024-01"]
+        spent = self.df[self.df["Date"].dt.month == 1]
+        self.assertAlmostEqual(january["total"], money(spent).sum(), places=1)
+        self.assertAlmostEqual(sum(amount for _, amount in january["daily"]), january["total"], places=1)
+        food = next(category for category in january["categories"] if category["Category"] == "Food")
+        self.assertEqual(food["Status"], "Exceeded")
+        self.assertTrue(all(category["Status"] == "No limit" for category in january["categories"] if category is not food))
+        json.dumps(payloads) # Plain data: cheap to send to the workers
+
+    def test_renders_in_pool_and_caches_by_data_version(self):
+        renderer = reports.ReportRenderer(max_workers=1)
+        self.addCleanup(renderer.shutdown)
+        payloads = reports.aggregate(self.df, self.rules, None, ["2024-01", "2024-02"])
+        with tempfile.TemporaryDirectory() as tmp:
+            job = renderer.submit(payloads, tmp, "pdf")
+            deadline = time.time() + 60
+            while not job.done and time.time() < deadline:
+                time.sleep(0.1)
+            self.assertEqual(job.progress(), (2, 2))
+            self.assertEqual(job.errors, {})
+            with open(job.paths["2024-01"], "rb") as f:
+                self.assertEqual(f.read(4), b"%PDF")
+
+            # Only the month whose data changed is rendered again
+            payloads["2024-02"] = dict(payloads["2024-02"], limit=500.0)
+            with mock.patch.object(renderer, "_executor", wraps=renderer._executor) as executor:
+                again = renderer.submit(payloads, tmp, "pdf")
+                while not again.done and time.time() < deadline:
+                    time.sleep(0.1)
+            self.assertEqual(executor.call_count, 1)
+            self.assertEqual(again.paths["2024-01"], job.paths["2024-01"])
+            self.assertNotEqual(again.paths["2024-02"], job.paths["2024-02"])
+            self.assertEqual(sorted(os.listdir(tmp)), sorted(os.path.basename(path) for path in again.paths.values()))
+
+    def test_broken_pool_is_replaced(self):
+        renderer = reports.ReportRenderer(max_workers=1)
+        self.addCleanup(renderer.shutdown)
+        payloads = reports.aggregate(self.df, self.rules, None, ["2024-01"])
+        with tempfile.TemporaryDirectory() as tmp:
+            deadline = time.time() + 60
+            for limit in (800.0, 500.0):
+                job = renderer.submit({"2024-01": dict(payloads["2024-01"], limit=limit)}, tmp, "pdf")
+                while not job.done and time.time() < deadline:
+                    time.sleep(0.1)
+                self.assertEqual((job.progress(), job.errors), ((1, 1), {}))
+                for process in list(renderer._pool._processes.values()):
+                    process.kill() # A worker dies, e.g. out of memory
+                    process.join()
+
+    def test_sweep_keeps_other_formats_and_in_flight_files(self):
+        renderer = reports.ReportRenderer(max_workers=1)
+        self.addCleanup(renderer.shutdown)
+        payloads = reports.aggregate(self.df, self.rules, None, ["2024-01"])
+        with tempfile.TemporaryDirectory() as tmp:
+            in_flight = os.path.join(tmp, "report-2024-01-000000000000.pdf.tmp") # Another render still writing
+            open(in_flight, "w").close()
+            deadline = time.time() + 60
+            paths = []
+            for fmt in ("pdf", "png"):
+                job = renderer.submit(payloads, tmp, fmt)
+                while not job.done and time.time() < deadline:
+                    time.sleep(0.1)
+                self.assertEqual(job.errors, {})
+                paths.append(job.paths["2024-01"])
+            self.assertTrue(all(os.path.exists(path) for path in paths))
+            self.assertTrue(os.path.exists(in_flight))
+
+class TestTransactionBrowser(unittest.TestCase):
+
+    def setUp(self):
+        self.df = benchmark.generate_transactions(3000, seed=3)
+        self.index = browser.TransactionIndex(self.df)
+
+    def test_keyset_pages_match_full_sort(self):
+        expected = self.df[self.df["Category"] == "Fun"].sort_values("Date", ascending=False, kind="stable")
+        seen, cursor = [], None
+        while True:
+            page, cursor = self.index.page(category="Fun", after=cursor, limit=50)
+            seen.extend(page["Date"])
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), len(expected))
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_combined_filters_and_text_prefix(self):
+        df = schema.concat([self.df, schema.from_rows(
+            ["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"],
+            [["2023-05-02", "80", "PLN", "Travel", "Train to Krakow", "18.4"],
+             ["2023-05-03", "12", "PLN", "Food", "Krakow pierogi", "2.76"]],
+        )[0]])
+        index = browser.TransactionIndex(df)
+        page, cursor = index.page(text="krak", currency="PLN", start="2023-05-01", end="2023-05-02")
+        self.assertEqual(page["Description"].tolist(), ["Train to Krakow"])
+        self.assertIsNone(cursor)
+        self.assertEqual(len(index.page(text="krakow")[0]), 2)
+        self.assertTrue(index.page(text="nowhere")[0].empty)
+
+    def test_index_cache_never_serves_another_versions_rows(self):
+        header = ["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"]
+        rent, _ = schema.from_rows(header, [["2026-10-01", "380", "EUR", "Rent", "Rent", "380"]])
+        other, _ = schema.from_rows(header, [["2026-10-01", "380", "EUR", "Rent", "Deposit", "380"]])
+        self.assertEqual(browser.get_index(rent).page()[0]["Description"].tolist(), ["Rent"])
+        self.assertEqual(browser.get_index(other).page()[0]["Description"].tolist(), ["Deposit"]) # Same date and amount
+
+        refiled, _ = schema.from_rows(header, [["2026-10-01", "380", "EUR", "Other", "Rent", "380"]])
+        self.assertEqual(browser.get_index(refiled).page(category="Other")[0]["Category"].tolist(), ["Other"])
+
+class TestRollup(unittest.TestCase):
+
+    def setUp(self):
+        today = pd.Timestamp.today().normalize()
+        self.df = pd.DataFrame({
+            "Date": [today, today, today - pd.DateOffset(months=1)],
+            "Category": ["Food", "Fun", "Food"],
+            "Amount_EUR": [100.0, 50.0, 999.0]
+        })
+        self.rules = pd.DataFrame({"Category": ["Food", "Fun", "Rent"], "Monthly_Limit": [300, 40, 400]})
+
+    def test_incremental_matches_full_build(self):
+        rollup = update_rollup(build_rollup(self.df.iloc[:1]), self.df.iloc[1:])
+        pd.testing.assert_series_equal(rollup, build_rollup(self.df))
+
+    def test_answers_match_full_scan(self):
+        rollup = build_rollup(self.df)
+        self.assertEqual(calculate_burn_rate(self.df, rollup=rollup), calculate_burn_rate(self.df))
+        pd.testing.assert_frame_equal(
+            check_category_limits(self.df, self.rules, rollup=rollup),
+            check_category_limits(self.df, self.rules)
+        )
+
+    def test_sqlite_trigger_maintains_rollup(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SQLiteBackend(f"{tmp}/budget.sqlite")
+            backend.append_rows([["2024-03-01", 1, "EUR", "Food", "", 10.0], ["2024-03-09", 1, "EUR", "Food", "", 5.0]])
+            backend.append_rows([["2024-04-01", 1, "EUR", "Food", "", 7.0]])
+            self.assertEqual(backend.get_rollup().to_dict(), {(2024, 3, "Food"): 15.0, (2024, 4, "Food"): 7.0})
+
+class TestLocalCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(local_cache, "CACHE_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_incremental_append(self):
+        header = ["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"]
+        first, _ = schema.from_rows(header, [["2024-03-01", "10", "EUR", "Food", "Lunch", "10"]])
+        second, _ = schema.from_rows(header, [["2024-03-02", "5", "EUR", "Fun", "Cinema", "5"]])
+        local_cache.append_transactions("Sheet", header, first, 0, 1)
+        local_cache.append_transactions("Sheet", header, second, 1, 3) # One blank row skipped
+        # A second process (an import) synced the same rows first: nothing is stored twice
+        self.assertFalse(local_cache.append_transactions("Sheet", header, second, 1, 3))
+
+        df, cached_header, cursor = local_cache.load_transactions("Sheet")
+        self.assertEqual(cursor, 3)
+        self.assertEqual(cached_header, header)
+        self.assertEqual(list(df["Amount_EUR_Cents"]), [1000, 500])
+        self.assertEqual(df.dtypes.astype(str).to_dict(), {
+            "Date": "datetime64[ns]", "Amount_Cents": "int64", "Currency": "category",
+            "Category": "category", "Description": "str", "Amount_EUR_Cents": "int64",
+        })
+
+    def test_reset(self):
+        df, _ = schema.from_rows(["Date", "Amount", "Amount_EUR"], [["2024-03-01", "1", "1"]])
+        local_cache.append_transactions("Sheet", ["Date", "Amount", "Amount_EUR"], df, 0, 1)
+        local_cache.reset("Sheet")
+        df, header, cursor = local_cache.load_transactions("Sheet")
+        self.assertTrue(df.empty)
+        self.assertEqual(cursor, 0)
+
+    def test_content_key_index(self):
+        header = ["Date", "Amount", "Currency", "Category", "Description", "Amount_EUR"]
+        coffee = ["2024-03-01", "3", "EUR", "Food", "Coffee", "3"]
+        first, _ = schema.from_rows(header, [coffee, coffee])
+        second, _ = schema.from_rows(header, [coffee[:3] + ["Fun", " coffee "] + coffee[5:]]) # Same content, re-filed
+        local_cache.append_transactions("Sheet", header, first, 0, 2)
+        key = int(schema.row_keys(first)[0])
+        self.assertEqual(local_cache.key_counts("Sheet", [key, 42]), {key: 2})
+
+        # Caches synced before the index existed get it built from their rows
+        with local_cache._connect() as conn:
+            conn.execute(f"DROP TABLE {local_cache._table('Sheet', 'ck_')}")
+        local_cache.append_transactions("Sheet", header, second, 2, 3)
+        self.assertEqual(local_cache.key_counts("Sheet", [key]), {key: 3})
+
+    def test_claim_key(self):
+        self.assertTrue(local_cache.claim_key("k", ttl=60))
+        self.assertFalse(local_cache.claim_key("k", ttl=60))
+        self.assertTrue(local_cache.claim_key("k", ttl=0)) # Expired claims can be taken again
+        local_cache.release_key("k")
+        self.assertTrue(local_cache.claim_key("k", ttl=60))
+
+    def test_connections_closed_and_schema_created_once(self):
+        with mock.patch.object(local_cache, "_create_schema", wraps=local_cache._create_schema) as create:
+            local_cache.claim_key("a", ttl=60)
+            local_cache.claim_key("b", ttl=60)
+        self.assertEqual(create.call_count, 1)
+        with local_cache._connect() as conn:
+            pass
+        with self.assertRaises(sqlite3.ProgrammingError): # Closed on exit
+            conn.execute("SELECT 1")
+
+class FlakyWorksheet:
+    """Records append_rows batches; fails the first `failures` calls."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+
+    def append_rows(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("quota exceeded")
+        self.batches.append(rows)
+
+class TestAlertEngine(unittest.TestCase):
+
+    TODAY = "2024-05-10"
+
+    def frame(self, *rows):
+        return schema.from_frame(pd.DataFrame(
+            [[date, amount, "EUR", category, "", amount] for date, category, amount in rows],
+            columns=TRANSACTION_HEADER,
+        ))[0]
+
+    def setUp(self):
+        rules = pd.DataFrame({"Category": ["Food", "Fun"], "Monthly_Limit": [310.0, 100.0], "Alert_Threshold": [250.0, 50.0]})
+        self.engine = alerts.AlertEngine(rules)
+        # Fun is already past its threshold when the engine starts: that stays quiet
+        self.engine.seed(self.frame(("2024-05-02", "Food", 200.0), ("2024-05-03", "Fun", 60.0), ("2024-04-20", "Food", 500.0)), today=self.TODAY)
+
+    def test_threshold_then_limit_fire_once(self):
+        events = self.engine.observe(self.frame(("2024-05-09", "Food", 60.0)), today=self.TODAY)
+        self.assertEqual([(e["kind"], e["category"]) for e in events], [("threshold", "Food")])
+        self.assertEqual(self.engine.observe(self.frame(("2024-05-09", "Food", 1.0)), today=self.TODAY), [])
+        events = self.engine.observe(self.frame(("2024-05-09", "Food", 50.0), ("2024-04-01", "Fun", 900.0)), today=self.TODAY)
+        self.assertEqual([(e["kind"], e["category"]) for e in events], [("limit", "Food")]) # April rows never alert
+        self.assertEqual([e["seq"] for e in self.engine.events_since(1)], [2])
+
+    def test_pending_rows_count_once_and_pace(self):
+        # 110 left over 22 days is 5/day: 20 today is over the pace
+        events = self.engine.add_pending("a", self.frame(("2024-05-10", "Food", 20.0)), today=self.TODAY)
+        self.assertEqual([e["kind"] for e in events], ["pace"])
+        self.engine.settle([]) # Shipped...
+        self.engine.observe(self.frame(("2024-05-10", "Food", 20.0)), today=self.TODAY) # ...and synced back
+        self.assertEqual(self.engine.months[(2024, 5, "Food")], 220.0)
+        self.assertEqual(self.engine.days[(pd.Timestamp(self.TODAY).toordinal(), "Food")], 20.0)
+
+class TestWriteQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = f"{self.tmp.name}/journal.jsonl"
+
+    def test_batches_pending_rows(self):
+        queue = WriteQueue(self.path, batch_size=2)
+        for i in range(3):
+            queue.enqueue(["2024-03-01", i, "EUR", "Food", "", i])
+        ws = FlakyWorksheet()
+
+        self.assertEqual(queue.flush(lambda: ws), 3)
+        self.assertEqual([len(batch) for batch in ws.batches], [2, 1])
+        self.assertEqual(queue.status()["pending"], 0)
+
+    def test_failed_flush_survives_restart(self):
+        queue = WriteQueue(self.path)
+        queue.enqueue(["2024-03-01", 5, "EUR", "Food", "", 5])
+        with self.assertRaises(ConnectionError):
+            queue.flush(lambda: FlakyWorksheet(failures=1))
+
+        # A new process replays the journal and still owes the row
+        restarted = WriteQueue(self.path)
+        self.assertEqual(restarted.status()["pending"], 1)
+        ws = FlakyWorksheet()
+        restarted.flush(lambda: ws)
+        self.assertEqual(ws.batches, [[["2024-03-01", 5, "EUR", "Food", "", 5]]])
+        self.assertEqual(WriteQueue(self.path).status()["pending"], 0)
+
+def fake_backend():
+    """Sheets backend over an in-memory spreadsheet seeded by setup_sheet."""
+    client = FakeClient()
+    setup_sheet.setup_spreadsheet(client.create("Budget"))
+    sh = client.open("Budget")
+    return client, sh, SheetsBackend(lambda: sh, "Budget")
+
+class TestLoadData(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(local_cache, "CACHE_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client, self.sh, self.backend = fake_backend()
+        cache = DatasetCache(data_manager.DATASET_TTLS)
+        queue = WriteQueue(
+            f"{self.tmp.name}/journal.jsonl",
+            on_flush=lambda: cache.invalidate("transactions", "rollup", drop=True)
+        )
+        tenant = tenants.Tenant(data_manager.DEFAULT_TENANT, "Budget", self.backend, cache)
+        tenant.queue = queue
+        for patcher in (
+            mock.patch.object(data_manager, "get_tenant", return_value=tenant),
+            mock.patch.object(data_manager, "st"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_single_round_trip_then_incremental(self):
+        ws = self.sh.worksheet("Transactions")
+        ws.append_rows([["2024-03-01", 10, "EUR", "Food", "Lunch", 10]])
+        self.client.calls.clear()
+
+        df, rules = data_manager.load_data()
+        # Plus a one-off metadata call to find the partition manifest
+        self.assertEqual(self.client.calls, {"worksheets": 1, "values_batch_get": 1})
+        self.assertEqual(rules["Monthly_Limit"].tolist()[:2], [400, 300])
+        self.assertEqual(df["Amount_EUR_Cents"].tolist(), [1000])
+
+        ws.append_rows([["2024-03-02", 5, "EUR", "Fun", "Cinema", 5]])
+        self.client.calls.clear()
+        data_manager.load_data()
+        self.assertEqual(self.client.calls, {}) # Served from the dataset cache
+
+        data_manager.invalidate("transactions", drop=True)
+        with mock.patch.object(self.sh, "values_batch_get", wraps=self.sh.values_batch_get) as spy:
+            df, _ = data_manager.load_data()
+        # Only the appended row is requested the second time
+        self.assertEqual(spy.call_args[0][0], ["Transactions!1:1", "Transactions!A3:Z", "Partitions"])
+        self.assertEqual(df["Amount_EUR_Cents"].tolist(), [1000, 500])
+        self.assertEqual(self.backend.get_rollup().to_dict(), {(2024, 3, "Food"): 10.0, (2024, 3, "Fun"): 5.0})
+
+    def test_syncs_read_the_local_cache_only_when_cold(self):
+        ws = self.sh.worksheet("Transactions")
+        ws.append_rows([["2024-03-01", 10, "EUR", "Food", "Lunch", 10]])
+        importer = SheetsBackend(lambda: self.sh, "Budget") # Another process sharing the local cache
+        with mock.patch.object(local_cache, "load_transactions", wraps=local_cache.load_transactions) as reads:
+            first = self.backend.get_transactions()
+            self.assertIs(self.backend.get_transactions(), first) # Nothing new: the same frame
+            ws.append_rows([["2024-03-02", 5, "EUR", "Fun", "Cinema", 5]])
+            self.assertEqual(self.backend.get_transactions()["Amount_EUR_Cents"].tolist(), [1000, 500])
+            self.assertEqual(reads.call_count, 1)
+
+            ws.append_rows([["2024-03-03", 7, "EUR", "Fun", "Bowling", 7]])
+            importer.get_transactions() # Moves the shared cursor first
+            self.assertEqual(self.backend.get_transactions()["Amount_EUR_Cents"].tolist(), [1000, 500, 700])
+            self.assertEqual(self.backend.get_transactions()["Amount_EUR_Cents"].tolist(), [1000, 500, 700])
+            self.assertEqual(reads.call_count, 3) # Read back once after the conflict (the importer's cold start is the other)
+        self.assertGreater(self.backend.nbytes(), 0)
+
+    def test_flush_during_cold_load_is_not_overwritten(self):
+        load = self.backend.load_data
+        def load_then_flush():
+            result = load()
+            data_manager.get_dataset_cache().invalidate("transactions", "rollup", drop=True) # A flush lands meanwhile
+            return result
+        with mock.patch.object(self.backend, "load_data", side_effect=load_then_flush):
+            data_manager.load_data()
+        self.assertFalse(data_manager.get_dataset_cache().has("transactions")) # The next read loads again
+        self.assertTrue(data_manager.get_dataset_cache().has("budget_rules"))
+
+    def test_failed_load_keeps_the_saved_dashboard(self):
+        self.sh.worksheet("Transactions").append_rows([["2024-03-01", 10, "EUR", "Food", "Lunch", 10]])
+        df, rules = data_manager.load_data()
+        data_manager.save_dashboard(df, rules, None, 800)
+        saved = data_manager.last_dashboard()
+        data_manager.invalidate(drop=True)
+        with mock.patch.object(self.backend, "load_data", side_effect=ConnectionError("offline")):
+            df, rules = data_manager.load_data() # Falls back to the cached rows, without rules
+        data_manager.save_dashboard(df, rules, None, 800)
+        self.assertEqual(data_manager.last_dashboard(), saved)
+
+    def test_repeated_submits_save_once(self):
+        for _ in range(2): # Double click, or a rerun during a slow save
+            self.assertTrue(data_manager.add_transaction("2024-03-03", 4, "EUR", "Food", "Coffee", 4))
+        data_manager.add_transaction("2024-03-03", 9, "EUR", "Fun", "Bar", 9, key="form-1")
+        data_manager.add_transaction("2024-03-03", 9, "EUR", "Fun", "Bar", 9, key="form-1")
+        data_manager.add_transaction("2024-03-03", 9, "EUR", "Fun", "Bar", 9, key="form-2") # A second round, on purpose
+        self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [400, 900, 900])
+
+    def test_pending_rows_visible_before_flush(self):
+        self.assertTrue(data_manager.add_transaction("2024-03-03", 20, "EUR", "Food", "Dinner", 20))
+        self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [2000])
+        self.assertEqual(data_manager.flush_pending(), 1)
+        self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [2000])
+
+class TestTenants(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(local_cache, "CACHE_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.st = mock.MagicMock(query_params={})
+        pool = tenants.TenantPool(data_manager._make_tenant)
+        for patcher in (
+            mock.patch.object(data_manager, "get_routes", return_value={"ana-7f3": "Budget Ana", "ben-c21": "Budget Ben"}),
+            mock.patch.object(data_manager, "get_tenants", return_value=pool),
+            mock.patch.object(data_manager, "STORAGE_BACKEND", "fake"),
+            mock.patch.object(data_manager, "_fake_client", return_value=quota.QuotaClient(FakeClient(), rate=1000, burst=1000)),
+            mock.patch.object(WriteQueue, "start"), # Rows ship when a test flushes them
+            mock.patch.object(data_manager, "st", self.st),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sessions_only_see_their_budget(self):
+        self.assertIsNone(data_manager.current_tenant()) # No link parameter, no budget
+        for budget in ("ana-7f3", "ben-c21"):
+            self.st.query_params = {"budget": budget}
+            self.assertTrue(data_manager.add_transaction("2024-03-03", 4, "EUR", "Food", "Coffee", 4))
+            data_manager.flush_pending()
+        self.st.query_params = {"budget": "ana-7f3"}
+        data_manager.add_transaction("2024-03-04", 6, "EUR", "Fun", "Cinema", 6)
+        self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [400, 600])
+        self.st.query_params = {"budget": "ben-c21"}
+        self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [400])
+        self.assertEqual(data_manager.get_backend().sheet_name, "Budget Ben")
+        self.st.query_params = {"budget": "someone-else"}
+        self.assertIsNone(data_manager.current_tenant())
+
+    def test_sessions_share_one_snapshot_per_version(self):
+        self.st.query_params = {"budget": "ana-7f3"}
+        store = data_manager.get_tenant().snapshots
+        data_manager.add_transaction("2024-03-03", 4, "EUR", "Food", "Coffee", 4)
+        pending = data_manager.get_transactions()
+        self.assertIs(data_manager.get_transactions(), pending) # Another rerun reuses the same overlay
+        data_manager.add_transaction("2024-03-04", 6, "EUR", "Fun", "Cinema", 6)
+        self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [400, 600])
+        self.assertEqual(store.version, 0) # Adds stay in memory: nothing is rewritten on disk
+
+        self.assertEqual(data_manager.flush_pending(), 2)
+        synced = data_manager.get_transactions()
+        self.assertIs(data_manager.get_transactions(), synced) # Another rerun maps the same version
+        self.assertFalse(synced["Amount_EUR_Cents"].to_numpy().flags.writeable)
+        self.assertEqual((synced["Amount_EUR_Cents"].tolist(), store.version), ([400, 600], 1))
+        self.assertEqual(len(os.listdir(store.directory)), 1)
+        data_manager.invalidate("transactions", drop=True) # A sync that finds no new rows
+        self.assertIs(data_manager.get_transactions(), synced) # Nothing rewritten, nothing to rehash
+        self.assertEqual(store.version, 1)
+
+    def test_stale_datasets_revalidate_outside_the_session(self):
+        with data_manager.use_tenant("ben-c21"):
+            ws = data_manager.get_backend().open_spreadsheet().worksheet("Transactions")
+            ws.append_rows([["2024-03-01", 10, "EUR", "Food", "Lunch", 10]])
+            self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [1000])
+            ws.append_rows([["2024-03-02", 5, "EUR", "Fun", "Cinema", 5]])
+            data_manager.invalidate("transactions")
+            self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [1000]) # Stale, reloading
+            deadline = time.time() + 10
+            while data_manager.get_dataset_cache().status()["transactions"]["stale"] and time.time() < deadline:
+                time.sleep(0.01) # The reload runs in a thread without the use_tenant() context
+            self.assertEqual(data_manager.get_transactions()["Amount_EUR_Cents"].tolist(), [1000, 500])
+
+    def test_trim_drops_least_recently_used_datasets(self):
+        pool = tenants.TenantPool(lambda tenant_id: tenants.Tenant(tenant_id, tenant_id, None, DatasetCache({})))
+        frame = pd.DataFrame({"Amount_EUR_Cents": np.arange(1000, dtype=np.int64)})
+        for tenant_id in ("a", "b", "c", "a"): # "a" is the most recent again
+            pool.get(tenant_id).datasets.put("transactions", frame)
+        pool.max_bytes = 2 * pool.get("a").datasets.nbytes()
+        self.assertGreater(pool.trim(), 0)
+        self.assertEqual([pool.get(t).datasets.has("transactions") for t in "bca"], [False, True, True])
+        self.assertEqual(pool.status()["evictions"], 1)
+        self.assertEqual(pool.trim(), 0) # Already fits
+
+    def test_derived_values_are_per_tenant_and_counted(self):
+        pool = tenants.TenantPool(lambda tenant_id: tenants.Tenant(tenant_id, tenant_id, None, DatasetCache({})))
+        df = benchmark.generate_transactions(500, seed=4)
+        a, b = pool.get("a"), pool.get("b")
+        index = browser.get_index(df, a.derived)
+        self.assertIs(browser.get_index(df, a.derived), index)
+        self.assertIsNot(browser.get_index(df, b.derived), index) # Budgets never share indexes
+        self.assertEqual(pool.status()["cached_bytes"], 2 * index.nbytes())
+
+        pool.max_bytes = 0
+        pool.trim() # Only "b", the most recent, keeps its values
+        self.assertEqual(pool.status()["cached_bytes"], index.nbytes())
+
+        # Old versions are let go as new ones arrive
+        for seed in range(3):
+            budget_logic.daily_spend(benchmark.generate_transactions(10, seed=seed), b.derived)
+        self.assertEqual(len(b.derived._versions), b.derived.max_versions)
+
+class TestApiServer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(local_cache, "CACHE_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        _, _, backend = fake_backend()
+        tenant = tenants.Tenant(data_manager.DEFAULT_TENANT, "Budget", backend, DatasetCache(data_manager.DATASET_TTLS))
+        tenant.queue = WriteQueue(f"{self.tmp.name}/journal.jsonl") # Not started: rows stay pending
+        for patcher in (
+            mock.patch.object(data_manager, "get_tenant", return_value=tenant),
+            mock.patch.object(data_manager, "st"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        patcher = mock.patch.object(api_server, "_add_all", wraps=api_server._add_all)
+        self.add_all = patcher.start()
+        self.addCleanup(patcher.stop)
+        app = api_server.build_app(api_server.WriteBatcher(window=0.5)) # Wide enough for a slow test machine
+        server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+        self.addCleanup(setattr, server, "should_exit", True)
+        while not server.started:
+            time.sleep(0.01)
+
+    def request(self, method: str, path: str, payload=None) -> tuple:
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        try:
+            conn.request(method, path, json.dumps(payload) if payload is not None else None)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            conn.close()
+
+    def test_concurrent_posts_are_saved_in_one_batch(self):
+        coffee = {"date": "2024-03-03", "amount": 4, "category": "Food", "description": "Coffee"}
+        payloads = [coffee, coffee, dict(coffee, amount=200, currency="CZK", description="Bus")]
+        with ThreadPoolExecutor(3) as pool:
+            results = list(pool.map(lambda payload: self.request("POST", "/api/transactions", payload), payloads))
+        self.assertEqual([status for status, _ in results], [201, 201, 201])
+        self.assertEqual(self.add_all.call_count, 1) # One journal write for all three
+        status, body = self.request("GET", "/api/transactions?count=5")
+        self.assertEqual(sorted(row["Amount_EUR"] for row in body["transactions"]), [4.0, 8.0]) # The double submit saved once
+        self.assertEqual(self.request("GET", "/api/stats?limit=500")[1]["remaining"], 500.0) # March 2024 is not this month
+
+    def test_errors(self):
+        self.assertEqual(self.request("POST", "/api/transactions", {"amount": 4})[0], 400)
+        self.assertEqual(self.request("POST", "/api/transactions", {"amount": 4, "category": "Food", "currency": "XYZ"})[0], 400)
+        self.assertEqual(self.request("GET", "/api/stats?limit=lots")[0], 400)
+        self.assertEqual(self.request("GET", "/api/stats?budget=someone-else")[0], 404)
+
+    def test_responses_are_cached_per_version_on_the_tenant(self):
+        tenant = data_manager.get_tenant()
+        first = self.request("GET", "/api/stats?limit=500")[1]
+        self.assertEqual(self.request("GET", "/api/stats?limit=500")[1], first)
+        self.assertGreater(tenant.derived.nbytes(), 0) # Counted in the pool's memory cap
+        today = pd.Timestamp.today().strftime("%Y-%m-%d")
+        self.assertEqual(self.request("POST", "/api/transactions", {"date": today, "amount": 30, "category": "Food"})[0], 201)
+        self.assertEqual(self.request("GET", "/api/stats?limit=500")[1]["remaining"], first["remaining"] - 30) # New version
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(local_cache, "CACHE_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client, self.sh, self.backend = fake_backend()
+
+    def test_setup_creates_every_tab_once(self):
+        setup_sheet.setup_spreadsheet(self.sh) # Already set up: nothing is added twice
+        self.assertEqual([ws.title for ws in self.sh.worksheets()], ["Transactions", "Budget_Rules", "Partitions"])
+        self.assertEqual(self.sh.worksheet("Budget_Rules").get_all_values()[1:], [[str(v) for v in row] for row in DEFAULT_RULES])
+
+    def test_archive_then_read_active_partition_only(self):
+        ws = self.sh.worksheet("Transactions")
+        ws.append_rows([
+            ["2024-01-05", 10, "EUR", "Food", "", 10],
+            ["2024-02-01", 5, "EUR", "Fun", "", 5],
+            ["2024-03-03", 7, "EUR", "Food", "", 7],
+            ["2024-01-20", 3, "EUR", "Food", "", 3],
+        ])
+        self.assertEqual(len(self.backend.get_transactions()), 4)
+
+        with mock.patch.object(FakeWorksheet, "append_rows", autospec=True, side_effect=FakeWorksheet.append_rows) as appends, \
+                mock.patch.object(FakeWorksheet, "update", autospec=True, side_effect=FakeWorksheet.update) as updates:
+            moved = partitions.archive_closed_months(self.sh, before="2024-03")
+        self.assertEqual(moved, {"Transactions_2024_01": 2, "Transactions_2024_02": 1})
+        # Cells are moved as stored: Sheets must not re-parse descriptions or amounts
+        moves = appends.call_args_list + [call for call in updates.call_args_list if call.args[0].title == "Transactions"]
+        self.assertEqual({call.kwargs.get("value_input_option") for call in moves}, {"RAW"})
+        self.assertEqual(len(ws.get_all_values()), 2) # Header + the open month
+
+        # The archive invalidates the sync cursor; old months now come from the manifest
+        df = self.backend.get_transactions()
+        self.assertEqual(df["Amount_EUR_Cents"].tolist(), [700])
+        self.assertEqual(self.backend.get_rollup().to_dict(), {
+            (2024, 1, "Food"): 13.0, (2024, 2, "Fun"): 5.0, (2024, 3, "Food"): 7.0,
+        })
+        self.assertEqual(self.backend.get_partition(2024, 1)["Amount_EUR_Cents"].tolist(), [1000, 300])
+        # Months the forecast reads; ones never archived are skipped without a request
+        self.assertEqual(self.backend.get_archive([(2023, 12), (2024, 1), (2024, 2)])["Amount_EUR_Cents"].tolist(), [1000, 300, 500])
+
+    def test_late_rows_merge_into_existing_summary(self):
+        ws = self.sh.worksheet("Transactions")
+        ws.append_rows([["2024-01-05", 10, "EUR", "Food", "", 10]])
+        partitions.archive_closed_months(self.sh, before="2024-03")
+        ws.append_rows([["2024-01-09", 2.5, "EUR", "Food", "", 2.5]])
+        partitions.archive_closed_months(self.sh, before="2024-03")
+
+        self.assertEqual(self.sh.worksheet("Partitions").get_all_values()[1:], [
+            ["Transactions_2024_01", "2024", "1", "Food", "2", "12.5"],
+        ])
+        self.assertEqual(len(self.sh.worksheet("Transactions_2024_01").get_all_values()), 3)
+
+class HTTPError(Exception):
+    """Carries a status code like gspread.exceptions.APIError."""
+
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+class TestStatementImport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(local_cache, "CACHE_DIR", self.tmp.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client, self.sh, self.backend = fake_backend()
+
+    def write(self, name, text):
+        path = f"{self.tmp.name}/{name}"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def test_csv_chunks_batches_and_skips_existing(self):
+        self.sh.worksheet("Transactions").append_rows([["2024-03-01", 3.5, "EUR", "Food", "Cafe Slavia", 3.5]])
+        path = self.write("statement.csv", "Booking date;Payee;Amount;Currency\n"
+            "01.03.2024;Cafe Slavia;-3,50;EUR\n"    # already in the sheet
+            "01.03.2024;Cafe Slavia;-3,50;EUR\n"    # a second coffee that day is new
+            "02.03.2024;Salary;1.200,00;EUR\n"      # income, left out
+            "04.03.2024;Ryanair;-1.059,99;EUR\n"
+            "05.03.2024;Lidl;-250;CZK\n"
+            "xx;Broken;-1;EUR\n")
+        self.client.calls.clear()
+        stats = import_statement.import_statement(
+            self.sh, path, delimiter=";", decimal=",", dayfirst=True, chunk_rows=2, batch_rows=2, backend=self.backend,
+        )
+        # Existing rows come from the local key index after an incremental sync, not a download of the tab
+        self.assertEqual(self.client.calls, {"worksheets": 2, "worksheet": 1, "values_batch_get": 1, "append_rows": 2})
+        self.assertEqual(
+            {k: stats[k] for k in ("read", "invalid", "expenses", "duplicates", "imported", "append_calls")},
+            {"read": 6, "invalid": 1, "expenses": 4, "duplicates": 1, "imported": 3, "append_calls": 2},
+        )
+        rows = self.sh.worksheet("Transactions").get_all_values()[2:]
+        self.assertEqual([row[3] for row in rows], ["Food", "Travel", "Food"])
+        self.assertEqual(rows[1][:3], ["2024-03-04", "1059.99", "EUR"])
+        self.assertEqual(float(rows[2][5]), normalize_currency(250, "CZK", "2024-03-05"))
+        # Running it again writes nothing
+        again = import_statement.import_statement(self.sh, path, delimiter=";", decimal=",", dayfirst=True, backend=self.backend)
+        self.assertEqual(again["imported"], 0)
+
+    def test_ofx_and_camt_readers(self):
+        ofx = self.write("s.ofx", "<OFX><CURDEF>GBP\n<STMTTRN><DTPOSTED>20240305120000[0:GMT]<TRNAMT>-12.50"
+                                  "<NAME>Pizza Express</STMTTRN>\n<STMTTRN>\n<DTPOSTED>20240306\n<TRNAMT>100\n</STMTTRN></OFX>")
+        df, _ = import_statement.normalize(pd.concat(import_statement.read_ofx_chunks(ofx)))
+        self.assertEqual(schema.to_sheet_rows(df)[0][:5], ["2024-03-05", 12.5, "GBP", "Food", "Pizza Express"])
+
+        camt = self.write("s.xml", '<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02"><Stmt>'
+            '<Ntry><Amt Ccy="PLN">45.00</Amt><CdtDbtInd>DBIT</CdtDbtInd><BookgDt><Dt>2024-03-07</Dt></BookgDt>'
+            '<NtryDtls><TxDtls><RltdPties><Dbtr><Nm>Me</Nm></Dbtr><Cdtr><Nm>Biedronka</Nm></Cdtr></RltdPties>'
+            '<RmtInf><Ustrd>Groceries</Ustrd></RmtInf></TxDtls></NtryDtls></Ntry>'
+            '<Ntry><Amt Ccy="PLN">900</Amt><CdtDbtInd>CRDT</CdtDbtInd><BookgDt><Dt>2024-03-08</Dt></BookgDt></Ntry>'
+            '</Stmt></Document>')
+        chunks = list(import_statement.read_camt_chunks(camt, chunk_rows=1))
+        self.assertEqual(len(chunks), 2)
+        df, _ = import_statement.normalize(pd.concat(chunks))
+        self.assertEqual(schema.to_sheet_rows(df)[0][:5], ["2024-03-07", 45.0, "PLN", "Food", "Biedronka Groceries"])
+
+class TestQuota(unittest.TestCase):
+
+    def test_token_bucket_throttles_past_burst(self):
+        bucket = quota.TokenBucket(rate=100, capacity=2)
+        self.assertEqual([bucket.acquire(), bucket.acquire()], [0.0, 0.0])
+        self.assertAlmostEqual(bucket.acquire(), 0.01, delta=0.005)
+
+    def test_concurrent_identical_reads_coalesce(self):
+        coalescer = quota.Coalescer()
+        release, calls, results = threading.Event(), [], []
+        def slow_read():
+            calls.append(1)
+            release.wait(1)
+            return "values"
+
+        threads = [threading.Thread(target=lambda: results.append(coalescer.do("key", slow_read))) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["values"] * 3)
+
+    def test_retries_quota_errors_but_not_failed_writes(self):
+        client = quota.QuotaClient(FakeClient(), rate=1000, burst=10, base_delay=0)
+        answers = [HTTPError(429), HTTPError(503), "ok"]
+        def flaky():
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+        self.assertEqual(client.call(flaky, (), {}), "ok")
+
+        answers[:] = [HTTPError(503), "ok"]
+        with self.assertRaises(HTTPError): # The append may have landed: do not repeat it
+            client.call(flaky, (), {}, write=True)
+
+    def test_handles_are_cached(self):
+        fake = FakeClient()
+        setup_sheet.setup_spreadsheet(fake.create("Budget"))
+        client = quota.QuotaClient(fake, rate=1000, burst=10)
+        fake.calls.clear()
+        for _ in range(3):
+            client.open("Budget").worksheet("Transactions").append_rows([["2024-03-01", 1, "EUR", "Food", "", 1]])
+        self.assertEqual(fake.calls, {"open": 1, "worksheet": 1, "append_rows": 3})
+
+class TestDatasetCache(unittest.TestCase):
+
+    def wait_for_refresh(self, cache, key):
+        for _ in range(200):
+            if not cache.status()[key]["refreshing"]:
+                return
+            time.sleep(0.01)
+
+    def test_stale_while_revalidate(self):
+        cache = DatasetCache({"transactions": 60})
+        loads = []
+        def loader():
+            loads.append(1)
+            return len(loads)
+
+        self.assertEqual(cache.get("transactions", loader), 1)
+        self.assertEqual(cache.get("transactions", loader), 1) # Fresh: no reload
+
+        cache.invalidate("transactions")
+        self.assertEqual(cache.get("transactions", loader), 1) # Stale copy served instantly
+        self.wait_for_refresh(cache, "transactions")
+        self.assertEqual(cache.get("transactions", loader), 2)
+
+        cache.invalidate("transactions", drop=True)
+        self.assertEqual(cache.get("transactions", loader), 3) # Dropped: loads synchronously
+
+    def test_invalidation_only_touches_named_datasets(self):
+        cache = DatasetCache({})
+        cache.put("transactions", "tx")
+        cache.put("budget_rules", "rules")
+        cache.invalidate("transactions", drop=True)
+        self.assertFalse(cache.has("transactions"))
+        self.assertEqual(cache.get("budget_rules", lambda: "reloaded"), "rules")
+
+class TestSQLiteBackend(unittest.TestCase):
+
+    def test_indexed_slice(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SQLiteBackend(f"{tmp}/budget.sqlite")
+            backend.append_rows([
+                ["2024-02-28", 10.0, "EUR", "Food", "", 10.0],
+                ["2024-03-01", 20.0, "EUR", "Food", "", 20.0],
+                ["2024-03-02", 30.0, "EUR", "Fun", "", 30.0],
+            ])
+            df = backend.get_transactions(start="2024-03-01", end="2024-04-01", category="Food")
+            self.assertEqual(df["Amount_EUR_Cents"].tolist(), [2000])
+            self.assertEqual(len(backend.get_budget_rules()), 5)
+            with backend._connect() as conn:
+                plan = conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT * FROM transactions WHERE Category = ? AND Date >= ?",
+                    ("Food", "2024-03-01"),
+                ).fetchall()
+            self.assertIn("idx_transactions_category", str(plan))
+
+    def test_no_write_queue_for_direct_writes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tenant = tenants.Tenant(data_manager.DEFAULT_TENANT, "Budget", SQLiteBackend(f"{tmp}/budget.sqlite"), DatasetCache({}))
+            with mock.patch.object(data_manager, "get_tenant", return_value=tenant):
+                self.assertEqual(data_manager.get_sync_status()["pending"], 0)
+            self.assertIsNone(tenant.queue) # No journal file, no flusher thread
+
+class TestTracing(unittest.TestCase):
+
+    def test_spans_and_sheets_counters(self):
+        patcher = mock.patch.object(tracing, "_local", threading.local()) # Later tests on this thread see no trace
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(local_cache, "CACHE_DIR", tmp):
+            client, sh, backend = fake_backend()
+            trace = tracing.start_trace("test")
+            with tracing.span("outer"):
+                backend.load_data()
+
+        names = [span["name"] for span in trace.spans]
+        self.assertIn("sheets.values_batch_get", names)
+        self.assertEqual(trace.spans[-1]["name"], "outer")
+        self.assertTrue(all(span["parent"] == "outer" for span in trace.spans[:-1]))
+        self.assertEqual(trace.counters["sheets.calls"], 2) # Manifest lookup + one batch read
+        self.assertGreater(trace.counters["sheets.bytes_in"], 0)
+        self.assertIn('budget_span_seconds_count{span="outer"}', tracing.export_prometheus())
+
+class TestBenchmarkGenerator(unittest.TestCase):
+
+    def test_seeded_and_consistent(self):
+        df = benchmark.generate_transactions(2000, seed=7)
+        pd.testing.assert_frame_equal(df, benchmark.generate_transactions(2000, seed=7))
+        self.assertEqual(list(df.columns), schema.TRANSACTION_COLUMNS)
+        self.assertTrue(df["Date"].is_monotonic_increasing)
+        # Amount_EUR is what the app's own conversion would produce (within rounding)
+        reconverted = convert_to_eur(money(df, "Amount"), df["Currency"])
+        self.assertTrue(((reconverted - money(df)).abs() <= 0.05).all())
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,145 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-thread trace of the rerun in progress; process totals for Prometheus
+_local = threading.local()
+_lock = threading.Lock()
+_span_totals = {}     # name -> [count, seconds]
+_counter_totals = {}  # name -> value
+
+
+class Trace:
+    """
+    Spans, counters and errors collected during one unit of work (an app rerun).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.spans = []
+        self.counters = {}
+        self.errors = []
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "started": self.started,
+            "spans": self.spans,
+            "counters": self.counters,
+            "errors": self.errors,
+        }
+
+
+def start_trace(name: str = "rerun") -> Trace:
+    """
+    Starts collecting for the current thread, replacing any previous trace.
+    """
+    _local.trace = Trace(name)
+    _local.stack = []
+    return _local.trace
+
+
+def current_trace() -> Trace:
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Times a block. Yields a dict the block can add attributes to (e.g. rows).
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    record = dict(attrs)
+    stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        seconds = time.perf_counter() - start
+        stack.pop()
+        trace = current_trace()
+        if trace is not None:
+            trace.spans.append({
+                "name": name,
+                "parent": stack[-1] if stack else None,
+                "depth": len(stack),
+                "ms": round(seconds * 1000, 3),
+                **record,
+            })
+        with _lock:
+            totals = _span_totals.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+
+def traced(name: str = None):
+    """
+    Decorator form of span().
+    """
+    def decorator(fn):
+        span_name = name or f"{fn.__module__}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: float = 1):
+    """
+    Adds to a counter (Sheets calls, bytes, rows...) on the trace and process totals.
+    """
+    trace = current_trace()
+    if trace is not None:
+        trace.counters[name] = trace.counters.get(name, 0) + value
+    with _lock:
+        _counter_totals[name] = _counter_totals.get(name, 0) + value
+
+
+def record_error(where: str, error: Exception):
+    """
+    Keeps the console print, and makes the error visible in the trace.
+    """
+    print(f"{where} Error: {error}")
+    trace = current_trace()
+    if trace is not None:
+        trace.errors.append({"where": where, "error": str(error)})
+    count("errors")
+
+
+def export_json(trace: Trace = None) -> str:
+    trace = trace or current_trace()
+    return json.dumps(trace.as_dict() if trace else {}, indent=2, default=str)
+
+
+def _metric_name(name: str) -> str:
+    return "".join(ch if ch.isalnum() else "_" for ch in name)
+
+
+def export_prometheus() -> str:
+    """
+    Process-wide totals in the Prometheus text exposition format.
+    """
+    with _lock:
+        spans = dict(_span_totals)
+        counters = dict(_counter_totals)
+
+    lines = [
+        "# HELP budget_span_seconds Time spent in instrumented code paths.",
+        "# TYPE budget_span_seconds summary",
+    ]
+    for name, (calls, seconds) in sorted(spans.items()):
+        lines.append(f'budget_span_seconds_count{{span="{name}"}} {calls}')
+        lines.append(f'budget_span_seconds_sum{{span="{name}"}} {seconds:.6f}')
+    for name, value in sorted(counters.items()):
+        metric = f"budget_{_metric_name(name)}_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    return "\n".join(lines) + "\n"
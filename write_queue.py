@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import local_cache
+import tracing
+
+JOURNAL_FILE = "journal.jsonl"
+
+
+class WriteQueue:
+    """
+    Write-behind queue for new transaction rows.
+    Rows go to an append-only journal on disk first; a background thread ships
+    them to the sheet in batches and appends an ack record once they land.
+    """
+
+    def __init__(self, path: str = None, batch_size: int = 500,
+                 interval: float = 2.0, max_backoff: float = 300.0, on_flush=None):
+        self.path = path or os.path.join(local_cache.CACHE_DIR, JOURNAL_FILE)
+        self.on_flush = on_flush # Called after each batch lands, e.g. to invalidate caches
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.flushed = 0
+        self.last_error = None
+        self.last_flush = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock() # One flusher at a time, or rows ship twice
+        self._wake = threading.Event()
+        self._thread = None
+        self._pending = self._replay()
+
+    # --- Journal ---
+    def _replay(self) -> dict:
+        pending = {}
+        if not os.path.exists(self.path):
+            return pending
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # Torn last line from a crash mid-write
+                if record["op"] == "add":
+                    pending[record["id"]] = record["row"]
+                elif record["op"] == "ack":
+                    for txn_id in record["ids"]:
+                        pending.pop(txn_id, None)
+        return pending
+
+    def _append(self, *records: dict):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _compact(self):
+        # Everything is acked: start a fresh journal instead of growing forever
+        if not self._pending and os.path.exists(self.path):
+            os.remove(self.path)
+
+    # --- Public API ---
+    def enqueue(self, row: list) -> str:
+        """
+        Durably records a row and returns its journal id without touching the network.
+        """
+        return self.enqueue_many([row])[0]
+
+    def enqueue_many(self, rows: list) -> list:
+        """
+        enqueue() for several rows with a single journal write and fsync; returns their ids.
+        """
+        ids = [uuid.uuid4().hex for _ in rows]
+        with self._lock:
+            self._append(*({"op": "add", "id": txn_id, "row": row} for txn_id, row in zip(ids, rows)))
+            self._pending.update(zip(ids, rows))
+        self._wake.set()
+        return ids
+
+    def pending_rows(self) -> list:
+        with self._lock:
+            return list(self._pending.values())
+
+    def pending_items(self) -> dict:
+        """
+        Journal id -> row for every row not yet acked.
+        """
+        with self._lock:
+            return dict(self._pending)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "flushed": self.flushed,
+                "last_error": self.last_error,
+                "last_flush": self.last_flush,
+            }
+
+    def flush(self, get_target) -> int:
+        """
+        Ships pending rows with one append_rows call per batch.
+        get_target() returns anything with append_rows (a worksheet or storage backend).
+        Returns the number of rows written; raises if the sheet call fails.
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = list(self._pending.items())[:self.batch_size]
+                if not batch:
+                    return written
+
+                target = get_target()
+                if target is None:
+                    raise ConnectionError("Google Sheets client unavailable")
+                target.append_rows([row for _, row in batch])
+
+                with self._lock:
+                    self._append({"op": "ack", "ids": [txn_id for txn_id, _ in batch]})
+                    for txn_id, _ in batch:
+                        self._pending.pop(txn_id, None)
+                    self.flushed += len(batch)
+                    self.last_flush = time.time()
+                    self.last_error = None
+                    self._compact()
+                written += len(batch)
+                if self.on_flush:
+                    self.on_flush()
+
+    def start(self, get_target):
+        """
+        Starts the background flusher (idempotent).
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, args=(get_target,), name="write-queue", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, get_target):
+        backoff = self.interval
+        while True:
+            self._wake.wait(timeout=backoff)
+            self._wake.clear()
+            try:
+                self.flush(get_target)
+                backoff = self.interval
+            except Exception as e:
+                # Rows stay in the journal; retry with exponential backoff
+                self.last_error = str(e)
+                tracing.record_error("Flush", e)
+                backoff = min(backoff * 2, self.max_backoff)